@@ -5,10 +5,13 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # Add current directory to path (for 'routing_core' sibling module)
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS 
-from routing_core import get_routes_and_metrics, _build_or_load_graph
-from routing_core import snap_to_nearest_node, get_pollution_points
+from routing_core import get_routes_and_metrics, get_pareto_routes, get_best_departure, _build_or_load_graph
+from routing_core import snap_to_nearest_node, snap_points, get_pollution_points, POLLUTION_FIELD
+from routing_core import get_pollution_raster, pollution_field_digest
+from routing_core import get_route_matrix, MAX_MATRIX_POINTS
+from time_dependent import parse_timestamp
 import logging
 
 # --- CONFIGURATION ---
@@ -39,16 +42,27 @@ def serve_static_files(path):
 def snap():
     """
     POST JSON: { "lat": 28.61, "lon": 77.20 }
-    Returns: { "lat": 28.61, "lon": 77.20, "node": 12345 }
+    Returns: { "lat": 28.61, "lon": 77.20, "node": 12345, "dist_m": 12.3 }
+
+    Bulk: { "points": [[28.61, 77.20], ...] } (or "lat,lon" strings)
+    Returns: { "snapped": [{ "lat", "lon", "node", "dist_m" }, ...] } in input order
     """
     try:
         payload = request.get_json(force=True)
-        lat = float(payload.get('lat'))
-        lon = float(payload.get('lon'))
+        points = payload.get('points')
+        if points is not None:
+            points = [tuple(map(float, p.split(',') if isinstance(p, str) else p)) for p in points]
+            if any(len(p) != 2 for p in points):
+                raise ValueError('each point must be [lat, lon]')
+        else:
+            lat = float(payload.get('lat'))
+            lon = float(payload.get('lon'))
     except Exception as e:
         return jsonify({'error': f'Invalid payload: {e}'}), 400
 
     try:
+        if points is not None:
+            return jsonify({'snapped': snap_points(points) if points else []}), 200
         snapped = snap_to_nearest_node((lat, lon))
         return jsonify(snapped), 200
     except Exception as e:
@@ -61,10 +75,68 @@ def pollution_points():
     [{ "lat": 28.6, "lon": 77.2, "ps": 320 }, ...]
     """
     try:
-        pts = get_pollution_points()
-        return jsonify(pts), 200
+        resp = jsonify(get_pollution_points())
+        return _conditional(resp, pollution_field_digest())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _conditional(resp, etag):
+    """Tag a response with the pollution snapshot ETag; answers If-None-Match with 304."""
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'   # always revalidate, 304 while unchanged
+    return resp.make_conditional(request)
+
+@app.route('/api/pollution_raster', methods=['GET'])
+def pollution_raster_meta():
+    """
+    Bounds, grid shape and ETag of the heatmap raster. Response:
+    { "bounds": [[s, w], [n, e]], "shape": [rows, cols], "etag": ..., "png": url, "f16": url, ... }
+    """
+    try:
+        raster = get_pollution_raster()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    meta = raster.meta()
+    meta['png'] = f"/api/pollution_raster.png?v={raster.etag}"
+    meta['f16'] = f"/api/pollution_raster.f16?v={raster.etag}"
+    return _conditional(jsonify(meta), raster.etag)
+
+@app.route('/api/pollution_raster.<fmt>', methods=['GET'])
+def pollution_raster(fmt):
+    """
+    Interpolated heatmap of the current forecast: `png` (RGBA overlay) or
+    `f16` (little-endian float16 PS grid, row 0 = north; shape in X-Grid-Shape).
+    """
+    if fmt not in ('png', 'f16'):
+        return jsonify({'error': "format must be 'png' or 'f16'"}), 404
+    try:
+        raster = get_pollution_raster()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if fmt == 'png':
+        resp = Response(raster.png, mimetype='image/png')
+    else:
+        resp = Response(raster.f16, mimetype='application/octet-stream')
+        resp.headers['X-Grid-Shape'] = f"{raster.shape[0]},{raster.shape[1]}"
+    resp.headers['X-Bounds'] = ','.join(str(b) for b in raster.bounds)
+    return _conditional(resp, f"{raster.etag}-{fmt}")
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Worker pid, uptime, RSS and preload timings (startup / memory monitoring)."""
+    import routing_core
+    return jsonify(routing_core.server_status()), 200
+
+@app.route('/api/route_cache_status', methods=['GET'])
+def route_cache_status():
+    """Hit rate, size and invalidations of the /api/route result cache (this worker)."""
+    import routing_core
+    return jsonify(routing_core.route_cache_status()), 200
+
+@app.route('/api/pollution_status', methods=['GET'])
+def pollution_status():
+    """Version and age of the pollution field snapshot shared by routing and the heatmap."""
+    return jsonify(POLLUTION_FIELD.status()), 200
 
 @app.route('/api/route', methods=['POST'])
 def route():
@@ -97,10 +169,18 @@ def route():
         if len(start_coords) != 2 or len(end_coords) != 2:
             return jsonify({'error': 'Invalid coordinate format. Must be "lat, lon".'}), 400
 
+        # Optional departure time (epoch seconds or ISO 8601; naive times are UTC)
+        depart_at = data.get('depart_at')
+        if depart_at is not None:
+            try:
+                parse_timestamp(depart_at)
+            except Exception:
+                return jsonify({'error': 'Invalid depart_at value. Use epoch seconds or ISO 8601.'}), 400
+
         logging.info(f"Finding routes from {start_coords} to {end_coords} with W={user_weight}")
 
         # Call core logic
-        route_results = get_routes_and_metrics(start_coords, end_coords, user_weight)
+        route_results = get_routes_and_metrics(start_coords, end_coords, user_weight, depart_at=depart_at)
 
         # If the core returns an error-like dict, pass that as a 400
         if isinstance(route_results, dict) and route_results.get('error'):
@@ -116,9 +196,159 @@ def route():
         }), 500
 
 
+@app.route('/api/route_pareto', methods=['POST'])
+def route_pareto():
+    """
+    POST JSON: { "start": "lat,lon", "end": "lat,lon", "max_routes": 8, "eps": 0 }
+    Returns every Pareto-optimal route for (time, exposure, emissions), at most
+    max_routes of them (optional), each with its own metrics. The client scores
+    them for any slider weight without calling the server again.
+    eps (optional, default 0 = exact) allows an eps-approximate front for speed.
+    """
+    try:
+        data = request.get_json(force=True) or {}
+        start_str = data.get('start')
+        end_str = data.get('end')
+        if not start_str or not end_str:
+            return jsonify({'error': 'Missing start or end coordinates. Please provide "start" and "end" fields in "lat,lon" format.'}), 400
+        try:
+            start_coords = tuple(map(float, [s.strip() for s in start_str.split(',')]))
+            end_coords = tuple(map(float, [s.strip() for s in end_str.split(',')]))
+            if len(start_coords) != 2 or len(end_coords) != 2:
+                raise ValueError
+        except Exception:
+            return jsonify({'error': 'Invalid coordinate format. Must be "lat, lon" with numeric values.'}), 400
+        max_routes = data.get('max_routes')
+        try:
+            max_routes = int(max_routes) if max_routes is not None else None
+            if max_routes is not None and max_routes < 1:
+                raise ValueError("max_routes must be >= 1")
+        except Exception as ex:
+            return jsonify({'error': f'Invalid max_routes value: {ex}'}), 400
+        try:
+            eps = float(data.get('eps', 0.0))
+            if not eps >= 0:
+                raise ValueError("eps must be >= 0")
+        except Exception as ex:
+            return jsonify({'error': f'Invalid eps value: {ex}'}), 400
+
+        result = get_pareto_routes(start_coords, end_coords, max_routes, eps)
+        if isinstance(result, dict) and result.get('error'):
+            return jsonify(result), 400
+        return jsonify(result), 200
+    except Exception as e:
+        logging.exception("Error during Pareto routing")
+        return jsonify({
+            'error': 'An internal error occurred during route calculation.',
+            'detail': str(e)
+        }), 500
+
+
+@app.route('/api/route_matrix', methods=['POST'])
+def route_matrix():
+    """
+    POST JSON: { "origins": ["lat,lon", ...], "destinations": ["lat,lon", ...],
+                 "weight": 0.5, "mode": "green" | "fastest" }
+    destinations defaults to origins. Points may also be [lat, lon] pairs.
+    Returns Time_min, Distance_km and Exposure_PS_min matrices (origins x
+    destinations, null where unreachable) computed against one snapshot.
+    """
+    def parse_points(items):
+        pts = []
+        for item in items:
+            if isinstance(item, str):
+                item = [s.strip() for s in item.split(',')]
+            lat, lon = map(float, item)
+            pts.append((lat, lon))
+        return pts
+
+    try:
+        data = request.get_json(force=True) or {}
+        try:
+            origins = parse_points(data.get('origins') or [])
+            destinations = data.get('destinations')
+            destinations = parse_points(destinations) if destinations is not None else None
+        except Exception:
+            return jsonify({'error': 'Invalid coordinate format. Points must be "lat,lon" strings or [lat, lon] pairs.'}), 400
+        if not origins or (destinations is not None and not destinations):
+            return jsonify({'error': 'Provide a non-empty "origins" list (and "destinations", if given).'}), 400
+        if len(origins) > MAX_MATRIX_POINTS or len(destinations or []) > MAX_MATRIX_POINTS:
+            return jsonify({'error': f'At most {MAX_MATRIX_POINTS} origins and {MAX_MATRIX_POINTS} destinations per request.'}), 400
+        try:
+            user_weight = float(data.get('weight', 0.5))
+            if not (0.0 <= user_weight <= 1.0):
+                raise ValueError("weight must be between 0 and 1")
+            mode = data.get('mode', 'green')
+            if mode not in ('green', 'fastest'):
+                raise ValueError('mode must be "green" or "fastest"')
+        except Exception as ex:
+            return jsonify({'error': f'Invalid parameter: {ex}'}), 400
+
+        result = get_route_matrix(origins, destinations, user_weight=user_weight, mode=mode)
+        return jsonify(result), 200
+    except Exception as e:
+        logging.exception("Error during route matrix calculation")
+        return jsonify({
+            'error': 'An internal error occurred during route calculation.',
+            'detail': str(e)
+        }), 500
+
+
+@app.route('/api/best_departure', methods=['POST'])
+def best_departure():
+    """
+    POST JSON: { "start": "lat,lon", "end": "lat,lon", "weight": 0.5,
+                 "earliest": "2025-01-01T08:00", "window_hours": 6, "step_minutes": 60 }
+    Returns the departure time in the window with the lowest forecast exposure
+    on the time-dependent green route, plus every candidate departure evaluated.
+    """
+    try:
+        data = request.get_json(force=True) or {}
+        start_str = data.get('start')
+        end_str = data.get('end')
+        if not start_str or not end_str:
+            return jsonify({'error': 'Missing start or end coordinates. Please provide "start" and "end" fields in "lat,lon" format.'}), 400
+        try:
+            start_coords = tuple(map(float, [s.strip() for s in start_str.split(',')]))
+            end_coords = tuple(map(float, [s.strip() for s in end_str.split(',')]))
+            if len(start_coords) != 2 or len(end_coords) != 2:
+                raise ValueError
+        except Exception:
+            return jsonify({'error': 'Invalid coordinate format. Must be "lat, lon" with numeric values.'}), 400
+        try:
+            user_weight = float(data.get('weight', 0.5))
+            if not (0.0 <= user_weight <= 1.0):
+                raise ValueError("weight must be between 0 and 1")
+            earliest = data.get('earliest')
+            if earliest is not None:
+                parse_timestamp(earliest)
+            window_hours = float(data.get('window_hours', 6))
+            step_minutes = float(data.get('step_minutes', 60))
+            if not (0 < window_hours <= 72) or not (5 <= step_minutes <= 24 * 60):
+                raise ValueError("window_hours must be in (0, 72] and step_minutes in [5, 1440]")
+        except Exception as ex:
+            return jsonify({'error': f'Invalid parameter: {ex}'}), 400
+
+        result = get_best_departure(start_coords, end_coords, user_weight,
+                                    earliest=earliest, window_hours=window_hours,
+                                    step_minutes=step_minutes)
+        if isinstance(result, dict) and result.get('error'):
+            return jsonify(result), 400
+        return jsonify(result), 200
+    except Exception as e:
+        logging.exception("Error during best departure search")
+        return jsonify({
+            'error': 'An internal error occurred during route calculation.',
+            'detail': str(e)
+        }), 500
+
+
 @app.route('/api/traffic_refresh', methods=['POST'])
 def traffic_refresh():
-
+    """
+    Starts a background TomTom refresh and returns 202 with the job
+    (poll /api/traffic_status). Pass "wait": true to run it in the request.
+    """
     try:
         payload = request.get_json(silent=True) or {}
         points = payload.get('points', None)
@@ -126,16 +356,27 @@ def traffic_refresh():
         spacing_deg = float(payload.get('spacing_deg', 0.005))
 
         import tomtom_integration as tt
-        res = tt.update_graph_from_tomtom_points(points=points, max_points=max_points, spacing_deg=spacing_deg)
-        return jsonify({'ok': True, 'result': res}), 200
+        if payload.get('wait'):
+            res = tt.update_graph_from_tomtom_points(points=points, max_points=max_points, spacing_deg=spacing_deg)
+            return jsonify({'ok': True, 'result': res}), 200
+        job = tt.start_refresh_job(points=points, max_points=max_points, spacing_deg=spacing_deg)
+        return jsonify({'ok': True, 'job': job}), 202
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 500
 
 
 @app.route('/api/traffic_status', methods=['GET'])
 def traffic_status():
-    # returns a trivial confirmation
-    return jsonify({'tomtom_key_present': bool(os.environ.get('TOMTOM_API_KEY'))}), 200
+    # returns key presence, the refresh job / segment cache state and the current edge weight snapshot versions;
+    # ?job=<id> reports that job, or state 'unknown' if this worker did not start it
+    import routing_core
+    import tomtom_integration as tt
+    store = routing_core.EDGE_WEIGHTS
+    return jsonify({
+        'tomtom_key_present': bool(tt.TOMTOM_KEY),
+        'refresh': tt.refresh_status(request.args.get('job')),
+        'edge_weights': store.status() if store is not None else None,
+    }), 200
 
 # --- RUNNING THE APPLICATION ---
 if __name__ == '__main__':
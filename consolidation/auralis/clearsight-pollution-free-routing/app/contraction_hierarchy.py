@@ -0,0 +1,391 @@
+# app/contraction_hierarchy.py
+"""
+Customizable contraction hierarchy (CCH) for fastest-route queries.
+
+Travel times only change when TomTom refreshes, so the expensive part is
+split from the cheap part:
+
+  1. build (offline, once per road graph, metric independent)
+     - nested-dissection node order from projected coordinates
+     - contraction of the undirected graph in that order -> chordal
+       supergraph of "CCH edges" {lo, hi} (lo has the lower rank)
+     - enumeration of all lower triangles, grouped into dependency levels
+  2. customize (whenever travel_time changes, a few vectorized passes)
+     - seed up/down weights of CCH edges from the original edges
+     - relax triangles level by level with np.minimum.at
+  3. query (per request, elimination-tree walk, no priority queue)
+     - forward upward search from the origin, backward upward search from
+       the destination, both walking the elimination-tree ancestors
+     - shortcuts are unpacked back to original nodes via the recorded
+       middle node of each improved triangle
+
+Build:  python app/contraction_hierarchy.py   (writes cache/cch.npz)
+"""
+import os
+import sys
+import math
+import hashlib
+from array import array
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
+
+CCH_PATH = os.environ.get(
+    "CCH_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "cch.npz"),
+)
+ND_LEAF_SIZE = 16
+
+
+def graph_fingerprint(arrays) -> str:
+    """Identifies the topology a hierarchy was built for."""
+    h = hashlib.sha1()
+    for a in (arrays.node_ids, arrays.edge_u, arrays.edge_v):
+        h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+
+# ==============================
+# ✅ ORDERING (NESTED DISSECTION)
+# ==============================
+def nested_dissection_order(x: np.ndarray, y: np.ndarray, ea: np.ndarray, eb: np.ndarray,
+                            leaf_size: int = ND_LEAF_SIZE) -> np.ndarray:
+    """
+    Order nodes for contraction: recursively split the node set at the median
+    of its wider coordinate extent, take the smaller boundary of the cut as a
+    vertex separator, order both halves first and the separator last.
+    ea/eb are undirected edges between node indices.
+    """
+    n = len(x)
+    side = np.zeros(n, dtype=np.int8)
+    order: List[np.ndarray] = []
+
+    def rec(nodes, a, b):
+        if len(nodes) <= leaf_size:
+            order.append(nodes)
+            return
+        xs, ys = x[nodes], y[nodes]
+        coord = xs if np.ptp(xs) >= np.ptp(ys) else ys
+        srt = np.argsort(coord, kind="stable")
+        half = len(nodes) // 2
+        side[nodes[srt[:half]]] = 0
+        side[nodes[srt[half:]]] = 1
+
+        cut = side[a] != side[b]
+        ends = np.concatenate([a[cut], b[cut]])
+        sep_l = np.unique(ends[side[ends] == 0])
+        sep_r = np.unique(ends[side[ends] == 1])
+        sep = sep_l if len(sep_l) <= len(sep_r) else sep_r
+        side[sep] = 2
+
+        left = nodes[side[nodes] == 0]
+        right = nodes[side[nodes] == 1]
+        in_l = (side[a] == 0) & (side[b] == 0)
+        in_r = (side[a] == 1) & (side[b] == 1)
+        a_l, b_l, a_r, b_r = a[in_l], b[in_l], a[in_r], b[in_r]
+        rec(left, a_l, b_l)
+        rec(right, a_r, b_r)
+        order.append(sep)
+
+    rec(np.arange(n), ea, eb)
+    return np.concatenate(order) if order else np.empty(0, dtype=np.int64)
+
+
+# ==============================
+# ✅ METRIC (CUSTOMIZED WEIGHTS)
+# ==============================
+class CCHMetric:
+    """Customized up/down weights of all CCH edges for one travel-time snapshot."""
+    __slots__ = ("version", "up", "down", "mid_up", "mid_down", "up_l", "down_l")
+
+    def __init__(self, version, up, down, mid_up, mid_down):
+        self.version = version
+        self.up = up            # cost lo -> hi
+        self.down = down        # cost hi -> lo
+        self.mid_up = mid_up    # middle node of the best lo -> hi shortcut, -1 = original edge
+        self.mid_down = mid_down
+        self.up_l = up.tolist()
+        self.down_l = down.tolist()
+
+
+# ==============================
+# ✅ HIERARCHY
+# ==============================
+class ContractionHierarchy:
+    """
+    Metric-independent CCH over a RouteEngine's (u, v) pairs.
+    Node indices are the same as GraphArrays / RouteEngine.
+    """
+
+    def __init__(self, n_nodes, rank, lo, hi, tri_a, tri_b, tri_t, tri_v, tri_level,
+                 pair_edge, pair_is_up, fingerprint):
+        self.n_nodes = n_nodes
+        self.rank = rank
+        self.lo = lo
+        self.hi = hi
+        self.tri_a, self.tri_b, self.tri_t, self.tri_v = tri_a, tri_b, tri_t, tri_v
+        self.tri_level = tri_level
+        self.pair_edge = pair_edge
+        self.pair_is_up = pair_is_up
+        self.fingerprint = fingerprint
+        self._prepare()
+
+    def _prepare(self):
+        n = self.n_nodes
+        self.n_edges = len(self.lo)
+        lo_l, hi_l = self.lo.tolist(), self.hi.tolist()
+        self.edge_id = {(a, b): e for e, (a, b) in enumerate(zip(lo_l, hi_l))}
+        self.up_nbr = [[] for _ in range(n)]
+        self.up_edge = [[] for _ in range(n)]
+        for e, (a, b) in enumerate(zip(lo_l, hi_l)):
+            self.up_nbr[a].append(b)
+            self.up_edge[a].append(e)
+        # Elimination tree: parent = lowest-ranked upper neighbor
+        rank = self.rank
+        self.parent = [min(nb, key=lambda w: rank[w]) if nb else -1 for nb in self.up_nbr]
+        self._lo_l, self._hi_l = lo_l, hi_l
+        # Triangle batches in dependency order
+        if len(self.tri_level):
+            o = np.argsort(self.tri_level, kind="stable")
+            bounds = np.flatnonzero(np.diff(self.tri_level[o])) + 1
+            self._batches = np.split(o, bounds)
+        else:
+            self._batches = []
+
+    # ------------------------------
+    # Build
+    # ------------------------------
+    @classmethod
+    def build(cls, engine, leaf_size: int = ND_LEAF_SIZE) -> "ContractionHierarchy":
+        arrays = engine.arrays
+        n = engine.n_nodes
+        pu, pv = engine.pair_u, engine.pair_v
+
+        # Undirected simple graph for ordering / contraction
+        a = np.minimum(pu, pv)
+        b = np.maximum(pu, pv)
+        keep = a != b
+        und = np.unique(a[keep] * n + b[keep])
+        ea, eb = und // n, und % n
+
+        order = nested_dissection_order(arrays.node_x, arrays.node_y, ea, eb, leaf_size)
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        rank_l = rank.tolist()
+
+        # Contraction: merging N_up(v) \ {p} into N_up(p) of the elimination-tree
+        # parent p yields the same fill-in as adding the whole clique.
+        up = [set() for _ in range(n)]
+        for x, y in zip(ea.tolist(), eb.tolist()):
+            if rank_l[x] < rank_l[y]:
+                up[x].add(y)
+            else:
+                up[y].add(x)
+        for v in order.tolist():
+            if up[v]:
+                p = min(up[v], key=rank_l.__getitem__)
+                up[p] |= up[v] - {p}
+
+        lo, hi = [], []
+        edge_id = {}
+        up_sorted = []
+        for v in range(n):
+            nb = sorted(up[v], key=rank_l.__getitem__)
+            up_sorted.append(nb)
+            for w in nb:
+                edge_id[(v, w)] = len(lo)
+                lo.append(v)
+                hi.append(w)
+
+        # Lower triangles {v, u, w} with rank v < u < w, and their dependency level:
+        # a triangle reads edges whose low end is v and writes edge {u, w} (low end u).
+        level = [0] * n
+        tri_a, tri_b, tri_t, tri_v, tri_lv = (array("i") for _ in range(5))
+        for v in order.tolist():
+            nb = up_sorted[v]
+            lv = level[v]
+            for i, u in enumerate(nb):
+                e_vu = edge_id[(v, u)]
+                if i + 1 < len(nb) and level[u] < lv + 1:
+                    level[u] = lv + 1
+                for w in nb[i + 1:]:
+                    tri_a.append(e_vu)
+                    tri_b.append(edge_id[(v, w)])
+                    tri_t.append(edge_id[(u, w)])
+                    tri_v.append(v)
+                    tri_lv.append(lv)
+
+        # Map every original (u, v) pair onto its CCH edge and direction
+        p_lo = np.where(rank[pu] < rank[pv], pu, pv)
+        p_hi = np.where(rank[pu] < rank[pv], pv, pu)
+        pair_edge = np.array([edge_id.get((x, y), -1) for x, y in zip(p_lo.tolist(), p_hi.tolist())],
+                             dtype=np.int64)
+        pair_is_up = rank[pu] < rank[pv]
+
+        return cls(n, rank, np.asarray(lo, dtype=np.int64), np.asarray(hi, dtype=np.int64),
+                   np.frombuffer(tri_a, dtype=np.int32), np.frombuffer(tri_b, dtype=np.int32),
+                   np.frombuffer(tri_t, dtype=np.int32), np.frombuffer(tri_v, dtype=np.int32),
+                   np.frombuffer(tri_lv, dtype=np.int32), pair_edge, pair_is_up,
+                   graph_fingerprint(arrays))
+
+    # ------------------------------
+    # Persistence
+    # ------------------------------
+    def save(self, path: str = CCH_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path, n_nodes=self.n_nodes, rank=self.rank, lo=self.lo, hi=self.hi,
+            tri_a=self.tri_a, tri_b=self.tri_b, tri_t=self.tri_t, tri_v=self.tri_v,
+            tri_level=self.tri_level, pair_edge=self.pair_edge, pair_is_up=self.pair_is_up,
+            fingerprint=np.array(self.fingerprint),
+        )
+
+    @classmethod
+    def load(cls, arrays, path: str = CCH_PATH) -> Optional["ContractionHierarchy"]:
+        """Load a saved hierarchy; None if missing or built for a different graph."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as z:
+            if str(z["fingerprint"]) != graph_fingerprint(arrays):
+                print(f"[cch] {path} was built for a different road graph, ignoring it.")
+                return None
+            return cls(int(z["n_nodes"]), z["rank"], z["lo"], z["hi"], z["tri_a"], z["tri_b"],
+                       z["tri_t"], z["tri_v"], z["tri_level"], z["pair_edge"], z["pair_is_up"],
+                       str(z["fingerprint"]))
+
+    # ------------------------------
+    # Customization
+    # ------------------------------
+    def customize(self, pair_cost: np.ndarray, version=None) -> CCHMetric:
+        """
+        Compute shortcut weights for one metric. `pair_cost` is aligned with the
+        RouteEngine pairs (e.g. CostView.pair_cost for travel_time).
+        """
+        m = self.n_edges
+        up = np.full(m, np.inf)
+        down = np.full(m, np.inf)
+        valid = self.pair_edge >= 0
+        is_up = valid & self.pair_is_up
+        is_down = valid & ~self.pair_is_up
+        np.minimum.at(up, self.pair_edge[is_up], pair_cost[is_up])
+        np.minimum.at(down, self.pair_edge[is_down], pair_cost[is_down])
+        mid_up = np.full(m, -1, dtype=np.int64)
+        mid_down = np.full(m, -1, dtype=np.int64)
+
+        for batch in self._batches:
+            a, b, t, v = self.tri_a[batch], self.tri_b[batch], self.tri_t[batch], self.tri_v[batch]
+            # u -> v -> w  (down along {v,u}, up along {v,w})
+            cand = down[a] + up[b]
+            better = cand < up[t]
+            if better.any():
+                np.minimum.at(up, t[better], cand[better])
+                won = better & (cand == up[t])
+                mid_up[t[won]] = v[won]
+            # w -> v -> u
+            cand = down[b] + up[a]
+            better = cand < down[t]
+            if better.any():
+                np.minimum.at(down, t[better], cand[better])
+                won = better & (cand == down[t])
+                mid_down[t[won]] = v[won]
+
+        return CCHMetric(version, up, down, mid_up, mid_down)
+
+    # ------------------------------
+    # Query
+    # ------------------------------
+    def _upward(self, start: int, weights: List[float]):
+        dist = {start: 0.0}
+        pred = {}
+        parent, up_nbr, up_edge = self.parent, self.up_nbr, self.up_edge
+        x = start
+        while x != -1:
+            dx = dist.get(x)
+            if dx is not None:
+                for w, e in zip(up_nbr[x], up_edge[x]):
+                    nd = dx + weights[e]
+                    if nd < dist.get(w, math.inf):
+                        dist[w] = nd
+                        pred[w] = e
+            x = parent[x]
+        return dist, pred
+
+    def query(self, metric: CCHMetric, orig: int, dest: int) -> Tuple[List[int], float, int]:
+        """
+        Shortest path between node indices. Returns (path, cost, settled),
+        or raises ValueError when dest is unreachable.
+        """
+        if orig == dest:
+            return [orig], 0.0, 1
+        df, pf = self._upward(orig, metric.up_l)
+        db, pb = self._upward(dest, metric.down_l)
+        best, meet = math.inf, -1
+        for x, d in db.items():
+            f = df.get(x)
+            if f is not None and f + d < best:
+                best, meet = f + d, x
+        if meet < 0 or not math.isfinite(best):
+            raise ValueError(f"No route between nodes {orig} and {dest}")
+
+        # Upward CCH arcs orig -> meet, then downward arcs meet -> dest
+        lo_l, hi_l = self._lo_l, self._hi_l
+        fwd = []
+        x = meet
+        while x != orig:
+            e = pf[x]
+            fwd.append(e)
+            x = lo_l[e]
+        fwd.reverse()
+        path = [orig]
+        for e in fwd:
+            self._unpack(metric, e, True, path)
+        x = meet
+        while x != dest:
+            e = pb[x]
+            self._unpack(metric, e, False, path)
+            x = lo_l[e]
+        return path, best, len(df) + len(db)
+
+    def _unpack(self, metric: CCHMetric, e: int, upward: bool, out: List[int]) -> None:
+        """Append the original nodes of CCH arc e (after its first node) to out."""
+        lo_l, hi_l, edge_id = self._lo_l, self._hi_l, self.edge_id
+        mid_up, mid_down = metric.mid_up, metric.mid_down
+        stack = [(e, upward)]
+        while stack:
+            e, upw = stack.pop()
+            lo, hi = lo_l[e], hi_l[e]
+            m = int(mid_up[e] if upw else mid_down[e])
+            if m < 0:
+                out.append(hi if upw else lo)
+                continue
+            e_lo = edge_id[(m, lo)]
+            e_hi = edge_id[(m, hi)]
+            if upw:
+                # lo -> m -> hi : down along {m,lo}, then up along {m,hi}
+                stack.append((e_hi, True))
+                stack.append((e_lo, False))
+            else:
+                # hi -> m -> lo : down along {m,hi}, then up along {m,lo}
+                stack.append((e_lo, True))
+                stack.append((e_hi, False))
+
+
+if __name__ == "__main__":
+    # Offline build over the (osmnx-cached) road graph used by the server
+    import time
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import routing_core
+
+    routing_core._build_or_load_graph()
+    t0 = time.perf_counter()
+    cch = ContractionHierarchy.build(routing_core.ROUTE_ENGINE)
+    t1 = time.perf_counter()
+    cch.save(CCH_PATH)
+    tt = routing_core.ROUTE_ENGINE.costs(routing_core.EDGE_WEIGHTS.current().travel_time)
+    t2 = time.perf_counter()
+    cch.customize(tt.pair_cost)
+    t3 = time.perf_counter()
+    print(f"CCH: {cch.n_nodes} nodes, {cch.n_edges} edges, {len(cch.tri_a)} triangles, "
+          f"{len(cch._batches)} levels")
+    print(f"build {t1 - t0:.2f}s, customize {1000 * (t3 - t2):.1f}ms -> {CCH_PATH}")
@@ -0,0 +1,243 @@
+# app/edge_weights.py
+"""
+Copy-on-write edge weight snapshots for concurrent routing.
+
+The road graph topology never changes after it is loaded, so it is flattened
+once into GraphArrays (edge i <-> G_proj edge (u, v, k) with attribute eid=i).
+Everything that does change per request or per refresh (travel time from
+TomTom, pollution score from the forecast, and the derived 0–1 norms) lives in
+an immutable EdgeWeights snapshot.
+
+Writers build a new snapshot from the current one under a lock and swap the
+reference; readers grab `store.current()` once and route against it without
+locking, so they always see one consistent set of weights.
+"""
+import math
+import hashlib
+import threading
+from typing import Dict, Tuple, Any, Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371008.8
+DEFAULT_TRAVEL_TIME = 60.0       # seconds, for edges without a usable length
+DEFAULT_POLLUTION_SCORE = 300.0  # until the first forecast is applied
+
+
+def _frozen(a: np.ndarray) -> np.ndarray:
+    a = np.ascontiguousarray(a, dtype=np.float64)
+    a.setflags(write=False)
+    return a
+
+
+def _minmax_norm(values: np.ndarray) -> np.ndarray:
+    """(x - min) / range over all edges, with range = 1 when all values are equal."""
+    if values.size == 0:
+        return values.copy()
+    v_min, v_max = values.min(), values.max()
+    v_range = (v_max - v_min) if v_max > v_min else 1.0
+    return (values - v_min) / v_range
+
+
+def _edge_points(geoms, op, node_a, node_b, edge_u, edge_v):
+    """
+    (x, y) of op(geometry) for every edge with a geometry, vectorized with
+    shapely; edges without one fall back to the mean of their end nodes.
+    """
+    import shapely
+    u = np.asarray(edge_u, dtype=np.int64)
+    v = np.asarray(edge_v, dtype=np.int64)
+    x = (node_a[u] + node_a[v]) / 2 if len(u) else np.empty(0)
+    y = (node_b[u] + node_b[v]) / 2 if len(u) else np.empty(0)
+    has = np.array([g is not None for g in geoms], dtype=bool)
+    if has.any():
+        pts = op(np.array([g for g in geoms if g is not None], dtype=object))
+        x[has] = shapely.get_x(pts)
+        y[has] = shapely.get_y(pts)
+    return x, y
+
+
+# ==============================
+# ✅ STATIC GRAPH ARRAYS
+# ==============================
+class GraphArrays:
+    """
+    Read-only array view of the road graph, built once when the graph loads.
+
+    node_ids[i]          OSM id of node i; node_index maps id -> i
+    node_x, node_y       projected coordinates (meters, G_proj CRS)
+    node_lat, node_lon   WGS84 coordinates (from G_orig)
+    edge_keys[e]         (u, v, k) of edge e; edge_index maps (u, v, k) -> e
+    edge_u, edge_v       node indices of edge e
+    length               edge length in meters
+    centroid_x/_y        projected edge centroid (used for pollution IDW)
+    mid_lat, mid_lon     WGS84 point halfway along each edge (used to map traffic readings)
+    node_tree            KD-tree over node lat/lon (equirectangular meters) for snapping
+    """
+
+    def __init__(self, G_proj, G_orig=None):
+        node_ids = list(G_proj.nodes)
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.node_index = {n: i for i, n in enumerate(node_ids)}
+        self.node_x = np.array([G_proj.nodes[n]["x"] for n in node_ids], dtype=np.float64)
+        self.node_y = np.array([G_proj.nodes[n]["y"] for n in node_ids], dtype=np.float64)
+        geo = G_orig if G_orig is not None else G_proj
+        self.node_lat = np.array([geo.nodes[n]["y"] for n in node_ids], dtype=np.float64)
+        self.node_lon = np.array([geo.nodes[n]["x"] for n in node_ids], dtype=np.float64)
+
+        edge_keys = []
+        edge_u, edge_v, length, geoms, geo_geoms = [], [], [], [], []
+        for u, v, k, data in G_proj.edges(keys=True, data=True):
+            edge_keys.append((u, v, k))
+            edge_u.append(self.node_index[u])
+            edge_v.append(self.node_index[v])
+            length.append(float(data.get("length", 100.0)))
+            geoms.append(data.get("geometry"))
+            geo_geoms.append(geo.edges[u, v, k].get("geometry") if geo.has_edge(u, v, k) else None)
+
+        self.edge_keys = edge_keys
+        self.edge_index = {key: e for e, key in enumerate(edge_keys)}
+        self.edge_u = np.asarray(edge_u, dtype=np.int32)
+        self.edge_v = np.asarray(edge_v, dtype=np.int32)
+        self.length = _frozen(length)
+
+        # Projected centroid and WGS84 midpoint of every edge, computed in bulk:
+        # from the geometry when the edge has one, else halfway between its nodes
+        import shapely
+        cx, cy = _edge_points(geoms, shapely.centroid, self.node_x, self.node_y, edge_u, edge_v)
+        mid_lon, mid_lat = _edge_points(
+            geo_geoms, lambda g: shapely.line_interpolate_point(g, 0.5, normalized=True),
+            self.node_lon, self.node_lat, edge_u, edge_v)
+        self.centroid_x = _frozen(cx)
+        self.centroid_y = _frozen(cy)
+        self.mid_lat = _frozen(mid_lat)
+        self.mid_lon = _frozen(mid_lon)
+
+        for a in (self.node_ids, self.node_x, self.node_y, self.node_lat, self.node_lon,
+                  self.edge_u, self.edge_v):
+            a.setflags(write=False)
+
+        # Equirectangular projection about the graph's mean latitude: accurate
+        # to well under a meter over a city-sized graph and cheap to apply to queries
+        self._lat0 = float(self.node_lat.mean()) if len(node_ids) else 0.0
+        self.node_tree = cKDTree(self._planar(self.node_lat, self.node_lon)) if len(node_ids) else None
+
+        # Tag every graph edge with its array index so graph-based code can
+        # look weights up in a snapshot instead of reading edge attributes.
+        for e, (u, v, k) in enumerate(edge_keys):
+            G_proj.edges[u, v, k]["eid"] = e
+
+    def _planar(self, lat, lon) -> np.ndarray:
+        k = math.pi / 180.0 * EARTH_RADIUS_M
+        return np.column_stack([np.asarray(lon, dtype=np.float64) * k * math.cos(math.radians(self._lat0)),
+                                np.asarray(lat, dtype=np.float64) * k])
+
+    def nearest_nodes(self, lat, lon) -> Tuple[np.ndarray, np.ndarray]:
+        """Node index and distance in meters of the nearest node to each (lat, lon)."""
+        dist, idx = self.node_tree.query(self._planar(np.atleast_1d(lat), np.atleast_1d(lon)))
+        return idx.astype(np.int64), dist
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edge_keys)
+
+
+# ==============================
+# ✅ IMMUTABLE WEIGHT SNAPSHOT
+# ==============================
+class EdgeWeights:
+    """
+    One consistent set of per-edge weights. Arrays are read-only; never mutate.
+
+    version            bumped on every publish
+    pollution_version  PollutionField version the scores came from (None = defaults)
+    traffic_version    bumped on every travel-time update
+    """
+    __slots__ = ("version", "pollution_version", "traffic_version",
+                 "travel_time", "pollution_score", "time_norm", "poll_norm", "_traffic_digest")
+
+    def __init__(self, version: int, pollution_version: Optional[int], traffic_version: int,
+                 travel_time: np.ndarray, pollution_score: np.ndarray,
+                 time_norm: Optional[np.ndarray] = None, poll_norm: Optional[np.ndarray] = None):
+        self.version = version
+        self.pollution_version = pollution_version
+        self.traffic_version = traffic_version
+        self.travel_time = _frozen(travel_time)
+        self.pollution_score = _frozen(pollution_score)
+        # Norms of an unchanged array are passed through from the previous snapshot
+        self.time_norm = time_norm if time_norm is not None else _frozen(_minmax_norm(self.travel_time))
+        self.poll_norm = poll_norm if poll_norm is not None else _frozen(_minmax_norm(self.pollution_score))
+        self._traffic_digest = None
+
+    @property
+    def traffic_digest(self) -> str:
+        """Content hash of travel_time; unlike traffic_version it is stable across processes."""
+        if self._traffic_digest is None:
+            self._traffic_digest = hashlib.sha1(self.travel_time.tobytes()).hexdigest()[:16]
+        return self._traffic_digest
+
+
+class EdgeWeightStore:
+    """
+    Holds the current EdgeWeights snapshot. Writers are serialized by a lock and
+    derive the next snapshot from the current one; readers just call current().
+    """
+
+    def __init__(self, arrays: GraphArrays, travel_time: np.ndarray,
+                 pollution_score: Optional[np.ndarray] = None):
+        self.arrays = arrays
+        if pollution_score is None:
+            pollution_score = np.full(arrays.n_edges, DEFAULT_POLLUTION_SCORE)
+        self._lock = threading.Lock()
+        self._current = EdgeWeights(1, None, 0, travel_time, pollution_score)
+
+    def current(self) -> EdgeWeights:
+        return self._current
+
+    def _swap(self, travel_time=None, pollution_score=None,
+              pollution_version=None, traffic_bump=False) -> EdgeWeights:
+        cur = self._current
+        nxt = EdgeWeights(
+            version=cur.version + 1,
+            pollution_version=pollution_version if pollution_version is not None else cur.pollution_version,
+            traffic_version=cur.traffic_version + (1 if traffic_bump else 0),
+            travel_time=cur.travel_time if travel_time is None else travel_time,
+            pollution_score=cur.pollution_score if pollution_score is None else pollution_score,
+            time_norm=cur.time_norm if travel_time is None else None,
+            poll_norm=cur.poll_norm if pollution_score is None else None,
+        )
+        self._current = nxt   # atomic reference swap
+        return nxt
+
+    def publish_pollution(self, pollution_score: np.ndarray, pollution_version: int) -> EdgeWeights:
+        """
+        Replace all pollution scores (one forecast version). Versions only move
+        forward: a late publish of an older forecast is ignored.
+        """
+        with self._lock:
+            cur = self._current.pollution_version
+            if cur == pollution_version or (
+                    cur is not None and pollution_version is not None and pollution_version <= cur):
+                return self._current   # this or a newer version is already applied
+            return self._swap(pollution_score=pollution_score, pollution_version=pollution_version)
+
+    def update_travel_times(self, edge_ids: np.ndarray, travel_times: np.ndarray) -> EdgeWeights:
+        """Copy the current travel times, overwrite the given edges and publish."""
+        with self._lock:
+            tt = self._current.travel_time.copy()
+            tt[np.asarray(edge_ids, dtype=np.int64)] = travel_times
+            return self._swap(travel_time=tt, traffic_bump=True)
+
+    def status(self) -> Dict[str, Any]:
+        cur = self._current
+        return {
+            "version": cur.version,
+            "pollution_version": cur.pollution_version,
+            "traffic_version": cur.traffic_version,
+            "edges": self.arrays.n_edges,
+        }
@@ -0,0 +1,333 @@
+# app/era5_store.py
+"""
+Local ERA5 reanalysis store: GRIB -> partitioned Parquet, with point/time lookups.
+
+ingest_file() (run offline via data/data.py) converts a GRIB or NetCDF file into
+
+    <root>/year=YYYY/month=MM/<source>.parquet    zstd, row groups sorted by (latitude, longitude, time)
+    <root>/_meta.json                             grid, variables, time range
+
+with one row per (time, latitude, longitude) and one float32 column per GRIB
+variable (shortName: t2m, u10, v10, d2m, sp, ...). Time is the valid time as
+UTC epoch seconds. Ingestion streams month-aligned windows of a week of time
+steps; every window's rows are sorted by grid cell, so a point lookup reads
+one or two row groups per window (Parquet statistics pruning).
+
+ERA5Store.point() returns the hourly rows of the nearest grid cell between
+two times; results are cached per (cell, month). weather_frame() maps them to
+the columns the routing forecast uses (temperature, wind_speed, humidity,
+pressure) so routing_core can fall back to reanalysis when Open-Meteo is
+unreachable.
+
+xarray/cfgrib (ingestion) and pyarrow (storage) are imported on first use.
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+ERA5_STORE_DIR = os.environ.get(
+    "ERA5_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "era5"))
+ERA5_ROW_GROUP = int(os.environ.get("ERA5_ROW_GROUP", 50_000))
+ERA5_CACHE_SIZE = int(os.environ.get("ERA5_CACHE_SIZE", 256))     # cached (cell, month) blocks
+META_FILE = "_meta.json"
+_INGEST_CHUNK = 24 * 7      # time steps converted per batch during ingestion
+
+SECONDS_PER_HOUR = 3600
+
+
+# ==============================
+# ✅ INGESTION (offline)
+# ==============================
+def _gridded(ds):
+    """The dataset restricted to its (latitude, longitude) variables, and its time dimension."""
+    variables = [v for v in ds.data_vars if {"latitude", "longitude"} <= set(ds[v].dims)]
+    time_dim = next((d for d in ("time", "step", "valid_time") if d in ds.dims), None)
+    return ds[variables], variables, time_dim
+
+
+def _axis_times(ds, time_dim: str) -> np.ndarray:
+    """Valid time (UTC epoch seconds) of each index along time_dim."""
+    values = ds[time_dim].values
+    if time_dim == "step":
+        values = ds["time"].values + values
+    return pd.to_datetime(values).values.astype("datetime64[s]").astype(np.int64)
+
+
+def _windows(times: np.ndarray, chunk: int = _INGEST_CHUNK) -> List[tuple]:
+    """
+    Inclusive (first, last) epoch-second windows over the sorted unique times:
+    at most `chunk` time steps each and never crossing a month boundary.
+    """
+    if len(times) == 0:
+        return []
+    month = times.astype("datetime64[s]").astype("datetime64[M]")
+    starts = np.flatnonzero(np.r_[True, month[1:] != month[:-1]])
+    ends = np.r_[starts[1:], len(times)]
+    return [(int(times[lo]), int(times[min(lo + chunk, hi) - 1]))
+            for s0, hi in zip(starts, ends) for lo in range(s0, hi, chunk)]
+
+
+def _to_frame(part, variables: List[str]) -> pd.DataFrame:
+    """Long (time, latitude, longitude, vars...) frame from a slice of one dataset."""
+    df = part.to_dataframe().reset_index()
+    if "valid_time" not in df.columns:
+        df["valid_time"] = df["time"] + df.get("step", pd.Timedelta(0))
+    out = pd.DataFrame({
+        "time": pd.to_datetime(df["valid_time"]).astype("int64") // 10**9,
+        "latitude": df["latitude"].astype(np.float32),
+        "longitude": df["longitude"].astype(np.float32),
+    })
+    for v in variables:
+        out[v] = df[v].astype(np.float32)
+    return out
+
+
+def ingest_file(path: str, root: str = ERA5_STORE_DIR) -> Dict:
+    """
+    Convert a GRIB (via cfgrib) or NetCDF (.nc, as delivered by the CDS) file
+    into monthly Parquet partitions under root and update _meta.json.
+    Re-ingesting the same file replaces its partitions. Returns the metadata.
+    """
+    source = os.path.splitext(os.path.basename(path))[0]
+    if path.endswith((".nc", ".nc4")):
+        import xarray as xr
+        datasets = [xr.open_dataset(path)]
+    else:
+        import cfgrib
+        datasets = cfgrib.open_datasets(path, backend_kwargs={"indexpath": ""})
+    return ingest_datasets(datasets, source, root)
+
+
+def ingest_datasets(datasets, source: str, root: str = ERA5_STORE_DIR) -> Dict:
+    """
+    ingest_file() for already opened xarray datasets; partitions are named after source.
+
+    Works through month-aligned windows of at most _INGEST_CHUNK time steps:
+    each window is read from every dataset, the hypercubes are merged on the
+    cell/time keys and the rows are appended to that month's Parquet file
+    (one writer per month, one or more row groups per window, each sorted by
+    cell). Memory is bounded by one window, not by the file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    keys = ["time", "latitude", "longitude"]
+    grids = [g for g in (_gridded(ds) for ds in datasets) if g[1]]
+    if not grids:
+        raise ValueError(f"{source}: no gridded variables found")
+    variables = list(dict.fromkeys(v for _, vs, _ in grids for v in vs))
+    schema = pa.schema([("time", pa.int64()), ("latitude", pa.float32()), ("longitude", pa.float32())]
+                       + [(v, pa.float32()) for v in variables])
+
+    axes = [_axis_times(ds, dim) if dim else None for ds, _, dim in grids]
+    all_times = np.unique(np.concatenate([t for t in axes if t is not None] or [np.empty(0, np.int64)]))
+    windows = _windows(all_times) or [(None, None)]
+
+    writers: Dict[tuple, tuple] = {}
+    lats, lons = set(), set()
+    rows, t_min, t_max = 0, None, None
+    try:
+        for w, (first, last) in enumerate(windows):
+            frames = []
+            for (ds, vs, dim), times in zip(grids, axes):
+                if dim is None:
+                    part = ds if w == 0 else None       # no time axis: ingest once
+                else:
+                    idx = np.flatnonzero((times >= first) & (times <= last))
+                    part = ds.isel({dim: idx}) if len(idx) else None
+                if part is not None:
+                    frames.append(_to_frame(part, vs))
+            if not frames:
+                continue
+
+            # Different GRIB hypercubes (e.g. surface vs. single-level) share the cell/time keys
+            df = frames[0]
+            for t in frames[1:]:
+                df = df.merge(t, on=keys, how="outer", suffixes=("", "_dup"))
+                for dup in [c for c in df.columns if c.endswith("_dup")]:
+                    df[dup[:-4]] = df[dup[:-4]].fillna(df[dup])
+                    df = df.drop(columns=dup)
+            df = df.groupby(keys, as_index=False).first().reindex(columns=keys + variables)
+            df[variables] = df[variables].astype(np.float32)
+
+            lats.update(df["latitude"].astype(float).unique().tolist())
+            lons.update(df["longitude"].astype(float).unique().tolist())
+            rows += len(df)
+            lo, hi = int(df["time"].min()), int(df["time"].max())
+            t_min = lo if t_min is None else min(t_min, lo)
+            t_max = hi if t_max is None else max(t_max, hi)
+
+            month = df["time"].to_numpy().astype("datetime64[s]").astype("datetime64[M]")
+            for m in np.unique(month):
+                part = df[month == m].sort_values(["latitude", "longitude", "time"])
+                key = (m.astype(object).year, m.astype(object).month)
+                if key not in writers:
+                    out_dir = os.path.join(root, f"year={key[0]:04d}", f"month={key[1]:02d}")
+                    os.makedirs(out_dir, exist_ok=True)
+                    path = os.path.join(out_dir, f"{source}.parquet")
+                    writers[key] = (path, pq.ParquetWriter(path + ".tmp", schema, compression="zstd"))
+                writers[key][1].write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False),
+                                            row_group_size=ERA5_ROW_GROUP)
+    except BaseException:
+        for path, writer in writers.values():
+            writer.close()
+            os.remove(path + ".tmp")
+        raise
+
+    written = []
+    for key in sorted(writers):
+        path, writer = writers[key]
+        writer.close()
+        os.replace(path + ".tmp", path)
+        written.append(path)
+    if not rows:
+        raise ValueError(f"{source}: no gridded variables found")
+
+    meta = _read_meta(root) or {"latitudes": [], "longitudes": [], "variables": [],
+                                "time_min": None, "time_max": None}
+    meta["latitudes"] = sorted(set(meta["latitudes"]) | lats)
+    meta["longitudes"] = sorted(set(meta["longitudes"]) | lons)
+    meta["variables"] = sorted(set(meta["variables"]) | set(variables))
+    meta["time_min"] = t_min if meta["time_min"] is None else min(meta["time_min"], t_min)
+    meta["time_max"] = t_max if meta["time_max"] is None else max(meta["time_max"], t_max)
+    with open(os.path.join(root, META_FILE + ".tmp"), "w") as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(root, META_FILE + ".tmp"), os.path.join(root, META_FILE))
+    meta["written"] = written
+    meta["rows"] = rows
+    return meta
+
+
+def _read_meta(root: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(root, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ==============================
+# ✅ LOOKUP
+# ==============================
+class ERA5Store:
+    """Read side of the store: nearest-cell hourly series between two times."""
+
+    def __init__(self, root: str = ERA5_STORE_DIR, cache_size: int = ERA5_CACHE_SIZE):
+        meta = _read_meta(root)
+        if meta is None:
+            raise FileNotFoundError(f"no ERA5 store at {root}")
+        self.root = root
+        self.lat = np.asarray(meta["latitudes"], dtype=np.float64)
+        self.lon = np.asarray(meta["longitudes"], dtype=np.float64)
+        self.variables = list(meta["variables"])
+        self.time_min = int(meta["time_min"])
+        self.time_max = int(meta["time_max"])
+        self._cache: "OrderedDict[tuple, pd.DataFrame]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def nearest_cell(self, lat: float, lon: float):
+        return (float(self.lat[np.abs(self.lat - lat).argmin()]),
+                float(self.lon[np.abs(self.lon - lon).argmin()]))
+
+    def _months(self, start: int, end: int) -> List[tuple]:
+        first = pd.Timestamp(start, unit="s").to_period("M")    # naive UTC
+        last = pd.Timestamp(end, unit="s").to_period("M")
+        return [(p.year, p.month) for p in pd.period_range(first, last, freq="M")]
+
+    def _cell_month(self, cell: tuple, year: int, month: int) -> pd.DataFrame:
+        key = (cell, year, month)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                return hit
+        import pyarrow.parquet as pq
+        part_dir = os.path.join(self.root, f"year={year:04d}", f"month={month:02d}")
+        frames = []
+        if os.path.isdir(part_dir):
+            filters = [("latitude", "=", np.float32(cell[0])), ("longitude", "=", np.float32(cell[1]))]
+            for name in sorted(os.listdir(part_dir)):
+                if name.endswith(".parquet"):
+                    frames.append(pq.read_table(os.path.join(part_dir, name), filters=filters).to_pandas())
+        df = (pd.concat(frames, ignore_index=True) if frames
+              else pd.DataFrame(columns=["time"] + self.variables))
+        df = df.drop(columns=[c for c in ("latitude", "longitude") if c in df.columns])
+        df = df.groupby("time", as_index=False).first().sort_values("time", ignore_index=True)
+        with self._lock:
+            self._cache[key] = df
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return df
+
+    def point(self, lat: float, lon: float, start: int, end: int,
+              variables: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Hourly rows (time + variables) of the grid cell nearest (lat, lon), start <= time <= end."""
+        cell = self.nearest_cell(lat, lon)
+        parts = [self._cell_month(cell, y, m) for y, m in self._months(start, end)]
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["time"])
+        df = df[(df["time"] >= start) & (df["time"] <= end)]
+        if variables is not None:
+            df = df.reindex(columns=["time", *variables])
+        return df.reset_index(drop=True)
+
+    def analog_start(self, ts: float, hours: int) -> int:
+        """
+        Start of the stored window used for a request at ts: ts itself when
+        covered, else the same calendar hour in the latest covered year, else
+        the last `hours` hours of the store.
+        """
+        t = pd.Timestamp(int(ts) // SECONDS_PER_HOUR * SECONDS_PER_HOUR, unit="s", tz="UTC")
+        end_margin = (hours - 1) * SECONDS_PER_HOUR
+        for years_back in range(0, 100):
+            cand = int((t - pd.DateOffset(years=years_back)).timestamp())
+            if cand + end_margin <= self.time_max:
+                if cand >= self.time_min:
+                    return cand
+                break
+        return max(self.time_min, self.time_max - end_margin)
+
+    def weather_frame(self, lat: float, lon: float, start_ts: float, hours: int = 72) -> pd.DataFrame:
+        """
+        `hours` hourly rows shaped like the Open-Meteo frame in routing_core
+        (time, temperature °C, wind_speed km/h, humidity %, pressure hPa),
+        relabelled to start at start_ts. Variables absent from the store are NaN.
+        """
+        src = self.analog_start(start_ts, hours)
+        df = self.point(lat, lon, src, src + (hours - 1) * SECONDS_PER_HOUR)
+        col = lambda name: df[name].to_numpy(np.float64) if name in df.columns else np.full(len(df), np.nan)
+        t2m_c = col("t2m") - 273.15
+        d2m_c = col("d2m") - 273.15
+        # Relative humidity from temperature and dew point (Magnus formula)
+        rh = 100.0 * np.exp(17.625 * d2m_c / (243.04 + d2m_c) - 17.625 * t2m_c / (243.04 + t2m_c))
+        shift = int(start_ts) // SECONDS_PER_HOUR * SECONDS_PER_HOUR - src
+        return pd.DataFrame({
+            "time": df["time"].to_numpy(np.int64) + shift,
+            "temperature": t2m_c,
+            "wind_speed": np.hypot(col("u10"), col("v10")) * 3.6,
+            "humidity": np.clip(rh, 0.0, 100.0),
+            "pressure": col("sp") / 100.0,
+        })
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store(root: str = ERA5_STORE_DIR) -> Optional[ERA5Store]:
+    """Shared store, opened on first use; None when no store has been ingested."""
+    global _STORE
+    if _STORE is None or _STORE.root != root:
+        with _STORE_LOCK:
+            if _STORE is None or _STORE.root != root:
+                try:
+                    _STORE = ERA5Store(root)
+                except FileNotFoundError:
+                    return None
+    return _STORE
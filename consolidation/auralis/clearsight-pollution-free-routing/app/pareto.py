@@ -0,0 +1,124 @@
+# app/pareto.py
+"""
+Multi-criteria label-setting search: all Pareto-optimal routes between two
+nodes for (travel time, pollution exposure, emissions) in one pass.
+
+Labels are settled in lexicographic order (time first), so a label popped at
+a node only needs a 2-D dominance check (exposure, emissions) against the
+labels already settled there. Labels dominated by a route already found at
+the destination are pruned early (target pruning).
+
+By default the search is exact and returns the whole front. Two optional
+approximations trade completeness for latency on dense graphs:
+  - eps:          epsilon-dominance; a label is dropped if another one is
+                  within (1 + eps) of it on every criterion (the result is an
+                  eps-approximate front)
+  - max_labels:   cap on settled labels per node (fastest kept)
+To return fewer routes without losing Pareto-optimal ones, search exactly and
+reduce the front with thin_front().
+"""
+import heapq
+from typing import List, Dict, Optional
+
+import numpy as np
+
+DEFAULT_EPS = 0.0          # exact
+DEFAULT_MAX_LABELS = None  # no per-node cap
+
+
+def _dominated(labels: List[tuple], x: float, m: float, eps: float) -> bool:
+    """True if some (x', m') in labels has x' <= x*(1+eps) and m' <= m*(1+eps)."""
+    fx, fm = x * (1 + eps), m * (1 + eps)
+    for lx, lm in labels:
+        if lx <= fx and lm <= fm:
+            return True
+    return False
+
+
+def pareto_paths(edge_indptr: np.ndarray, edge_order: np.ndarray, edge_v: np.ndarray,
+                 time: np.ndarray, exposure: np.ndarray, emission: np.ndarray,
+                 orig: int, dest: int,
+                 eps: float = DEFAULT_EPS, max_labels: Optional[int] = DEFAULT_MAX_LABELS) -> List[Dict]:
+    """
+    Pareto set of paths orig -> dest over an edge-level CSR
+    (edge_order[edge_indptr[u]:edge_indptr[u+1]] = edge ids leaving node u).
+
+    Returns [{"edges": [edge ids], "nodes": [node idx], "time", "exposure", "emission"}]
+    sorted by time. With eps=0 and no max_labels this is the complete front.
+    """
+    if max_labels is None:
+        max_labels = float("inf")
+    indptr = edge_indptr.tolist()
+    order = edge_order.tolist()
+    heads = edge_v.tolist()
+    c_t, c_x, c_m = time.tolist(), exposure.tolist(), emission.tolist()
+
+    # Label store: parallel lists indexed by label id
+    l_node, l_pred, l_edge = [orig], [-1], [-1]
+    settled: Dict[int, List[tuple]] = {}
+    found: List[tuple] = []        # (x, m) of destination labels, for target pruning
+    found_ids: List[int] = []
+    heap = [(0.0, 0.0, 0.0, 0)]
+    push, pop = heapq.heappush, heapq.heappop
+
+    while heap:
+        t, x, m, lid = pop(heap)
+        u = l_node[lid]
+        if found and _dominated(found, x, m, eps):
+            continue
+        at_u = settled.setdefault(u, [])
+        if len(at_u) >= max_labels or _dominated(at_u, x, m, eps):
+            continue
+        at_u.append((x, m))
+
+        if u == dest:
+            found.append((x, m))
+            found_ids.append((t, x, m, lid))
+            continue
+
+        for j in range(indptr[u], indptr[u + 1]):
+            e = order[j]
+            v = heads[e]
+            nt, nx_, nm = t + c_t[e], x + c_x[e], m + c_m[e]
+            at_v = settled.get(v)
+            if at_v and (len(at_v) >= max_labels or _dominated(at_v, nx_, nm, eps)):
+                continue
+            if found and _dominated(found, nx_, nm, eps):
+                continue
+            l_node.append(v)
+            l_pred.append(lid)
+            l_edge.append(e)
+            push(heap, (nt, nx_, nm, len(l_node) - 1))
+
+    routes = []
+    for t, x, m, lid in found_ids:
+        edges, nodes = [], [l_node[lid]]
+        k = lid
+        while l_pred[k] != -1:
+            edges.append(l_edge[k])
+            k = l_pred[k]
+            nodes.append(l_node[k])
+        edges.reverse()
+        nodes.reverse()
+        routes.append({"edges": edges, "nodes": nodes, "time": t, "exposure": x, "emission": m})
+    routes.sort(key=lambda r: r["time"])
+    return routes
+
+
+def thin_front(routes: List[Dict], max_routes: Optional[int]) -> List[Dict]:
+    """
+    Reduce a time-sorted front to at most max_routes, always keeping the best
+    route for each criterion and spreading the rest evenly along the front.
+    """
+    if not max_routes or len(routes) <= max_routes:
+        return routes
+    keep = {0}
+    keep.add(min(range(len(routes)), key=lambda i: routes[i]["exposure"]))
+    keep.add(min(range(len(routes)), key=lambda i: routes[i]["emission"]))
+    keep = set(sorted(keep)[:max_routes])
+    rest = [i for i in range(len(routes)) if i not in keep]
+    n_more = max_routes - len(keep)
+    if n_more > 0 and rest:
+        picks = np.linspace(0, len(rest) - 1, n_more).round().astype(int)
+        keep.update(rest[i] for i in picks)
+    return [routes[i] for i in sorted(keep)]
@@ -0,0 +1,147 @@
+# app/pollution_field.py
+"""
+Versioned pollution field shared by /api/route and /api/pollution_points.
+
+The forecast (Open-Meteo + LSTM + virtual stations) is expensive, so it is
+produced off the request path and published as an immutable snapshot.
+Readers only ever grab the current snapshot reference:
+
+  - no snapshot yet          -> the first caller loads one synchronously
+  - age < ttl                -> served as-is
+  - ttl <= age < max_stale   -> served stale, a background refresh is kicked off
+  - age >= max_stale         -> the caller waits for a fresh load
+"""
+import os
+import time
+import hashlib
+import threading
+from typing import Callable, Dict, List, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+POLLUTION_FIELD_TTL = float(os.environ.get("POLLUTION_FIELD_TTL", 600))          # seconds
+POLLUTION_FIELD_MAX_STALE = float(os.environ.get("POLLUTION_FIELD_MAX_STALE", 3600))
+
+
+class PollutionField:
+    """
+    One forecast run. Treat as read-only: a new run produces a new object
+    with a higher version instead of mutating this one.
+    """
+    __slots__ = ("version", "stations", "points", "created_at", "hourly_times", "hourly_ps", "digest")
+
+    def __init__(self, version: int, stations: pd.DataFrame, created_at: float):
+        self.version = version
+        self.stations = stations
+        self.created_at = created_at
+        # Heatmap payload, built column-wise once per version
+        self.points = [
+            {"lat": float(la), "lon": float(lo), "ps": float(ps)}
+            for la, lo, ps in zip(stations["station_lat"].to_numpy(),
+                                  stations["station_lon"].to_numpy(),
+                                  stations["PS"].to_numpy())
+        ]
+        # City-wide hourly series (epoch seconds, mean PS per forecast hour).
+        # Loaders without a `time` column give a single hour starting now.
+        if "time" in stations.columns and len(stations):
+            hourly = stations.groupby("time")["PS"].mean().sort_index()
+            self.hourly_times = hourly.index.to_numpy(dtype=np.float64)
+            self.hourly_ps = hourly.to_numpy(dtype=np.float64)
+        else:
+            self.hourly_times = np.array([created_at - created_at % 3600.0])
+            self.hourly_ps = np.array([float(stations["PS"].mean()) if len(stations) else 0.0])
+
+        # Content hash: identifies the same forecast across processes (cache keys)
+        h = hashlib.sha1()
+        for col in ("station_lat", "station_lon", "PS"):
+            h.update(np.ascontiguousarray(stations[col].to_numpy(dtype=np.float64)).tobytes())
+        h.update(np.ascontiguousarray(self.hourly_times).tobytes())
+        self.digest = h.hexdigest()[:16]
+
+    def age(self, now: Optional[float] = None) -> float:
+        return (now if now is not None else time.time()) - self.created_at
+
+
+class PollutionFieldStore:
+    """
+    Holds the current PollutionField and refreshes it with stale-while-revalidate.
+    `loader` must return a DataFrame with station_lat, station_lon and PS columns.
+    """
+
+    def __init__(self, loader: Callable[[], pd.DataFrame],
+                 ttl: float = POLLUTION_FIELD_TTL,
+                 max_stale: float = POLLUTION_FIELD_MAX_STALE):
+        self._loader = loader
+        self.ttl = ttl
+        self.max_stale = max(max_stale, ttl)
+        self._field = None
+        self._version = 0
+        self._refresh_lock = threading.Lock()   # one loader run at a time
+        self._refresh_thread = None
+        self.last_error = None
+
+    def current(self) -> PollutionField:
+        """Return the snapshot to use for this request (see module docstring)."""
+        field = self._field
+        if field is None:
+            return self.refresh()
+
+        age = field.age()
+        if age >= self.max_stale:
+            return self.refresh()
+        if age >= self.ttl:
+            self.refresh_async()
+        return field
+
+    @property
+    def version(self) -> int:
+        field = self._field
+        return field.version if field is not None else 0
+
+    def refresh(self) -> PollutionField:
+        """Load a new field synchronously. Concurrent callers share a single load."""
+        seen = self._field
+        with self._refresh_lock:
+            # Someone else published while we were waiting for the lock
+            if self._field is not None and self._field is not seen:
+                return self._field
+            try:
+                stations = self._loader()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[pollution_field] refresh failed: {e}")
+                if self._field is not None:
+                    return self._field
+                raise
+            self._version += 1
+            field = PollutionField(self._version, stations.reset_index(drop=True), time.time())
+            self._field = field   # atomic reference swap
+            self.last_error = None
+            return field
+
+    def refresh_async(self) -> None:
+        """Start a background refresh unless one is already running."""
+        t = self._refresh_thread
+        if t is not None and t.is_alive():
+            return
+        t = threading.Thread(target=self._refresh_quietly, name="pollution-field-refresh", daemon=True)
+        self._refresh_thread = t
+        t.start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
+
+    def status(self) -> Dict[str, Any]:
+        field = self._field
+        return {
+            "version": field.version if field is not None else 0,
+            "age_s": round(field.age(), 1) if field is not None else None,
+            "ttl_s": self.ttl,
+            "max_stale_s": self.max_stale,
+            "stations": len(field.stations) if field is not None else 0,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,146 @@
+# app/pollution_raster.py
+"""
+Server-side pollution heatmap.
+
+The station PS values of one PollutionField are interpolated (inverse
+distance weighting) onto a fixed lat/lon grid once per field version and
+kept in two compact encodings:
+
+  - png    RGBA image (same green→red scale as the frontend) for a Leaflet
+           imageOverlay; encoded with zlib from the standard library
+  - f16    raw little-endian float16 PS grid, row 0 = north, for clients
+           that want the values (e.g. custom colouring or probing)
+
+Both are served with an ETag derived from the field digest, so repeat
+fetches of an unchanged forecast are answered with 304.
+"""
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Any, Tuple
+
+import numpy as np
+
+POLLUTION_RASTER_SIZE = int(os.environ.get("POLLUTION_RASTER_SIZE", 256))   # cells on the longer side
+IDW_POWER = 2.0
+PS_COLOR_MAX = 500.0       # PS mapped to full red (matches getColorForPS in script.js)
+RASTER_ALPHA = 150         # 0–255 overlay opacity
+_IDW_CHUNK = 16384         # grid cells per distance block (bounds memory with many stations)
+
+
+def idw_grid(lat: np.ndarray, lon: np.ndarray, values: np.ndarray,
+             bounds: Tuple[float, float, float, float], shape: Tuple[int, int],
+             power: float = IDW_POWER) -> np.ndarray:
+    """
+    IDW-interpolate station values onto a (rows, cols) grid of cell centres
+    over bounds = (min_lat, min_lon, max_lat, max_lon). Row 0 is the north edge.
+    Distances use an equirectangular projection about the grid's mid-latitude.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounds
+    rows, cols = shape
+    lat_c = max_lat - (np.arange(rows) + 0.5) * (max_lat - min_lat) / rows
+    lon_c = min_lon + (np.arange(cols) + 0.5) * (max_lon - min_lon) / cols
+    kx = np.cos(np.radians((min_lat + max_lat) / 2))
+
+    gy = np.repeat(lat_c, cols)
+    gx = np.tile(lon_c, rows) * kx
+    sy = np.asarray(lat, dtype=np.float64)
+    sx = np.asarray(lon, dtype=np.float64) * kx
+    v = np.asarray(values, dtype=np.float64)
+
+    out = np.empty(rows * cols)
+    for lo in range(0, len(out), _IDW_CHUNK):
+        hi = min(lo + _IDW_CHUNK, len(out))
+        d2 = (gy[lo:hi, None] - sy[None, :]) ** 2 + (gx[lo:hi, None] - sx[None, :]) ** 2
+        w = 1.0 / np.maximum(d2, 1e-18) ** (power / 2)
+        out[lo:hi] = (w @ v) / w.sum(axis=1)
+    return out.reshape(rows, cols)
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Minimal RGBA8 PNG writer (filter type 0 on every row)."""
+    h, w, _ = rgba.shape
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + _png_chunk(b"IEND", b""))
+
+
+def colorize(ps: np.ndarray) -> np.ndarray:
+    """PS grid -> RGBA uint8, same scale as the frontend: r = 255v, g = 255(1 - v), b = 50."""
+    v = np.clip(ps / PS_COLOR_MAX, 0.0, 1.0)
+    rgba = np.empty(ps.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.round(255 * v)
+    rgba[..., 1] = np.round(255 * (1 - v))
+    rgba[..., 2] = 50
+    rgba[..., 3] = RASTER_ALPHA
+    return rgba
+
+
+class PollutionRaster:
+    """Interpolated PS grid for one PollutionField, with its PNG / float16 encodings."""
+
+    def __init__(self, field, bounds: Tuple[float, float, float, float],
+                 size: int = POLLUTION_RASTER_SIZE):
+        min_lat, min_lon, max_lat, max_lon = bounds
+        # Keep cells roughly square on the ground
+        h_m = max_lat - min_lat
+        w_m = (max_lon - min_lon) * np.cos(np.radians((min_lat + max_lat) / 2))
+        if w_m >= h_m:
+            shape = (max(1, int(round(size * h_m / w_m))) if w_m > 0 else 1, size)
+        else:
+            shape = (size, max(1, int(round(size * w_m / h_m))))
+
+        st = field.stations
+        if len(st):
+            grid = idw_grid(st["station_lat"].to_numpy(), st["station_lon"].to_numpy(),
+                            st["PS"].to_numpy(), bounds, shape)
+        else:
+            grid = np.zeros(shape)
+
+        self.version = field.version
+        self.bounds = bounds
+        self.shape = shape
+        self.etag = f"{field.digest}-{shape[0]}x{shape[1]}"
+        self.ps_min = float(grid.min())
+        self.ps_max = float(grid.max())
+        self.f16 = grid.astype("<f2").tobytes()
+        self.png = encode_png(colorize(grid))
+
+    def meta(self) -> Dict[str, Any]:
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        return {
+            "version": self.version,
+            "etag": self.etag,
+            "bounds": [[min_lat, min_lon], [max_lat, max_lon]],
+            "shape": list(self.shape),
+            "ps_min": round(self.ps_min, 1),
+            "ps_max": round(self.ps_max, 1),
+            "png_bytes": len(self.png),
+            "f16_bytes": len(self.f16),
+        }
+
+
+_RASTER = None
+_RASTER_LOCK = threading.Lock()
+
+
+def get_raster(field, bounds: Tuple[float, float, float, float]) -> PollutionRaster:
+    """Raster for this field version and bounds, rendered once and reused."""
+    global _RASTER
+    r = _RASTER
+    if r is not None and r.version == field.version and r.bounds == bounds:
+        return r
+    with _RASTER_LOCK:
+        r = _RASTER
+        if r is None or r.version != field.version or r.bounds != bounds:
+            r = PollutionRaster(field, bounds)
+            _RASTER = r
+    return r
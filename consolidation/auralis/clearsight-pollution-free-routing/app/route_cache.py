@@ -0,0 +1,156 @@
+# app/route_cache.py
+"""
+Bounded LRU + TTL cache for /api/route results.
+
+Keys are built by routing_core from the snapped endpoints, the quantized
+user weight and the pollution / traffic snapshot digests, so a new forecast
+or traffic refresh simply stops matching old entries. Every put also carries
+the ordered snapshot generation (pollution field version, edge weight
+version): a put for a newer generation drops the in-memory entries of older
+ones at once instead of waiting for them to age out, and a late put from a
+request that started on an older snapshot is discarded.
+
+Optionally backed by SQLite (ROUTE_CACHE_DB) so entries survive worker
+restarts and are shared between workers on the same machine. Digests are
+content hashes, so they stay valid across processes.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", 2048))
+ROUTE_CACHE_TTL = float(os.environ.get("ROUTE_CACHE_TTL", 900))        # seconds
+ROUTE_CACHE_DB = os.environ.get("ROUTE_CACHE_DB") or None               # path; unset = memory only
+ROUTE_CACHE_WEIGHT_STEP = float(os.environ.get("ROUTE_CACHE_WEIGHT_STEP", 0.05))
+
+_DISK_PRUNE_EVERY = 256   # puts between expired-row cleanups
+
+
+def quantize_weight(w: float, step: float = ROUTE_CACHE_WEIGHT_STEP) -> float:
+    """Snap a 0–1 slider weight to its bucket (the route is computed with the bucket value)."""
+    if step <= 0:
+        return float(w)
+    return round(round(float(w) / step) * step, 6)
+
+
+class RouteCache:
+    """
+    Thread-safe LRU with per-entry TTL. put() takes the key's snapshot
+    generation as a tuple of monotonically increasing versions;
+    `namespace` (e.g. the graph fingerprint) separates disk entries of
+    different graphs.
+    """
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_SIZE, ttl: float = ROUTE_CACHE_TTL,
+                 db_path: Optional[str] = ROUTE_CACHE_DB, namespace: str = ""):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self.namespace = namespace
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+        self._db = None
+        self._puts = 0
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("CREATE TABLE IF NOT EXISTS routes "
+                                 "(key TEXT PRIMARY KEY, created REAL, payload TEXT)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"[route_cache] disk store disabled: {e}")
+                self._db = None
+
+    def _disk_key(self, key: Tuple) -> str:
+        return json.dumps([self.namespace, *key])
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT created, payload FROM routes WHERE key = ?",
+                                           (self._disk_key(key),)).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row is not None and now - row[0] < self.ttl:
+                    value = json.loads(row[1])
+                    self._insert(key, row[0], value)
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: Tuple, value: Dict[str, Any], generation: Tuple[int, ...]) -> None:
+        now = time.time()
+        with self._lock:
+            current = self._generation
+            if current is not None and generation != current:
+                if any(g < c for g, c in zip(generation, current)):
+                    # Computed on a snapshot that has since been replaced
+                    self.stale_puts += 1
+                    return
+                # New forecast or traffic snapshot: nothing older can match again
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+            self._generation = generation
+            self._insert(key, now, value)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO routes VALUES (?, ?, ?)",
+                                     (self._disk_key(key), now, json.dumps(value)))
+                    self._puts += 1
+                    if self._puts % _DISK_PRUNE_EVERY == 0:
+                        self._db.execute("DELETE FROM routes WHERE created < ?", (now - self.ttl,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"[route_cache] disk write failed: {e}")
+
+    def _insert(self, key: Tuple, created: float, value: Dict[str, Any]) -> None:
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+                "disk": self._db is not None,
+            }
@@ -0,0 +1,409 @@
+# app/route_engine.py
+"""
+Array-based shortest path engine.
+
+Instead of calling a Python weight function for every relaxed edge
+(networkx), the per-edge cost is computed once as a NumPy array for the
+request, parallel edges are collapsed to their cheapest member with one
+`np.minimum.reduceat`, and Dijkstra runs in compiled code over a CSR matrix
+(scipy.sparse.csgraph).
+
+The CSR layout (one entry per distinct u->v pair, rows sorted by u) depends
+only on the graph topology, so it is built once per GraphArrays.
+
+Point-to-point queries can also run goal-directed:
+  - "astar":         A* with h(v) = scale * straight-line distance(v, dest)
+  - "bidirectional": bidirectional A* with average potentials
+  - "dijkstra":      full single-source csgraph Dijkstra
+  - "auto":          compiled Dijkstra on small graphs (it wins on wall time
+                     below a few tens of thousands of nodes even though it
+                     settles every node), bidirectional A* above that
+The scale is the largest constant that keeps h admissible and consistent
+for the given cost array: min over edges of cost / straight-line length.
+For travel_time that is 1 / (fastest observed speed on any edge).
+"""
+import os
+import math
+import heapq
+import threading
+from typing import List, Tuple, Dict, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+ROUTING_ALGORITHM = os.environ.get("ROUTING_ALGORITHM", "auto")
+ALGORITHMS = ("dijkstra", "astar", "bidirectional")
+# "auto" switches from compiled Dijkstra to bidirectional A* at this graph size
+AUTO_GOAL_DIRECTED_MIN_NODES = int(os.environ.get("AUTO_GOAL_DIRECTED_MIN_NODES", 20000))
+# Origins per compiled one-to-many Dijkstra batch in many_to_many (bounds memory)
+MATRIX_CHUNK = int(os.environ.get("MATRIX_CHUNK", 32))
+
+
+class NoRouteError(Exception):
+    """Raised when the destination cannot be reached from the origin."""
+
+
+class CostView:
+    """
+    One per-edge cost array collapsed onto the engine's CSR pairs, with the
+    derived forms each search needs built lazily and reused.
+    """
+
+    def __init__(self, engine: "RouteEngine", edge_cost: np.ndarray):
+        self.engine = engine
+        self.pair_cost = engine.pair_costs(edge_cost)
+        self._matrix = None
+        self._forward = None
+        self._reverse = None
+        self._scale = None
+        self._edge_cost = np.asarray(edge_cost, dtype=np.float64)
+        self._pair_edge = None
+
+    @property
+    def matrix(self) -> csr_matrix:
+        if self._matrix is None:
+            e = self.engine
+            self._matrix = csr_matrix((self.pair_cost, e.indices, e.indptr),
+                                      shape=(e.n_nodes, e.n_nodes))
+        return self._matrix
+
+    @property
+    def pair_edge(self) -> np.ndarray:
+        """Edge id of the cheapest parallel edge of each pair (the one routes use)."""
+        if self._pair_edge is None:
+            e = self.engine
+            cost = self._edge_cost[e.edge_order]
+            ranked = np.lexsort((cost, e.pair_id))
+            self._pair_edge = e.edge_order[ranked[e.pair_start]]
+        return self._pair_edge
+
+    @property
+    def forward(self) -> List[float]:
+        """Pair costs as a Python list aligned with engine.indices (for heap searches)."""
+        if self._forward is None:
+            self._forward = self.pair_cost.tolist()
+        return self._forward
+
+    @property
+    def reverse(self) -> List[float]:
+        """Pair costs aligned with engine.rev_indices (incoming edges)."""
+        if self._reverse is None:
+            self._reverse = self.pair_cost[self.engine.rev_order].tolist()
+        return self._reverse
+
+    @property
+    def heuristic_scale(self) -> float:
+        """Largest k such that k * straight-line distance never overestimates."""
+        if self._scale is None:
+            eu = self.engine.pair_euclid
+            mask = eu > 0
+            if not mask.any():
+                self._scale = 0.0
+            else:
+                # Slight shrink guards against float rounding breaking consistency
+                self._scale = max(0.0, float(np.min(self.pair_cost[mask] / eu[mask]))) * (1 - 1e-9)
+        return self._scale
+
+
+class RouteEngine:
+    """
+    CSR view of a GraphArrays topology plus shortest path queries on it.
+
+    edge_order   edges sorted by (u, v); parallel edges are contiguous
+    pair_start   offset in edge_order where each distinct (u, v) pair starts
+    indptr/indices  CSR structure over pairs (row = u, column = v)
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        n = arrays.n_nodes
+        u = arrays.edge_u.astype(np.int64)
+        v = arrays.edge_v.astype(np.int64)
+
+        order = np.lexsort((v, u))
+        pair_key = u[order] * n + v[order]
+        is_start = np.ones(len(order), dtype=bool)
+        is_start[1:] = pair_key[1:] != pair_key[:-1]
+
+        self.n_nodes = n
+        self.edge_order = order
+        self.pair_start = np.flatnonzero(is_start)
+        self.pair_id = np.cumsum(is_start) - 1                # pair of each edge_order slot
+        self.pair_key = pair_key[self.pair_start]          # sorted, for (u, v) lookups
+        self.pair_u = u[order][self.pair_start]
+        self.pair_v = v[order][self.pair_start]
+        self.indices = self.pair_v.astype(np.int32)
+        self.indptr = np.searchsorted(self.pair_u, np.arange(n + 1)).astype(np.int32)
+        # Edge-level CSR (parallel edges kept), for searches that cannot collapse them
+        self.edge_indptr = np.searchsorted(u[order], np.arange(n + 1)).astype(np.int32)
+
+        # Reverse (incoming) CSR over the same pairs, for backward searches
+        self.rev_order = np.lexsort((self.pair_u, self.pair_v))
+        self.rev_indices = self.pair_u[self.rev_order].astype(np.int32)
+        self.rev_indptr = np.searchsorted(self.pair_v[self.rev_order], np.arange(n + 1)).astype(np.int32)
+
+        # Straight-line length of each pair in projected meters (heuristic basis)
+        self.pair_euclid = np.hypot(arrays.node_x[self.pair_v] - arrays.node_x[self.pair_u],
+                                    arrays.node_y[self.pair_v] - arrays.node_y[self.pair_u])
+
+        # Plain lists: indexing them in the heap loops is much faster than ndarrays
+        self._indptr_l = self.indptr.tolist()
+        self._indices_l = self.indices.tolist()
+        self._rev_indptr_l = self.rev_indptr.tolist()
+        self._rev_indices_l = self.rev_indices.tolist()
+        self._x_l = arrays.node_x.tolist()
+        self._y_l = arrays.node_y.tolist()
+
+        self._lock = threading.Lock()
+        self._view_cache = {}   # (name, weights.version) -> CostView
+
+    # ------------------------------
+    # Cost arrays -> CSR matrices
+    # ------------------------------
+    def pair_costs(self, edge_cost: np.ndarray) -> np.ndarray:
+        """Cheapest parallel edge per (u, v) pair, aligned with self.indices."""
+        return np.minimum.reduceat(np.asarray(edge_cost, dtype=np.float64)[self.edge_order],
+                                   self.pair_start)
+
+    def costs(self, edge_cost: np.ndarray) -> CostView:
+        return CostView(self, edge_cost)
+
+    def matrix(self, edge_cost: np.ndarray) -> csr_matrix:
+        """CSR adjacency for one per-edge cost array (explicit zeros are kept as edges)."""
+        return self.costs(edge_cost).matrix
+
+    def cached_costs(self, name: str, version: int, edge_cost: np.ndarray) -> CostView:
+        """
+        costs() memoized per snapshot version, for costs that depend only on the
+        snapshot (e.g. travel_time). Only the latest version per name is kept.
+        """
+        key = (name, version)
+        view = self._view_cache.get(key)
+        if view is None:
+            view = self.costs(edge_cost)
+            with self._lock:
+                self._view_cache = {k: val for k, val in self._view_cache.items() if k[0] != name}
+                self._view_cache[key] = view
+        return view
+
+    # ------------------------------
+    # Queries
+    # ------------------------------
+    def shortest_path(self, graph: csr_matrix, orig: int, dest: int) -> Tuple[List[int], float]:
+        """
+        Dijkstra from node index `orig`; returns (node index path, total cost).
+        Raises NoRouteError if `dest` is unreachable.
+        """
+        dist, pred = dijkstra(graph, directed=True, indices=orig, return_predecessors=True)
+        if not np.isfinite(dist[dest]):
+            raise NoRouteError(f"No route between nodes {orig} and {dest}")
+        return _walk_predecessors(pred, orig, dest), float(dist[dest])
+
+    def search(self, costs: CostView, orig: int, dest: int,
+               algorithm: Optional[str] = None) -> Dict:
+        """
+        Point-to-point query with the chosen algorithm.
+        Returns {"path": [node idx...], "cost": float, "settled": int, "algorithm": str}.
+        """
+        algorithm = algorithm or ROUTING_ALGORITHM
+        if algorithm == "auto":
+            algorithm = "bidirectional" if self.n_nodes >= AUTO_GOAL_DIRECTED_MIN_NODES else "dijkstra"
+        if algorithm == "astar":
+            path, cost, settled = self._astar(costs, orig, dest)
+        elif algorithm == "bidirectional":
+            path, cost, settled = self._bidirectional(costs, orig, dest)
+        elif algorithm == "dijkstra":
+            path, cost = self.shortest_path(costs.matrix, orig, dest)
+            settled = self.n_nodes
+        else:
+            raise ValueError(f"Unknown routing algorithm: {algorithm} (expected auto or one of {ALGORITHMS})")
+        return {"path": path, "cost": cost, "settled": settled, "algorithm": algorithm}
+
+    def search_many(self, views: Dict[str, CostView], orig: int, dest: int,
+                    algorithm: Optional[str] = None) -> Dict[str, Dict]:
+        """Run search() for several cost views between the same snapped endpoints."""
+        return {name: self.search(view, orig, dest, algorithm) for name, view in views.items()}
+
+    def _astar(self, costs: CostView, orig: int, dest: int):
+        indptr, indices, cost = self._indptr_l, self._indices_l, costs.forward
+        xs, ys = self._x_l, self._y_l
+        k = costs.heuristic_scale
+        tx, ty = xs[dest], ys[dest]
+        hypot = math.hypot
+        push, pop = heapq.heappush, heapq.heappop
+
+        g = {orig: 0.0}
+        pred = {orig: -1}
+        closed = set()
+        heap = [(k * hypot(xs[orig] - tx, ys[orig] - ty), 0.0, orig)]
+        while heap:
+            _, gu, u = pop(heap)
+            if u in closed:
+                continue
+            if u == dest:
+                return _walk_dict(pred, dest), gu, len(closed) + 1
+            closed.add(u)
+            for j in range(indptr[u], indptr[u + 1]):
+                v = indices[j]
+                nd = gu + cost[j]
+                if nd < g.get(v, math.inf):
+                    g[v] = nd
+                    pred[v] = u
+                    push(heap, (nd + k * hypot(xs[v] - tx, ys[v] - ty), nd, v))
+        raise NoRouteError(f"No route between nodes {orig} and {dest}")
+
+    def _bidirectional(self, costs: CostView, orig: int, dest: int):
+        """
+        Bidirectional A* with the average potential
+            p(v) = k * (|v - dest| - |v - orig|) / 2
+        Both directions search the same reduced graph c'(a, b) = c(a, b) + p(b) - p(a) >= 0,
+        so the usual bidirectional Dijkstra stopping rule applies.
+        """
+        if orig == dest:
+            return [orig], 0.0, 1
+        xs, ys = self._x_l, self._y_l
+        k = costs.heuristic_scale * 0.5
+        sx, sy, tx, ty = xs[orig], ys[orig], xs[dest], ys[dest]
+        hypot = math.hypot
+        push, pop = heapq.heappush, heapq.heappop
+        pot = {}
+
+        def p(v):
+            val = pot.get(v)
+            if val is None:
+                val = k * (hypot(xs[v] - tx, ys[v] - ty) - hypot(xs[v] - sx, ys[v] - sy))
+                pot[v] = val
+            return val
+
+        sides = (
+            # dist, parent, closed, heap, indptr, indices, costs, sign
+            ({orig: 0.0}, {orig: -1}, set(), [(0.0, orig)],
+             self._indptr_l, self._indices_l, costs.forward, 1),
+            ({dest: 0.0}, {dest: -1}, set(), [(0.0, dest)],
+             self._rev_indptr_l, self._rev_indices_l, costs.reverse, -1),
+        )
+        best, meet = math.inf, -1
+        while sides[0][3] and sides[1][3]:
+            if sides[0][3][0][0] + sides[1][3][0][0] >= best:
+                break
+            # Expand the side with the smaller frontier
+            side = 0 if len(sides[0][3]) <= len(sides[1][3]) else 1
+            dist, parent, closed, heap, indptr, indices, cost, sign = sides[side]
+            other_dist = sides[1 - side][0]
+            du, u = pop(heap)
+            if u in closed:
+                continue
+            closed.add(u)
+            pu = p(u)
+            for j in range(indptr[u], indptr[u + 1]):
+                v = indices[j]
+                # forward: edge u->v, c + p(v) - p(u); backward: edge v->u, c + p(u) - p(v)
+                rc = cost[j] + sign * (p(v) - pu)
+                nd = du + (rc if rc > 0.0 else 0.0)
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    parent[v] = u
+                    push(heap, (nd, v))
+                    od = other_dist.get(v)
+                    if od is not None and nd + od < best:
+                        best, meet = nd + od, v
+        if meet < 0:
+            raise NoRouteError(f"No route between nodes {orig} and {dest}")
+
+        fwd = _walk_dict(sides[0][1], meet)
+        node, bwd = meet, []
+        while node != dest:
+            node = sides[1][1][node]
+            bwd.append(node)
+        path = fwd + bwd
+        return path, self.path_cost(costs, path), len(sides[0][2]) + len(sides[1][2])
+
+    def many_to_many(self, costs: CostView, origins: np.ndarray, dests: np.ndarray,
+                     metrics: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Route every origin to every destination on `costs` and total each
+        per-edge metric along the chosen paths.
+
+        One compiled one-to-many Dijkstra per chunk of origins gives the
+        shortest path trees; each metric is then summed from every node up to
+        its origin by pointer jumping over the predecessor array (log(depth)
+        vectorized passes instead of one path walk per pair).
+
+        Returns {"cost": (n_o, n_d), <metric>: (n_o, n_d), ...}; unreachable = inf.
+        """
+        origins = np.asarray(origins, dtype=np.int64)
+        dests = np.asarray(dests, dtype=np.int64)
+        n = self.n_nodes
+        pair_metrics = {name: np.asarray(m, dtype=np.float64)[costs.pair_edge]
+                        for name, m in metrics.items()}
+        out = {name: np.full((len(origins), len(dests)), np.inf) for name in ["cost", *metrics]}
+
+        for lo in range(0, len(origins), MATRIX_CHUNK):
+            rows = slice(lo, lo + MATRIX_CHUNK)
+            dist, pred = dijkstra(costs.matrix, directed=True, indices=origins[rows],
+                                  return_predecessors=True)
+            out["cost"][rows] = dist[:, dests]
+            if not pair_metrics:
+                continue
+
+            # Edge value into each tree node; roots and unreachable nodes point to themselves
+            has = pred >= 0
+            r, c = np.nonzero(has)
+            pairs = np.searchsorted(self.pair_key, pred[r, c].astype(np.int64) * n + c)
+            anc = np.where(has, pred, np.arange(n, dtype=pred.dtype)[None, :]).astype(np.int64)
+            acc = {}
+            for name, m in pair_metrics.items():
+                a = np.zeros(pred.shape)
+                a[r, c] = m[pairs]
+                acc[name] = a
+
+            # acc[v] = sum over the 2^i edges above v; double until every node reaches its root
+            while True:
+                nxt = np.take_along_axis(anc, anc, axis=1)
+                for name in acc:
+                    acc[name] += np.take_along_axis(acc[name], anc, axis=1)
+                if np.array_equal(nxt, anc):
+                    break
+                anc = nxt
+
+            reached = np.isfinite(dist[:, dests])
+            for name, a in acc.items():
+                out[name][rows] = np.where(reached, a[:, dests], np.inf)
+        return out
+
+    def path_pairs(self, path: List[int]) -> np.ndarray:
+        """CSR pair index of every hop of a node index path."""
+        p = np.asarray(path, dtype=np.int64)
+        if len(p) < 2:
+            return np.empty(0, dtype=np.int64)
+        return np.searchsorted(self.pair_key, p[:-1] * self.n_nodes + p[1:])
+
+    def path_edges(self, costs: CostView, path: List[int]) -> np.ndarray:
+        """Edge ids along a node index path (the cheapest parallel edge per hop under `costs`)."""
+        return costs.pair_edge[self.path_pairs(path)]
+
+    def path_cost(self, costs: CostView, path: List[int]) -> float:
+        """Sum of pair costs along a node index path."""
+        return float(costs.pair_cost[self.path_pairs(path)].sum())
+
+
+def _walk_dict(pred: Dict[int, int], dest: int) -> List[int]:
+    path = [dest]
+    node = pred[dest]
+    while node != -1:
+        path.append(node)
+        node = pred[node]
+    path.reverse()
+    return path
+
+
+def _walk_predecessors(pred: np.ndarray, orig: int, dest: int) -> List[int]:
+    path = [dest]
+    node = dest
+    while node != orig:
+        node = int(pred[node])
+        path.append(node)
+    path.reverse()
+    return path
@@ -1,16 +1,25 @@
 import os
 import time
+import threading
 import requests
-import networkx as nx
 import pandas as pd
 import numpy as np
-import osmnx as ox
-import geopandas as gpd
-from shapely.geometry import Point
 from scipy.spatial import cKDTree
-from typing import Dict, List, Tuple, Any
-
-from models.model_loader import run_model_prediction  # your AQI model
+# osmnx / geopandas are imported where the graph is built: they are slow to
+# import and only needed once per process (see preload()).
+from typing import Dict, List, Tuple, Any, Optional
+
+from models.model_loader import run_model_prediction, model_status  # your AQI model
+from pollution_field import PollutionFieldStore
+from edge_weights import GraphArrays, EdgeWeightStore
+from route_engine import RouteEngine, NoRouteError, AUTO_GOAL_DIRECTED_MIN_NODES
+from contraction_hierarchy import ContractionHierarchy
+from pareto import pareto_paths, thin_front
+from route_cache import RouteCache, quantize_weight
+from pollution_raster import get_raster
+from era5_store import get_store as get_era5_store
+from time_dependent import (TimeDependentPollution, td_route, best_departure,
+                            parse_timestamp, format_timestamp)
 
 PLACE = "New Delhi, India"
 
@@ -18,6 +27,9 @@ G_proj = None
 G_orig = None
 PLACE_POLYGON_GDF = None
 
+# Fixed seed so the virtual station layout does not jump between forecast refreshes
+VIRTUAL_STATION_SEED = 2024
+
 # ==============================
 # ✅ EMISSION MODEL (INDIAN NORMS)
 # ==============================
@@ -80,9 +92,47 @@ def compute_green_cost(T: float, P: float, E: float,
     return w_T * T + w_P * P + w_E * E
 
 
+def compute_green_cost_array(T: np.ndarray, P: np.ndarray, E: float,
+                             w_T: float = 0.3,
+                             w_P: float = 0.4,
+                             w_E: float = 0.3) -> np.ndarray:
+    """
+    compute_green_cost() for all edges at once: same clamping, same weights,
+    returns one cost per edge.
+    """
+    E = max(0.0, min(1.0, E))
+    return w_T * np.clip(T, 0.0, 1.0) + w_P * np.clip(P, 0.0, 1.0) + w_E * E
+
+
 # ==============================
 # ✅ LIVE AQI FORECAST → POLLUTION SCORE
 # ==============================
+FORECAST_HOURS = 72
+
+
+def _fetch_open_meteo(lat: float, lon: float) -> pd.DataFrame:
+    """Hourly weather for the next 3 days: time (UTC epoch s), temperature, wind_speed, humidity, pressure."""
+    url = (
+        "https://api.open-meteo.com/v1/forecast?"
+        f"latitude={lat}&longitude={lon}"
+        "&hourly=temperature_2m,wind_speed_10m,relative_humidity_2m,surface_pressure"
+        "&forecast_days=3"
+    )
+
+    r = requests.get(url, timeout=10)
+    r.raise_for_status()
+    hourly = r.json()["hourly"]
+
+    return pd.DataFrame({
+        # Forecast hour as UTC epoch seconds (Open-Meteo defaults to GMT)
+        "time": pd.to_datetime(hourly["time"], utc=True).astype("int64") // 10**9,
+        "temperature": hourly["temperature_2m"],
+        "wind_speed": hourly["wind_speed_10m"],
+        "humidity": hourly["relative_humidity_2m"],
+        "pressure": hourly["surface_pressure"],
+    })
+
+
 def get_forecast_data_from_model() -> pd.DataFrame:
     """
     Fetch live meteorological data, run your AQI model, and
@@ -91,23 +141,17 @@ def get_forecast_data_from_model() -> pd.DataFrame:
     try:
         lat, lon = 28.6139, 77.2090
 
-        url = (
-            "https://api.open-meteo.com/v1/forecast?"
-            f"latitude={lat}&longitude={lon}"
-            "&hourly=temperature_2m,wind_speed_10m,relative_humidity_2m,surface_pressure"
-            "&forecast_days=3"
-        )
-
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        hourly = r.json()["hourly"]
-
-        df = pd.DataFrame({
-            "temperature": hourly["temperature_2m"],
-            "wind_speed": hourly["wind_speed_10m"],
-            "humidity": hourly["relative_humidity_2m"],
-            "pressure": hourly["surface_pressure"],
-        })
+        try:
+            df = _fetch_open_meteo(lat, lon)
+        except Exception as e:
+            # Offline / API down: same hours from the local ERA5 store, if one was ingested
+            store = get_era5_store()
+            if store is None:
+                raise
+            print(f"[forecast] Open-Meteo unavailable ({e}); using local ERA5 reanalysis")
+            df = store.weather_frame(lat, lon, time.time(), hours=FORECAST_HOURS).ffill().bfill()
+            if df.empty or df.isna().any().any():
+                raise
 
         # Your ML model gives predicted AQI
         predicted_aqi = run_model_prediction(df)
@@ -118,10 +162,11 @@ def get_forecast_data_from_model() -> pd.DataFrame:
         # Scatter virtual stations around Delhi center
         center = (28.6129, 77.2295)
         n = len(df)
-        df["station_lat"] = center[0] + (np.random.rand(n) - 0.5) * 0.1
-        df["station_lon"] = center[1] + (np.random.rand(n) - 0.5) * 0.1
+        rng = np.random.default_rng(VIRTUAL_STATION_SEED)
+        df["station_lat"] = center[0] + (rng.random(n) - 0.5) * 0.1
+        df["station_lon"] = center[1] + (rng.random(n) - 0.5) * 0.1
 
-        return df[["station_lat", "station_lon", "PS"]]
+        return df[["station_lat", "station_lon", "PS", "time"]]
 
     except Exception:
         # Fallback if API/ML fails so app still works
@@ -132,239 +177,648 @@ def get_forecast_data_from_model() -> pd.DataFrame:
         })
 
 
+# Shared, versioned snapshot of the forecast above (see pollution_field.py).
+# Request handlers only read POLLUTION_FIELD.current(); the model runs off the request path.
+POLLUTION_FIELD = PollutionFieldStore(get_forecast_data_from_model)
+# Margin (degrees) around the road graph covered by the heatmap raster
+RASTER_PAD_DEG = float(os.environ.get("RASTER_PAD_DEG", 0.005))
+
+
 # ==============================
 # ✅ GRAPH LOADING
 # ==============================
+# Static array view of the graph + copy-on-write weight snapshots (see edge_weights.py)
+GRAPH_ARRAYS = None
+EDGE_WEIGHTS = None
+ROUTE_ENGINE = None
+_GRAPH_LOCK = threading.Lock()
+# Customizable contraction hierarchy for fastest routes (see contraction_hierarchy.py)
+CCH = None
+_CCH_METRIC = None
+# Hourly pollution per edge for the current forecast (see time_dependent.py)
+_TD_POLLUTION = None
+# LRU/TTL cache of /api/route results (see route_cache.py), created with the graph
+ROUTE_CACHE = None
+
+
 def _build_or_load_graph():
-    global G_proj, G_orig
+    global G_proj, G_orig, GRAPH_ARRAYS, EDGE_WEIGHTS, ROUTE_ENGINE
 
     if G_proj is None or G_orig is None:
-        print("Loading road network...")
-        # Use a smaller radius (2000m) to stay within Render's free tier memory limits (512MB).
-        # "New Delhi" as a place is too large and causes OOM kills.
-        G_orig = ox.graph_from_point((28.6139, 77.2090), dist=2000, network_type="drive")
-        G_proj = ox.project_graph(G_orig)
-
-        # Basic travel time estimate (length / speed)
-        for u, v, k, data in G_proj.edges(keys=True, data=True):
-            length = data.get("length", 100)  # meters
-            # Approx 30 km/h → 8.33 m/s
-            data["travel_time"] = length / 8.33
+        with _GRAPH_LOCK:
+            if G_proj is not None and G_orig is not None:
+                return G_proj
+            print("Loading road network...")
+            import osmnx as ox
+            # Use a smaller radius (2000m) to stay within Render's free tier memory limits (512MB).
+            # "New Delhi" as a place is too large and causes OOM kills.
+            g_orig = ox.graph_from_point((28.6139, 77.2090), dist=2000, network_type="drive")
+            g_proj = ox.project_graph(g_orig)
+
+            # Basic travel time estimate (length / speed)
+            for u, v, k, data in g_proj.edges(keys=True, data=True):
+                length = data.get("length", 100)  # meters
+                # Approx 30 km/h → 8.33 m/s
+                data["travel_time"] = length / 8.33
+
+            arrays = GraphArrays(g_proj, g_orig)
+            free_flow = np.array([g_proj.edges[key]["travel_time"] for key in arrays.edge_keys])
+            EDGE_WEIGHTS = EdgeWeightStore(arrays, free_flow)
+            ROUTE_ENGINE = RouteEngine(arrays)
+            GRAPH_ARRAYS = arrays
+            # Publish the graphs last: other threads test these to skip the lock
+            G_orig = g_orig
+            G_proj = g_proj
+            _load_contraction_hierarchy(background=not _PRELOADING)
 
     return G_proj
 
 
+def _load_contraction_hierarchy(background=True):
+    """
+    Use a prebuilt hierarchy from cache/ if it matches the graph. Large graphs
+    without one get it built (in the background unless background=False);
+    until then (and on small graphs, where compiled Dijkstra is already fast)
+    fastest routes use the route engine.
+    """
+    global CCH
+    try:
+        CCH = ContractionHierarchy.load(GRAPH_ARRAYS)
+    except Exception as e:
+        print(f"[cch] could not load hierarchy: {e}")
+        CCH = None
+    if CCH is None and GRAPH_ARRAYS.n_nodes >= AUTO_GOAL_DIRECTED_MIN_NODES:
+        if background:
+            threading.Thread(target=_build_contraction_hierarchy, name="cch-build", daemon=True).start()
+        else:
+            _build_contraction_hierarchy()
+
+
+def _build_contraction_hierarchy():
+    global CCH
+    try:
+        cch = ContractionHierarchy.build(ROUTE_ENGINE)
+        cch.save()
+        CCH = cch
+        recustomize_contraction_hierarchy()
+    except Exception as e:
+        print(f"[cch] background build failed: {e}")
+
+
+def recustomize_contraction_hierarchy(weights=None):
+    """
+    Customize the hierarchy for the current travel times. Called after traffic
+    refreshes; also done lazily by the first fastest-route query that needs it.
+    Returns the CCHMetric, or None when no hierarchy is available.
+    """
+    global _CCH_METRIC
+    cch = CCH
+    if cch is None:
+        return None
+    weights = weights or EDGE_WEIGHTS.current()
+    metric = _CCH_METRIC
+    if metric is not None and metric.version == weights.traffic_version:
+        return metric
+    tt = ROUTE_ENGINE.cached_costs("travel_time", weights.version, weights.travel_time)
+    metric = cch.customize(tt.pair_cost, version=weights.traffic_version)
+    _CCH_METRIC = metric
+    return metric
+
+
+# ==============================
+# ✅ PRELOAD (GUNICORN MASTER)
+# ==============================
+_PRELOADING = False
+PROCESS_STARTED = time.time()
+PRELOAD_STATS: Dict[str, Any] = {}
+
+
+def process_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def process_private_mb() -> Optional[float]:
+    """
+    Memory only this process holds (private clean + dirty pages), in MB.
+    For a forked worker this is its real cost on top of the shared preload.
+    None where /proc/self/smaps_rollup is unavailable.
+    """
+    try:
+        kb = 0
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                    kb += int(line.split()[1])
+        return round(kb / 1024.0, 1)
+    except OSError:
+        return None
+
+
+def preload(load_model: bool = True) -> Dict[str, Any]:
+    """
+    Build everything a request needs before the server forks: road graph,
+    edge arrays, route engine, contraction hierarchy (synchronously, since
+    threads do not survive fork) and, with load_model, the AQI model and the
+    first pollution field. Workers forked afterwards share these pages
+    copy-on-write.
+
+    Without load_model the pollution field is left to the workers as well:
+    building it runs the model, which would import TensorFlow in the master.
+    """
+    global _PRELOADING
+    t0 = time.time()
+    _PRELOADING = True
+    try:
+        _build_or_load_graph()
+        t_graph = time.time()
+        if load_model:
+            from models.model_loader import ensure_model_loaded
+            ensure_model_loaded()
+            _current_edge_weights()
+        t_model = time.time()
+        recustomize_contraction_hierarchy()
+    finally:
+        _PRELOADING = False
+    PRELOAD_STATS.update({
+        "graph_s": round(t_graph - t0, 2),
+        "model_s": round(t_model - t_graph, 2),
+        "pollution_field": load_model,
+        "total_s": round(time.time() - t0, 2),
+        "rss_mb": process_rss_mb(),
+        "nodes": GRAPH_ARRAYS.n_nodes,
+        "edges": GRAPH_ARRAYS.n_edges,
+    })
+    print(f"[preload] {PRELOAD_STATS}")
+    return dict(PRELOAD_STATS)
+
+
+def route_cache_status() -> Dict[str, Any]:
+    cache = ROUTE_CACHE
+    return cache.stats() if cache is not None else {"entries": 0, "hits": 0, "misses": 0}
+
+
+def server_status() -> Dict[str, Any]:
+    """Startup/memory figures for this worker (see /api/health)."""
+    return {
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - PROCESS_STARTED, 1),
+        "rss_mb": process_rss_mb(),
+        "private_mb": process_private_mb(),
+        "graph_loaded": G_proj is not None,
+        "preload": dict(PRELOAD_STATS) or None,
+        "model": model_status(),
+    }
+
+
 # ==============================
 # ✅ POLLUTION ASSIGNMENT (IDW)
 # ==============================
-def _assign_pollution_score_and_norms(G_proj, aqi_data):
+def _assign_pollution_score_and_norms(G_proj, aqi_data, pollution_version=None):
     """
-    Assign Pollution_Score to each edge via IDW interpolation.
-    Also compute normalized time (T) and pollution (P) for matrix routing.
+    Assign a Pollution_Score to each edge (nearest station to the edge centroid)
+    and publish it as a new edge weight snapshot. The snapshot derives the
+    normalized time (T) and pollution (P) used by matrix routing.
     """
-    edges = ox.graph_to_gdfs(G_proj, nodes=False, edges=True).reset_index()
+    import geopandas as gpd
+    arrays = GRAPH_ARRAYS
+    crs = G_proj.graph["crs"]
+
+    stations_gdf = gpd.GeoDataFrame(
+        aqi_data[["PS"]].copy(),
+        geometry=gpd.points_from_xy(aqi_data["station_lon"], aqi_data["station_lat"]),
+        crs="EPSG:4326",
+    )
+    stations_proj = stations_gdf.to_crs(crs)
 
-    stations = aqi_data.copy()
-    stations["geometry"] = [Point(xy) for xy in zip(stations["station_lon"], stations["station_lat"])]
-    stations_gdf = gpd.GeoDataFrame(stations, geometry="geometry", crs="EPSG:4326")
+    tree = cKDTree(np.column_stack([stations_proj.geometry.x, stations_proj.geometry.y]))
+    ps_vals = stations_proj["PS"].to_numpy(dtype=float)
 
-    stations_proj = stations_gdf.to_crs(edges.crs)
+    _, ind = tree.query(np.column_stack([arrays.centroid_x, arrays.centroid_y]))
+    return EDGE_WEIGHTS.publish_pollution(ps_vals[ind], pollution_version)
 
-    tree = cKDTree([(p.x, p.y) for p in stations_proj.geometry])
-    ps_vals = stations_proj["PS"].to_numpy()
 
-    # --- 1) Assign Pollution_Score ---
-    for idx, row in edges.iterrows():
-        pt = row.geometry.centroid
-        dist, ind = tree.query([pt.x, pt.y])
-        G_proj.edges[row.u, row.v, row.key]["Pollution_Score"] = float(ps_vals[ind])
+def _current_edge_weights():
+    """
+    Make sure the edge weights reflect the current pollution field and return
+    (field, weights). The returned snapshot never changes underneath the caller.
+    """
+    field = POLLUTION_FIELD.current()
+    G_proj = _build_or_load_graph()
+    weights = EDGE_WEIGHTS.current()
+    # Re-interpolate only when a newer forecast version has been published
+    if weights.pollution_version is None or weights.pollution_version < field.version:
+        weights = _assign_pollution_score_and_norms(G_proj, field.stations, field.version)
+    return field, weights
 
-    # --- 2) Compute normalized time & pollution for all edges ---
-    times = []
-    polls = []
-    edge_keys = []
 
-    for u, v, k, data in G_proj.edges(keys=True, data=True):
-        t_val = float(data.get("travel_time", 60.0))
-        p_val = float(data.get("Pollution_Score", 300.0))
-        times.append(t_val)
-        polls.append(p_val)
-        edge_keys.append((u, v, k))
+def _route_cache() -> RouteCache:
+    global ROUTE_CACHE
+    if ROUTE_CACHE is None:
+        from contraction_hierarchy import graph_fingerprint
+        ROUTE_CACHE = RouteCache(namespace=graph_fingerprint(GRAPH_ARRAYS)[:16])
+    return ROUTE_CACHE
 
-    times = np.array(times)
-    polls = np.array(polls)
 
-    t_min, t_max = times.min(), times.max()
-    p_min, p_max = polls.min(), polls.max()
+def _time_dependent_pollution(field, weights):
+    """
+    (n_edges, hours) pollution for this forecast: the snapshot's per-edge
+    scores scaled by the forecast's hourly city-wide curve. Built once per
+    pollution version; hour columns are materialized lazily.
+    """
+    global _TD_POLLUTION
+    td = _TD_POLLUTION
+    if td is not None and td.version == weights.pollution_version:
+        return td
+    td = TimeDependentPollution(weights.pollution_score, field.hourly_times[0],
+                                field.hourly_ps, version=weights.pollution_version)
+    _TD_POLLUTION = td
+    return td
+
+
+def _route_weights(user_weight):
+    """(E, w_T, w_P, w_E) for a slider value: more weight on pollution when user_weight is high."""
+    # For now, use a conceptual average emission factor E (e.g. mixed BS-IV/BS-VI fleet)
+    # In future, this can be made dynamic from real vehicle data.
+    avg_emission_factor = emission_factor_from_indian_norms("diesel", "BS4")
+    base_w_T, base_w_P, base_w_E = 0.3, 0.4, 0.3
+    w_T = base_w_T * (1 - 0.3 * user_weight)
+    w_P = base_w_P * (1 + 0.3 * user_weight)
+    w_E = base_w_E
+    return avg_emission_factor, w_T, w_P, w_E
 
-    t_range = (t_max - t_min) if t_max > t_min else 1.0
-    p_range = (p_max - p_min) if p_max > p_min else 1.0
 
-    for (u, v, k), t_val, p_val in zip(edge_keys, times, polls):
-        G_proj.edges[u, v, k]["time_norm"] = float((t_val - t_min) / t_range)
-        G_proj.edges[u, v, k]["poll_norm"] = float((p_val - p_min) / p_range)
+def _path_coords(path) -> List[List[float]]:
+    """[(lat, lon), ...] for a node index path."""
+    nodes = np.asarray(path, dtype=np.int64)
+    return np.column_stack([GRAPH_ARRAYS.node_lat[nodes], GRAPH_ARRAYS.node_lon[nodes]]).tolist()
 
-    return G_proj
+
+def _route_metrics(edges, weights, emission_factor, green_cost=None, ps=None) -> Dict[str, float]:
+    """
+    Per-route totals from the snapshot arrays (edges = edge ids along the route):
+      Time_min         Σ travel_time
+      Distance_km      Σ length
+      Exposure_PS_min  Σ travel_time × Pollution_Score (ps overrides the static scores)
+      Peak_PS          max Pollution_Score on the route
+      Emission         Σ E × length (E·km)
+      Green_Cost       Σ 3-variable edge cost, when green_cost is given
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    tt = weights.travel_time[edges]
+    ps = weights.pollution_score[edges] if ps is None else ps
+    km = float(GRAPH_ARRAYS.length[edges].sum()) / 1000.0
+    metrics = {
+        "Time_min": round(float(tt.sum()) / 60.0, 2),
+        "Distance_km": round(km, 3),
+        "Exposure_PS_min": round(float(tt @ ps) / 60.0, 1),
+        "Peak_PS": round(float(ps.max()), 1) if len(edges) else 0.0,
+        "Emission": round(emission_factor * km, 3),
+    }
+    if green_cost is not None:
+        metrics["Green_Cost"] = round(float(green_cost[edges].sum()), 4)
+    return metrics
 
 
 # ==============================
 # ✅ ROUTING MAIN FUNCTION (3-VARIABLE MATRIX)
 # ==============================
-def get_routes_and_metrics(start_coords, end_coords, user_weight):
+def get_routes_and_metrics(start_coords, end_coords, user_weight, depart_at=None):
     """
     Compute:
       - main_route: using 3-variable matrix cost (time, pollution, emission)
       - fastest_route: using only travel time
 
     user_weight can be used to slightly bias pollution vs time if needed.
+    Both routes are computed against a single edge weight snapshot.
+
+    depart_at (epoch seconds or ISO 8601, optional): price each edge's
+    pollution at the forecast hour the traveler enters it instead of using
+    the static per-edge score.
     """
-    aqi_data = get_forecast_data_from_model()
-    G_proj = _build_or_load_graph()
-    G_proj = _assign_pollution_score_and_norms(G_proj, aqi_data)
+    depart_ts = parse_timestamp(depart_at) if depart_at is not None else None
+    field, weights = _current_edge_weights()
+
+    # Nearest nodes (KD-tree over the graph's lat/lon)
+    o, d, orig, dest = _snap_endpoints(start_coords, end_coords)
+
+    # Repeated queries (same snapped endpoints, weight bucket and snapshots)
+    # are served from the route cache; the route is computed with the
+    # bucket's weight so cached and fresh answers agree.
+    user_weight = quantize_weight(user_weight)
+    key = (o, d, user_weight, None if depart_ts is None else int(depart_ts // 60),
+           field.digest, weights.traffic_digest)
+    cache = _route_cache()
+    result = cache.get(key)
+    if result is None:
+        result = _compute_routes(field, weights, o, d, orig, dest, user_weight,
+                                 None if depart_ts is None else (depart_ts // 60) * 60)
+        if "error" not in result:
+            cache.put(key, result, (field.version, weights.version))
+        cached = False
+    else:
+        cached = True
+    if "error" in result:
+        return result
+    return {**result, "map_center": [start_coords[0], start_coords[1]], "cached": cached,
+            "pollution_version": field.version, "weights_version": weights.version}
+
+
+def _compute_routes(field, weights, o, d, orig, dest, user_weight, depart_ts):
+    """Main + fastest route and their metrics for snapped endpoints (cacheable part of the response)."""
+    avg_emission_factor, w_T, w_P, w_E = _route_weights(user_weight)
+
+    # One cost per edge for this request's weights; both searches share the
+    # snapped endpoints and use goal-directed search over the CSR arrays
+    green_cost = compute_green_cost_array(weights.time_norm, weights.poll_norm,
+                                          avg_emission_factor, w_T=w_T, w_P=w_P, w_E=w_E)
+    views = {
+        # --- Fastest route using snapshot travel_time only ---
+        "fast": ROUTE_ENGINE.cached_costs("travel_time", weights.version, weights.travel_time),
+    }
+    fast_view = views["fast"]
+    td_main = None
+    if depart_ts is None:
+        # --- Main (green) route using matrix cost ---
+        views["main"] = ROUTE_ENGINE.costs(green_cost)
+    else:
+        # --- Main (green) route with pollution priced at the hour each edge is entered ---
+        static_cost = compute_green_cost_array(weights.time_norm, weights.poll_norm,
+                                               avg_emission_factor, w_T=w_T, w_P=0.0, w_E=w_E)
+        td_main = td_route(ROUTE_ENGINE.edge_indptr, ROUTE_ENGINE.edge_order,
+                           GRAPH_ARRAYS.edge_u, GRAPH_ARRAYS.edge_v, weights.travel_time,
+                           static_cost, w_P, _time_dependent_pollution(field, weights),
+                           depart_ts, o, d)
+        if td_main is None:
+            return {"error": f"No route between nodes {orig} and {dest}"}
+    cch_metric = recustomize_contraction_hierarchy(weights)
 
-    # Nearest nodes in original graph (lat, lon)
-    orig = ox.nearest_nodes(G_orig, start_coords[1], start_coords[0])
-    dest = ox.nearest_nodes(G_orig, end_coords[1], end_coords[0])
+    try:
+        if cch_metric is not None:
+            # Fastest route from the contraction hierarchy (travel_time metric)
+            path, cost, settled = CCH.query(cch_metric, o, d)
+            views.pop("fast")
+            results = ROUTE_ENGINE.search_many(views, o, d)
+            results["fast"] = {"path": path, "cost": cost, "settled": settled, "algorithm": "cch"}
+        else:
+            results = ROUTE_ENGINE.search_many(views, o, d)
+    except (NoRouteError, ValueError) as e:
+        return {"error": str(e)}
+    if td_main is not None:
+        results["main"] = {"path": td_main["nodes"], "cost": td_main["cost"],
+                           "settled": td_main["settled"], "algorithm": "time_dependent"}
+
+    # Edges each route actually uses, then all metrics as vectorized gathers
+    fast_edges = ROUTE_ENGINE.path_edges(fast_view, results["fast"]["path"])
+    if td_main is None:
+        main_edges = ROUTE_ENGINE.path_edges(views["main"], results["main"]["path"])
+        main_ps = None
+    else:
+        # Exposure priced at the forecast hour each edge is entered
+        main_edges = td_main["edges"]
+        main_ps = _time_dependent_pollution(field, weights).scores(main_edges, td_main["entry_ts"])
 
-    # For now, use a conceptual average emission factor E (e.g. mixed BS-IV/BS-VI fleet)
-    # In future, this can be made dynamic from real vehicle data.
-    avg_emission_factor = emission_factor_from_indian_norms("diesel", "BS4")
+    metrics = {
+        "Main_Route": _route_metrics(main_edges, weights, avg_emission_factor, green_cost, ps=main_ps),
+        "Fastest_Route": _route_metrics(fast_edges, weights, avg_emission_factor, green_cost),
+    }
 
-    # Optionally adjust weights using user_weight (0–1) to emphasize pollution vs time
-    # Example: more weight on pollution when user_weight is high
-    base_w_T, base_w_P, base_w_E = 0.3, 0.4, 0.3
-    w_T = base_w_T * (1 - 0.3 * user_weight)
-    w_P = base_w_P * (1 + 0.3 * user_weight)
-    w_E = base_w_E
+    response = {
+        "main_route_coords": _path_coords(results["main"]["path"]),
+        "fastest_route_coords": _path_coords(results["fast"]["path"]),
+        "metrics": metrics,
+        "pollution_version": field.version,
+        "weights_version": weights.version,
+        "search": {name: {"algorithm": r["algorithm"], "settled": r["settled"]}
+                   for name, r in results.items()},
+    }
+    if td_main is not None:
+        response["depart_at"] = format_timestamp(depart_ts)
+        response["arrive_at"] = format_timestamp(td_main["arrival_ts"])
+    return response
 
-    def matrix_cost(u, v, d):
-        T = d.get("time_norm", 0.5)
-        P = d.get("poll_norm", 0.5)
-        E = avg_emission_factor
-        return compute_green_cost(T, P, E, w_T=w_T, w_P=w_P, w_E=w_E)
-
-    # --- Main (green) route using matrix cost ---
-    main_route = nx.shortest_path(
-        G_proj,
-        orig,
-        dest,
-        weight=matrix_cost
-    )
 
-    # --- Fastest route using raw travel_time only ---
-    fast_route = nx.shortest_path(
-        G_proj,
-        orig,
-        dest,
-        weight="travel_time"
-    )
+# ==============================
+# ✅ MANY-TO-MANY ROUTE MATRIX
+# ==============================
+MAX_MATRIX_POINTS = int(os.environ.get("MAX_MATRIX_POINTS", 300))
 
-    def get_coords(route):
-        return [(G_orig.nodes[n]["y"], G_orig.nodes[n]["x"]) for n in route]
 
-    # Simple metrics for now (you can extend with real time/PS sums)
-    metrics = {
-        "Main_Route": {
-            "Time_min": len(main_route),  # placeholder: hop count
-        },
-        "Fastest_Route": {
-            "Time_min": len(fast_route),
-        }
+def _matrix_to_json(m: np.ndarray, scale: float, ndigits: int):
+    """Scaled, rounded nested lists with None for unreachable pairs."""
+    m = np.round(m * scale, ndigits)
+    return [[float(x) if np.isfinite(x) else None for x in row] for row in m]
+
+
+def get_route_matrix(origins, destinations=None, user_weight=0.5, mode="green"):
+    """
+    Time, distance and exposure between every origin and destination
+    (lists of (lat, lon)), all against one edge weight snapshot.
+
+    mode "green" routes on the same 3-variable cost as the main route,
+    "fastest" on travel time only. Metrics are summed along those routes.
+    """
+    field, weights = _current_edge_weights()
+    destinations = origins if destinations is None else destinations
+
+    pts = np.asarray(list(origins) + list(destinations), dtype=np.float64)
+    idx, _ = GRAPH_ARRAYS.nearest_nodes(pts[:, 0], pts[:, 1])
+    o, d = idx[:len(origins)], idx[len(origins):]
+
+    if mode == "fastest":
+        costs = ROUTE_ENGINE.cached_costs("travel_time", weights.version, weights.travel_time)
+    else:
+        avg_emission_factor, w_T, w_P, w_E = _route_weights(user_weight)
+        costs = ROUTE_ENGINE.costs(compute_green_cost_array(
+            weights.time_norm, weights.poll_norm, avg_emission_factor, w_T=w_T, w_P=w_P, w_E=w_E))
+
+    m = ROUTE_ENGINE.many_to_many(costs, o, d, {
+        "time": weights.travel_time,
+        "distance": GRAPH_ARRAYS.length,
+        "exposure": weights.travel_time * weights.pollution_score,
+    })
+
+    return {
+        "Time_min": _matrix_to_json(m["time"], 1 / 60.0, 2),
+        "Distance_km": _matrix_to_json(m["distance"], 1 / 1000.0, 3),
+        "Exposure_PS_min": _matrix_to_json(m["exposure"], 1 / 60.0, 1),
+        "origins_snapped": np.column_stack([GRAPH_ARRAYS.node_lat[o], GRAPH_ARRAYS.node_lon[o]]).tolist(),
+        "destinations_snapped": np.column_stack([GRAPH_ARRAYS.node_lat[d], GRAPH_ARRAYS.node_lon[d]]).tolist(),
+        "mode": mode,
+        "pollution_version": field.version,
+        "weights_version": weights.version,
     }
 
+
+# ==============================
+# ✅ BEST DEPARTURE WINDOW
+# ==============================
+def get_best_departure(start_coords, end_coords, user_weight,
+                       earliest=None, window_hours=6.0, step_minutes=60.0):
+    """
+    Run the time-dependent green route for departures every step_minutes over
+    the next window_hours and return the one with the lowest pollution
+    exposure (Σ travel_time × PS at the hour each edge is entered).
+    """
+    earliest_ts = parse_timestamp(earliest) if earliest is not None else time.time()
+    field, weights = _current_edge_weights()
+
+    o, d, orig, dest = _snap_endpoints(start_coords, end_coords)
+
+    avg_emission_factor, w_T, w_P, w_E = _route_weights(user_weight)
+    static_cost = compute_green_cost_array(weights.time_norm, weights.poll_norm,
+                                           avg_emission_factor, w_T=w_T, w_P=0.0, w_E=w_E)
+    td = _time_dependent_pollution(field, weights)
+
+    def route_at(ts):
+        return td_route(ROUTE_ENGINE.edge_indptr, ROUTE_ENGINE.edge_order,
+                        GRAPH_ARRAYS.edge_u, GRAPH_ARRAYS.edge_v, weights.travel_time,
+                        static_cost, w_P, td, ts, o, d)
+
+    ranked = best_departure(route_at, td, weights.travel_time, earliest_ts, window_hours, step_minutes)
+    if not ranked:
+        return {"error": f"No route between nodes {orig} and {dest} in the forecast window"}
+
+    best = ranked[0]
     return {
-        "main_route_coords": get_coords(main_route),
-        "fastest_route_coords": get_coords(fast_route),
-        "metrics": metrics,
+        "depart_at": format_timestamp(best["depart_ts"]),
+        "arrive_at": format_timestamp(best["arrival_ts"]),
+        "route_coords": _path_coords(best["nodes"]),
+        "Exposure_PS_min": round(best["exposure"] / 60.0, 1),
+        "candidates": [
+            {
+                "depart_at": format_timestamp(r["depart_ts"]),
+                "Exposure_PS_min": round(r["exposure"] / 60.0, 1),
+                "Time_min": round((r["arrival_ts"] - r["depart_ts"]) / 60.0, 2),
+            }
+            for r in sorted(ranked, key=lambda r: r["depart_ts"])
+        ],
+        "forecast_start": format_timestamp(td.hour_start),
+        "forecast_hours": td.hours,
         "map_center": [start_coords[0], start_coords[1]],
+        "pollution_version": field.version,
+        "weights_version": weights.version,
     }
 
 
 # ==============================
-# ✅ FRONTEND HELPERS
+# ✅ PARETO ROUTES (TIME / EXPOSURE / EMISSIONS)
 # ==============================
-def snap_to_nearest_node(latlon: Tuple[float, float]) -> Dict[str, Any]:
+def get_pareto_routes(start_coords, end_coords, max_routes=None, eps=0.0):
     """
-    Given (lat, lon) returns snapped node and its coordinates.
+    All Pareto-optimal routes for (travel time, pollution exposure, emissions)
+    in one search, so the client can move the weight slider locally.
+
+    The search is exact by default; max_routes only thins the returned routes
+    (front_size is the full front). eps > 0 prunes with epsilon-dominance for
+    speed, and the response is then marked as an approximate front.
+
+      time      = Σ travel_time                    (s)
+      exposure  = Σ travel_time × Pollution_Score  (PS·s)
+      emission  = Σ E × length                     (E·km, E = fleet emission factor)
     """
-    _build_or_load_graph()
-    lon = float(latlon[1])
-    lat = float(latlon[0])
+    field, weights = _current_edge_weights()
+
+    o, d, orig, dest = _snap_endpoints(start_coords, end_coords)
+
+    avg_emission_factor = emission_factor_from_indian_norms("diesel", "BS4")
+    lengths = GRAPH_ARRAYS.length
+    exposure = weights.travel_time * weights.pollution_score
+    emission = avg_emission_factor * lengths / 1000.0
+
+    front = pareto_paths(ROUTE_ENGINE.edge_indptr, ROUTE_ENGINE.edge_order, GRAPH_ARRAYS.edge_v,
+                         weights.travel_time, exposure, emission, o, d, eps=eps)
+    if not front:
+        return {"error": f"No route between nodes {orig} and {dest}"}
+    total = len(front)
+    front = thin_front(front, max_routes)
+
+    routes = [
+        {"coords": _path_coords(r["nodes"]),
+         "metrics": _route_metrics(r["edges"], weights, avg_emission_factor)}
+        for r in front
+    ]
 
-    node = ox.nearest_nodes(G_orig, lon, lat)
     return {
-        "lat": float(G_orig.nodes[node]["y"]),
-        "lon": float(G_orig.nodes[node]["x"]),
-        "node": int(node),
+        "routes": routes,
+        "front_size": total,
+        "exact": eps == 0,
+        "eps": eps,
+        "map_center": [start_coords[0], start_coords[1]],
+        "pollution_version": field.version,
+        "weights_version": weights.version,
     }
 
 
-
 # ==============================
-# ✅ SPATIAL INDEX HELPER
+# ✅ FRONTEND HELPERS
 # ==============================
-def _edge_midpoints_and_index(G):
-    """
-    Returns (coords, idx_map) for building a cKDTree of edge midpoints.
-    coords: (M, 2) array of (lat, lon)
-    idx_map: dict { index_in_coords -> (u, v, k) }
-    """
-    coords = []
-    idx_map = {}
-    
-    if G is None:
-        return np.array([]), {}
-
-    idx = 0
-    for u, v, k, data in G.edges(keys=True, data=True):
-        # We try to use 'geometry' if present (accurate midpoint)
-        # otherwise average of node coords.
-        try:
-            if "geometry" in data:
-                mid = data["geometry"].interpolate(0.5, normalized=True)
-                # If these are shapely points, accessing .y / .x works
-                coords.append([mid.y, mid.x])
-            else:
-                n1 = G.nodes[u]
-                n2 = G.nodes[v]
-                lat = (n1['y'] + n2['y']) / 2
-                lon = (n1['x'] + n2['x']) / 2
-                coords.append([lat, lon])
-            
-            idx_map[idx] = (u, v, k)
-            idx += 1
-        except Exception:
-            continue
-
-    return np.array(coords), idx_map
-
-
-_POLLUTION_CACHE = None
-_POLLUTION_CACHE_TS = 0.0
-_POLLUTION_CACHE_TTL = 60.0  # seconds
+def _snap_endpoints(start_coords, end_coords):
+    """(o, d, orig, dest): node indices and OSM ids nearest to two (lat, lon) points."""
+    idx, _ = GRAPH_ARRAYS.nearest_nodes([start_coords[0], end_coords[0]],
+                                        [start_coords[1], end_coords[1]])
+    o, d = int(idx[0]), int(idx[1])
+    node_ids = GRAPH_ARRAYS.node_ids
+    return o, d, int(node_ids[o]), int(node_ids[d])
+
+
+def snap_to_nearest_node(latlon: Tuple[float, float]) -> Dict[str, Any]:
+    """
+    Given (lat, lon) returns snapped node and its coordinates.
+    """
+    return snap_points([latlon])[0]
+
+
+def snap_points(points) -> List[Dict[str, Any]]:
+    """
+    Snap many (lat, lon) points in one KD-tree query. Returns one
+    {"lat", "lon", "node", "dist_m"} per point, in order.
+    """
+    _build_or_load_graph()
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    idx, dist = GRAPH_ARRAYS.nearest_nodes(pts[:, 0], pts[:, 1])
+    lat = GRAPH_ARRAYS.node_lat[idx]
+    lon = GRAPH_ARRAYS.node_lon[idx]
+    nodes = GRAPH_ARRAYS.node_ids[idx]
+    return [
+        {"lat": float(a), "lon": float(b), "node": int(n), "dist_m": round(float(m), 1)}
+        for a, b, n, m in zip(lat, lon, nodes, dist)
+    ]
 
 
 def get_pollution_points() -> List[Dict[str, Any]]:
     """
     Returns list of station points for heatmap:
       [{ "lat": ..., "lon": ..., "ps": ... }, ...]
+    Served from the current pollution field snapshot (same one /api/route uses).
     """
-    global _POLLUTION_CACHE, _POLLUTION_CACHE_TS
+    return POLLUTION_FIELD.current().points
 
-    now = time.time()
-    if _POLLUTION_CACHE and (now - _POLLUTION_CACHE_TS) < _POLLUTION_CACHE_TTL:
-        return _POLLUTION_CACHE
 
-    df = get_forecast_data_from_model()
-    out = []
+def pollution_field_digest() -> str:
+    """Content digest of the current pollution snapshot (ETag for /api/pollution_points)."""
+    return POLLUTION_FIELD.current().digest
 
-    for _, row in df.iterrows():
-        out.append({
-            "lat": float(row["station_lat"]),
-            "lon": float(row["station_lon"]),
-            "ps": float(row["PS"]),
-        })
 
-    _POLLUTION_CACHE = out
-    _POLLUTION_CACHE_TS = now
-    return out
+def get_pollution_raster():
+    """
+    Heatmap raster of the current pollution snapshot over the road graph's
+    extent (padded by RASTER_PAD_DEG), rendered once per snapshot.
+    """
+    _build_or_load_graph()
+    field = POLLUTION_FIELD.current()
+    bounds = (
+        round(float(GRAPH_ARRAYS.node_lat.min()) - RASTER_PAD_DEG, 6),
+        round(float(GRAPH_ARRAYS.node_lon.min()) - RASTER_PAD_DEG, 6),
+        round(float(GRAPH_ARRAYS.node_lat.max()) + RASTER_PAD_DEG, 6),
+        round(float(GRAPH_ARRAYS.node_lon.max()) + RASTER_PAD_DEG, 6),
+    )
+    return get_raster(field, bounds)
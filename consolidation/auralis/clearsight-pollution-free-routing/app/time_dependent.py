@@ -0,0 +1,232 @@
+# app/time_dependent.py
+"""
+Time-dependent pollution pricing over the 72-hour forecast.
+
+The forecast gives a spatial field (stations -> per-edge Pollution_Score) and
+an hourly city-wide AQI series. Edge pollution at hour h is modelled as
+
+    PS[e, h] = PS_base[e] * hourly[h] / mean(hourly)
+
+and stored as a (hours, n_edges) float16 block whose hour columns are only
+materialized when a search actually reaches that hour. `matrix` exposes the
+(n_edges, hours) view. The search reads hours through norm_list(), a Python
+list per hour kept in a small LRU (TD_NORM_LIST_CACHE hours, about 32 B per
+edge each) so a departure sweep does not hold the whole horizon as lists.
+
+td_route() is Dijkstra on the green cost where each edge's pollution term is
+priced at the hour the traveler enters it (departure time + travel time so
+far along the cost-optimal prefix). Travel times themselves are static, so
+arrival times are FIFO.
+"""
+import os
+import math
+import heapq
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+SECONDS_PER_HOUR = 3600.0
+TD_NORM_LIST_CACHE = int(os.environ.get("TD_NORM_LIST_CACHE", 3))   # hours kept as Python lists
+
+
+def parse_timestamp(value: Union[str, int, float]) -> float:
+    """
+    Epoch seconds from an epoch number or an ISO 8601 string.
+    Naive ISO times are taken as UTC (the forecast hours are UTC).
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def format_timestamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat(timespec="minutes")
+
+
+class TimeDependentPollution:
+    """Lazily materialized (n_edges, hours) float16 pollution field for one forecast version."""
+
+    def __init__(self, base_ps: np.ndarray, hour_start: float, hourly_ps: np.ndarray, version=None):
+        self.version = version
+        self.base = np.asarray(base_ps, dtype=np.float32)
+        hourly = np.asarray(hourly_ps, dtype=np.float64)
+        if hourly.size == 0:
+            hourly = np.ones(1)
+        mean = hourly.mean()
+        self.factor = (hourly / mean if mean > 0 else np.ones_like(hourly)).astype(np.float32)
+        self.hour_start = float(hour_start)
+        self.hours = len(self.factor)
+
+        # One normalization across all hours so costs are comparable over time
+        lo = float(self.base.min()) * float(self.factor.min()) if self.base.size else 0.0
+        hi = float(self.base.max()) * float(self.factor.max()) if self.base.size else 1.0
+        self._lo = lo
+        self._range = (hi - lo) if hi > lo else 1.0
+
+        self._data = None            # (hours, n_edges) float16, allocated on first use
+        self._ready = np.zeros(self.hours, dtype=bool)
+        self._norm_lists: "OrderedDict[int, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hour_index(self, ts: float) -> int:
+        h = int(math.floor((ts - self.hour_start) / SECONDS_PER_HOUR))
+        return min(max(h, 0), self.hours - 1)
+
+    def hour_of(self, ts: np.ndarray) -> np.ndarray:
+        h = np.floor((np.asarray(ts, dtype=np.float64) - self.hour_start) / SECONDS_PER_HOUR)
+        return np.clip(h, 0, self.hours - 1).astype(np.int64)
+
+    def column(self, h: int) -> np.ndarray:
+        """Pollution score of every edge at hour h (float16, materialized on demand)."""
+        if not self._ready[h]:
+            with self._lock:
+                if self._data is None:
+                    self._data = np.empty((self.hours, len(self.base)), dtype=np.float16)
+                if not self._ready[h]:
+                    self._data[h] = self.base * self.factor[h]
+                    self._ready[h] = True
+        return self._data[h]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """(n_edges, hours) view; materializes every hour."""
+        for h in range(self.hours):
+            self.column(h)
+        return self._data.T
+
+    def norm_list(self, h: int) -> List[float]:
+        """
+        0–1 normalized pollution at hour h as a Python list (for the search loop).
+        Only the TD_NORM_LIST_CACHE most recently used hours are kept.
+        """
+        with self._lock:
+            lst = self._norm_lists.get(h)
+            if lst is not None:
+                self._norm_lists.move_to_end(h)
+                return lst
+        col = self.column(h).astype(np.float64)
+        lst = np.clip((col - self._lo) / self._range, 0.0, 1.0).tolist()
+        with self._lock:
+            self._norm_lists[h] = lst
+            self._norm_lists.move_to_end(h)
+            while len(self._norm_lists) > max(TD_NORM_LIST_CACHE, 0):
+                self._norm_lists.popitem(last=False)
+        return lst
+
+    def scores(self, edges: np.ndarray, entry_ts: np.ndarray) -> np.ndarray:
+        """Pollution score of each path edge at the hour it is entered."""
+        if len(edges) == 0:
+            return np.empty(0)
+        hours = self.hour_of(entry_ts)
+        for h in np.unique(hours):
+            self.column(int(h))
+        return self._data[hours, edges].astype(np.float64)
+
+    def exposure(self, edges: np.ndarray, entry_ts: np.ndarray, travel_time: np.ndarray) -> float:
+        """Σ travel_time × PS(entry hour) along a path, vectorized."""
+        if len(edges) == 0:
+            return 0.0
+        return float((travel_time[edges] * self.scores(edges, entry_ts)).sum())
+
+
+def td_route(edge_indptr: np.ndarray, edge_order: np.ndarray,
+             edge_u: np.ndarray, edge_v: np.ndarray,
+             travel_time: np.ndarray, static_cost: np.ndarray, w_P: float,
+             td: TimeDependentPollution, depart_ts: float, orig: int, dest: int) -> Optional[Dict]:
+    """
+    Time-dependent Dijkstra on cost(e, t) = static_cost[e] + w_P * P_norm[e, hour(t)].
+    Returns {"edges", "nodes", "cost", "entry_ts", "arrival_ts", "settled"} or None
+    if unreachable.
+    """
+    indptr = edge_indptr.tolist()
+    order = edge_order.tolist()
+    heads = edge_v.tolist()
+    tt = travel_time.tolist()
+    static = static_cost.tolist()
+    hour_start, hours = td.hour_start, td.hours
+    push, pop = heapq.heappush, heapq.heappop
+
+    dist = {orig: 0.0}
+    arrive = {orig: float(depart_ts)}
+    pred = {}
+    done = set()
+    cols = {}
+    heap = [(0.0, orig)]
+    while heap:
+        c, u = pop(heap)
+        if u in done:
+            continue
+        done.add(u)
+        if u == dest:
+            break
+        t_u = arrive[u]
+        h = int((t_u - hour_start) // SECONDS_PER_HOUR)
+        h = 0 if h < 0 else (hours - 1 if h >= hours else h)
+        col = cols.get(h)
+        if col is None:
+            col = cols[h] = td.norm_list(h)
+        for j in range(indptr[u], indptr[u + 1]):
+            e = order[j]
+            v = heads[e]
+            nc = c + static[e] + w_P * col[e]
+            if nc < dist.get(v, math.inf):
+                dist[v] = nc
+                arrive[v] = t_u + tt[e]
+                pred[v] = e
+                push(heap, (nc, v))
+    if dest not in done:
+        return None
+
+    edges = []
+    x = dest
+    while x != orig:
+        e = pred[x]
+        edges.append(e)
+        x = int(edge_u[e])
+    edges.reverse()
+    edges = np.asarray(edges, dtype=np.int64)
+    nodes = np.concatenate([[orig], edge_v[edges]]).astype(np.int64)
+    entry_ts = float(depart_ts) + np.concatenate([[0.0], np.cumsum(travel_time[edges])[:-1]]) \
+        if len(edges) else np.empty(0)
+    return {
+        "edges": edges,
+        "nodes": nodes,
+        "cost": dist[dest],
+        "entry_ts": entry_ts,
+        "arrival_ts": arrive[dest],
+        "settled": len(done),
+    }
+
+
+def best_departure(route_fn, td: TimeDependentPollution, travel_time: np.ndarray,
+                   earliest_ts: float, window_hours: float, step_minutes: float) -> List[Dict]:
+    """
+    Evaluate route_fn(depart_ts) for departures every step_minutes over the next
+    window_hours (clipped to the forecast horizon). Returns one entry per
+    departure with its route and time-dependent exposure, best exposure first.
+    """
+    horizon = td.hour_start + td.hours * SECONDS_PER_HOUR
+    last = min(earliest_ts + window_hours * SECONDS_PER_HOUR, horizon)
+    step = max(step_minutes, 1.0) * 60.0
+    out = []
+    t = earliest_ts
+    while t <= last:
+        r = route_fn(t)
+        if r is not None:
+            r["depart_ts"] = t
+            r["exposure"] = td.exposure(r["edges"], r["entry_ts"], travel_time)
+            out.append(r)
+        t += step
+    out.sort(key=lambda r: (r["exposure"], r["depart_ts"]))
+    return out
@@ -2,23 +2,117 @@
 import os
 import time
 import math
+import uuid
+import threading
 import requests
 import numpy as np
-from typing import List, Dict, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Any, Optional
 
-# TomTom Flow Segment point endpoint (we query single points)
+# TomTom Flow Segment point endpoint (we query single points).
+# TOMTOM_BASE_URL can point at a local fake server for testing.
 TOMTOM_KEY = os.environ.get('TOMTOM_API_KEY', None)
-TOMTOM_FLOW_URL = "https://api.tomtom.com/traffic/services/4/flowSegmentData/absolute/10/json"
+TOMTOM_BASE_URL = os.environ.get('TOMTOM_BASE_URL', "https://api.tomtom.com")
+TOMTOM_FLOW_PATH = "/traffic/services/4/flowSegmentData/absolute/10/json"
+TOMTOM_FLOW_URL = TOMTOM_BASE_URL.rstrip('/') + TOMTOM_FLOW_PATH
 
 # Safety: do not hammer API. Use friendly defaults.
 DEFAULT_MAX_POINTS = 200
 DEFAULT_POINT_SPACING_DEG = 0.005  # ~500m (approx). Increase for sparser sampling.
 REQUEST_TIMEOUT = 6.0
+TOMTOM_RATE_PER_SEC = float(os.environ.get('TOMTOM_RATE_PER_SEC', 5))   # sustained requests/s
+TOMTOM_BURST = int(os.environ.get('TOMTOM_BURST', 5))                   # token bucket capacity
+TOMTOM_MAX_WORKERS = int(os.environ.get('TOMTOM_MAX_WORKERS', 8))
+TOMTOM_CACHE_TTL = float(os.environ.get('TOMTOM_CACHE_TTL', 300))       # seconds per flow segment
+
+
+# ==============================
+# ✅ RATE LIMITING + SEGMENT CACHE
+# ==============================
+class TokenBucket:
+    """Blocking token bucket shared by all ingestion workers."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class FlowSegmentCache:
+    """
+    TTL cache of TomTom flow readings keyed by flow segment (its end
+    coordinates). Query points are remembered per segment, so a point that
+    landed on a fresh segment is answered without another request.
+    """
+
+    def __init__(self, ttl: float = TOMTOM_CACHE_TTL):
+        self.ttl = ttl
+        self._segments: Dict[tuple, Tuple[float, Dict[str, Any]]] = {}
+        self._points: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def point_key(lat: float, lon: float) -> tuple:
+        return (round(lat, 5), round(lon, 5))
+
+    def get(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            seg = self._points.get(self.point_key(lat, lon))
+            entry = self._segments.get(seg) if seg is not None else None
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, lat: float, lon: float, reading: Dict[str, Any]) -> None:
+        seg = reading.get('segment') or self.point_key(lat, lon)
+        with self._lock:
+            self._segments[seg] = (time.time(), reading)
+            self._points[self.point_key(lat, lon)] = seg
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            fresh = sum(1 for t, _ in self._segments.values() if now - t < self.ttl)
+            return {'segments': len(self._segments), 'fresh_segments': fresh,
+                    'hits': self.hits, 'misses': self.misses, 'ttl_s': self.ttl}
+
+
+RATE_LIMITER = TokenBucket(TOMTOM_RATE_PER_SEC, TOMTOM_BURST)
+FLOW_CACHE = FlowSegmentCache()
+
+
+def _segment_key(fs: Dict[str, Any]) -> Optional[tuple]:
+    """Identify a flow segment by its first and last coordinate."""
+    coords = ((fs.get('coordinates') or {}).get('coordinate')) or []
+    if not coords:
+        return None
+    a, b = coords[0], coords[-1]
+    return (round(a.get('latitude', 0.0), 5), round(a.get('longitude', 0.0), 5),
+            round(b.get('latitude', 0.0), 5), round(b.get('longitude', 0.0), 5))
+
 
 def query_tomtom_flow_point(lat: float, lon: float) -> Dict[str, Any]:
     """
     Query TomTom flowSegmentData for a single lat/lon.
-    Returns { currentSpeed, freeFlowSpeed, confidence } or None on failure.
+    Returns { currentSpeed, freeFlowSpeed, confidence, segment } or None on failure.
     """
     if not TOMTOM_KEY:
         # Running without key -> skip
@@ -28,6 +122,7 @@ def query_tomtom_flow_point(lat: float, lon: float) -> Dict[str, Any]:
         "unit": "KMPH",
         "key": TOMTOM_KEY
     }
+    r = None
     try:
         r = requests.get(TOMTOM_FLOW_URL, params=params, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
@@ -36,13 +131,39 @@ def query_tomtom_flow_point(lat: float, lon: float) -> Dict[str, Any]:
         return {
             'currentSpeed': fs.get('currentSpeed'),
             'freeFlowSpeed': fs.get('freeFlowSpeed'),
-            'confidence': fs.get('confidence')
+            'confidence': fs.get('confidence'),
+            'segment': _segment_key(fs),
         }
     except Exception as e:
         # Log to console; real app should use logger
         print(f"[tomtom_integration] query failed for {lat},{lon}: {e} (status={getattr(r,'status_code',None)})")
         return None
 
+
+def _fetch_point(lat: float, lon: float) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """(reading, from_cache) for one point; rate limited on cache misses."""
+    cached = FLOW_CACHE.get(lat, lon)
+    if cached is not None:
+        return cached, True
+    if not TOMTOM_KEY:
+        return None, False   # nothing to request: don't spend a rate-limit token
+    RATE_LIMITER.acquire()
+    res = query_tomtom_flow_point(lat, lon)
+    if res and res.get('currentSpeed') is not None:
+        FLOW_CACHE.put(lat, lon, res)
+    return res, False
+
+
+def fetch_flow(points: List[Tuple[float, float]],
+               max_workers: int = TOMTOM_MAX_WORKERS) -> List[Tuple[Optional[Dict[str, Any]], bool]]:
+    """Fetch readings for many points concurrently (order preserved)."""
+    if not points:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(points))),
+                            thread_name_prefix="tomtom") as pool:
+        return list(pool.map(lambda p: _fetch_point(p[0], p[1]), points))
+
+
 # Helper to build grid sample over graph bounding box
 def _sample_points_over_bounds(bounds: Tuple[float,float,float,float], spacing_deg: float, max_points: int):
     """
@@ -60,100 +181,139 @@ def _sample_points_over_bounds(bounds: Tuple[float,float,float,float], spacing_d
                 return pts
     return pts
 
+
+# ==============================
+# ✅ EDGE MIDPOINT INDEX (CACHED PER GRAPH)
+# ==============================
+_MIDPOINT_INDEX = None   # (GraphArrays, cKDTree)
+_MIDPOINT_LOCK = threading.Lock()
+
+
+def _midpoint_index(arrays):
+    """cKDTree over edge midpoints (lat, lon); row i is edge id i. Built once per graph."""
+    global _MIDPOINT_INDEX
+    cached = _MIDPOINT_INDEX
+    if cached is not None and cached[0] is arrays:
+        return cached[1]
+    with _MIDPOINT_LOCK:
+        cached = _MIDPOINT_INDEX
+        if cached is not None and cached[0] is arrays:
+            return cached[1]
+        if arrays.n_edges == 0:
+            return None
+        from scipy.spatial import cKDTree
+        tree = cKDTree(np.column_stack([arrays.mid_lat, arrays.mid_lon]))
+        _MIDPOINT_INDEX = (arrays, tree)
+        return tree
+
+
+# ==============================
+# ✅ INGESTION
+# ==============================
 def update_graph_from_tomtom_points(points: List[Dict[str, float]],
                                     search_k: int = 1,
                                     max_points: int = DEFAULT_MAX_POINTS,
                                     spacing_deg: float = DEFAULT_POINT_SPACING_DEG) -> Dict[str, Any]:
 
     # lazy import to avoid circular imports
-    from routing_core import _edge_midpoints_and_index, G_proj, G_orig, _build_or_load_graph
-    if G_proj is None:
-        _build_or_load_graph()
-
-    # Build search graph (use original geometry if available)
-    search_graph = G_orig if (G_orig is not None) else G_proj
+    import routing_core
+    routing_core._build_or_load_graph()
+    arrays = routing_core.GRAPH_ARRAYS
 
     # If no explicit points provided, sample grid over graph bounds
     if not points:
-        # get bbox of nodes (lat, lon are stored as y,x)
-        ys = [data['y'] for _, data in search_graph.nodes(data=True)]
-        xs = [data['x'] for _, data in search_graph.nodes(data=True)]
-        min_lat, max_lat = min(ys), max(ys)
-        min_lon, max_lon = min(xs), max(xs)
-        grid_pts = _sample_points_over_bounds((min_lat, min_lon, max_lat, max_lon),
-                                             spacing_deg=spacing_deg,
-                                             max_points=max_points)
-        points_to_query = [{'lat': float(p[0]), 'lon': float(p[1])} for p in grid_pts]
+        bounds = (float(arrays.node_lat.min()), float(arrays.node_lon.min()),
+                  float(arrays.node_lat.max()), float(arrays.node_lon.max()))
+        points_to_query = _sample_points_over_bounds(bounds, spacing_deg=spacing_deg,
+                                                     max_points=max_points)
     else:
-        points_to_query = [{'lat': float(p['lat']), 'lon': float(p['lon'])} for p in points][:max_points]
+        points_to_query = [(float(p['lat']), float(p['lon'])) for p in points][:max_points]
 
-    # Build KD-tree over edge midpoints and index map
-    coords, idx_map = _edge_midpoints_and_index(search_graph)
-    if coords.size == 0 or len(idx_map) == 0:
+    tree = _midpoint_index(arrays)
+    if tree is None:
         return {'updated_edges': 0, 'queried_points': 0, 'timestamp': time.time(), 'note':'no edges in graph'}
-    from scipy.spatial import cKDTree
-    tree = cKDTree(coords)
-
-    updates = {}  # mapping (u,v,k) -> observed_speed_kph
-    queried = 0
-    for p in points_to_query:
-        lat, lon = p['lat'], p['lon']
-        res = query_tomtom_flow_point(lat, lon)
-        queried += 1
-        if not res or res.get('currentSpeed') is None:
-            continue
-        time.sleep(1.5)
-
-        speed_kph = float(res['currentSpeed'])
-        # nearest edge(s)
-        dist, idx = tree.query([lat, lon], k=search_k)
-        if np.isscalar(idx):
-            idxs = [int(idx)]
-        else:
-            idxs = [int(i) for i in idx]
-        for i in idxs:
-            u, v, k = idx_map[i]
-            updates[(u, v, k)] = speed_kph
-
-    # Apply updates to projected graph (G_proj)
-    updated_edges = 0
-    for (u, v, k), obs_speed_kph in updates.items():
-        try:
-            data = G_proj.edges[u, v, k]
-            length_m = data.get('length', None)
-            if length_m is None or obs_speed_kph <= 0:
-                continue
-            # compute new travel time (seconds)
-            travel_time_s = float(length_m) / (obs_speed_kph / 3.6)
-            G_proj.edges[u, v, k]['travel_time'] = travel_time_s
-            G_proj.edges[u, v, k]['observed_speed_kph'] = obs_speed_kph
-            updated_edges += 1
-        except Exception:
-            # some edges may mismatch between search_graph and G_proj keying; skip gracefully
-            continue
-
-    # Recompute normalized time_norm and poll_norm across the graph
-    times = []
-    ps_list = []
-    for _, _, _, data in G_proj.edges(keys=True, data=True):
-        times.append(data.get('travel_time', 300.0))
-        ps_list.append(data.get('Pollution_Score', 500.0))
-    if len(times) == 0:
-        return {'updated_edges': updated_edges, 'queried_points': queried, 'timestamp': time.time()}
-
-    times = np.array(times, dtype=float)
-    ps_list = np.array(ps_list, dtype=float)
-    t_min, t_max = times.min(), times.max()
-    p_min, p_max = ps_list.min(), ps_list.max()
-    t_range = t_max - t_min if t_max > t_min else 1.0
-    p_range = p_max - p_min if p_max > p_min else 1.0
-
-    # iterate again to set norms (use same ordering as edges())
-    for (u, v, k), t, p in zip(list(G_proj.edges(keys=True)), times, ps_list):
+
+    readings = fetch_flow(points_to_query)
+    cache_hits = sum(1 for _, hit in readings if hit)
+
+    # Observed speed per point, then all nearest-edge lookups in one query
+    ok = [(p, float(res['currentSpeed'])) for p, (res, _) in zip(points_to_query, readings)
+          if res and res.get('currentSpeed') is not None]
+    eids = np.empty(0, dtype=np.int64)
+    new_times = np.empty(0)
+    if ok:
+        _, idx = tree.query(np.array([p for p, _ in ok]), k=search_k)
+        idx = np.asarray(idx, dtype=np.int64).reshape(len(ok), -1)
+        speeds = np.repeat(np.array([v for _, v in ok]), idx.shape[1])
+        hit = idx.ravel()
+        # Later points win for an edge hit twice (as before): keep each edge's last hit
+        keep = len(hit) - 1 - np.unique(hit[::-1], return_index=True)[1]
+        hit, speeds = hit[keep], speeds[keep]
+        valid = speeds > 0
+        eids = hit[valid]
+        # Observed speed (km/h) -> travel time (seconds)
+        new_times = arrays.length[eids] / (speeds[valid] / 3.6)
+
+    # Publish as a new edge weight snapshot: O(updated edges) writes plus one
+    # vectorized min/max for time_norm (poll_norm is carried over unchanged).
+    # G_proj itself is never mutated, so concurrent routes stay consistent.
+    store = routing_core.EDGE_WEIGHTS
+    updated_edges = len(eids)
+    weights_version = store.current().version
+    if updated_edges:
+        weights = store.update_travel_times(eids, new_times)
+        weights_version = weights.version
+        # Fast re-customization of the fastest-route hierarchy for the new travel times
+        routing_core.recustomize_contraction_hierarchy(weights)
+
+    return {'updated_edges': updated_edges, 'queried_points': len(points_to_query),
+            'cache_hits': cache_hits, 'weights_version': weights_version, 'timestamp': time.time()}
+
+
+# ==============================
+# ✅ BACKGROUND REFRESH JOB
+# ==============================
+_JOB_LOCK = threading.Lock()
+_JOB: Dict[str, Any] = {'state': 'idle', 'id': None}
+
+
+def start_refresh_job(points: List[Dict[str, float]] = None, **kwargs) -> Dict[str, Any]:
+    """
+    Run update_graph_from_tomtom_points() on a background thread so the HTTP
+    request returns immediately. Only one refresh runs at a time; starting
+    while one is running returns the running job.
+
+    Job state lives in this process: with several gunicorn workers a status
+    poll may reach a worker that never saw the job (see refresh_status).
+    """
+    global _JOB
+    with _JOB_LOCK:
+        if _JOB['state'] == 'running':
+            return dict(_JOB)
+        job = {'state': 'running', 'id': uuid.uuid4().hex, 'started': time.time()}
+        _JOB = job
+
+    def run():
+        global _JOB
         try:
-            G_proj.edges[u, v, k]['time_norm'] = float((t - t_min) / t_range)
-            G_proj.edges[u, v, k]['poll_norm'] = float((p - p_min) / p_range)
-        except Exception:
-            continue
+            result = update_graph_from_tomtom_points(points=points, **kwargs)
+            done = {'state': 'done', 'result': result}
+        except Exception as e:
+            print(f"[tomtom_integration] refresh job failed: {e}")
+            done = {'state': 'failed', 'error': str(e)}
+        with _JOB_LOCK:
+            _JOB = {**job, **done, 'finished': time.time()}
+
+    threading.Thread(target=run, name="tomtom-refresh", daemon=True).start()
+    return dict(job)
 
-    return {'updated_edges': updated_edges, 'queried_points': queried, 'timestamp': time.time()}
+
+def refresh_status(job_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Latest job and cache state. With job_id, a job this process does not own
+    (started on another worker, or replaced since) is reported as 'unknown'.
+    """
+    job = dict(_JOB)
+    if job_id is not None and job.get('id') != job_id:
+        job = {'id': job_id, 'state': 'unknown'}
+    return {'job': job, 'cache': FLOW_CACHE.status()}
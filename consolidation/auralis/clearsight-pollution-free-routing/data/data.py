@@ -1,13 +1,24 @@
-import xarray as xr
-import pandas as pd
+"""
+Offline ERA5 ingestion: GRIB / NetCDF -> partitioned Parquet store (see app/era5_store.py).
 
-# Load GRIB file
-ds = xr.open_dataset("data.grib", engine="cfgrib")
+    python data/data.py data/data.grib [more.grib | era5.nc ...] [--out data/era5]
+"""
+import os
+import sys
+import time
+import argparse
 
-# Convert to a DataFrame
-df = ds.to_dataframe().reset_index()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+from era5_store import ingest_file, ERA5_STORE_DIR
 
-# Save as CSV
-df.to_csv("output.csv", index=False)
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Ingest ERA5 GRIB/NetCDF files into the local reanalysis store")
+    ap.add_argument("files", nargs="*", default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.grib")])
+    ap.add_argument("--out", default=ERA5_STORE_DIR)
+    args = ap.parse_args()
 
-print("Saved output.csv")
+    for path in args.files:
+        t0 = time.perf_counter()
+        meta = ingest_file(path, args.out)
+        print(f"{path}: {meta['rows']} rows, {len(meta['written'])} partitions, "
+              f"variables {meta['variables']} in {time.perf_counter() - t0:.1f}s -> {args.out}")
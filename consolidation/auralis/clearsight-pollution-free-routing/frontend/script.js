@@ -4,6 +4,7 @@
 const API_ROUTE = '/api/route';
 const API_SNAP = '/api/snap';
 const API_POLLUTION = '/api/pollution_points';
+const API_POLLUTION_RASTER = '/api/pollution_raster';
 const API_TRAFFIC_REFRESH = '/api/traffic_refresh';
 const API_TRAFFIC_STATUS = '/api/traffic_status';
 
@@ -15,6 +16,7 @@ let markerStart = null;
 let markerEnd = null;
 let routeLayers = [];
 let heatLayerGroup = null;
+let heatRasterEtag = null; // raster currently shown; skip redraws while unchanged
 let nextClickTarget = 'start'; // first click sets start, then end, then toggles
 
 // UI references
@@ -232,6 +234,24 @@ const url = `https://nominatim.openstreetmap.org/search?format=json&q=${encodeUR
 
 // ---------------- HEATMAP / POLLUTION POINTS ----------------
 async function loadPollutionHeatmap() {
+    // One server-rendered image overlay instead of a marker per station.
+    // The meta request is revalidated with ETag (304 while the forecast is unchanged).
+    try {
+        const resp = await fetch(API_POLLUTION_RASTER, { cache: 'no-cache' });
+        if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+        const meta = await resp.json();
+        if (meta.etag === heatRasterEtag) return;
+        heatLayerGroup.clearLayers();
+        L.imageOverlay(meta.png, meta.bounds, { opacity: 0.8, interactive: false }).addTo(heatLayerGroup);
+        heatRasterEtag = meta.etag;
+    } catch (e) {
+        console.warn('Pollution raster unavailable, falling back to points', e);
+        heatRasterEtag = null;
+        await loadPollutionPoints();
+    }
+}
+
+async function loadPollutionPoints() {
     heatLayerGroup.clearLayers();
     try {
         const resp = await fetch(API_POLLUTION);
@@ -351,8 +371,23 @@ async function refreshLiveTraffic() {
         const data = await resp.json();
         if (!resp.ok || !data.ok) {
             showMessage('Traffic refresh failed: ' + (data.error || 'server error'), true);
+            return;
+        }
+        // Refresh runs in the background; poll its job until it finishes.
+        // A poll answered by another worker (unknown / different id) is retried.
+        const jobId = data.job && data.job.id;
+        let job = data.job;
+        const deadline = Date.now() + 5 * 60 * 1000;
+        while (job && (job.state === 'running' || job.state === 'unknown' || job.id !== jobId)
+               && Date.now() < deadline) {
+            await new Promise(r => setTimeout(r, 1000));
+            const st = await (await fetch(API_TRAFFIC_STATUS + '?job=' + encodeURIComponent(jobId))).json();
+            job = st.refresh && st.refresh.job;
+        }
+        if (!job || job.state !== 'done') {
+            showMessage('Traffic refresh failed: ' + ((job && job.error) || 'server error'), true);
         } else {
-            showMessage('Traffic updated — updated edges: ' + (data.result.updated_edges || 0), false);
+            showMessage('Traffic updated — updated edges: ' + (job.result.updated_edges || 0), false);
             // re-run current route if points set
             if (markerStart && markerEnd) findRoutes();
         }
@@ -0,0 +1,51 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings for the routing server (Procfile / render.yaml use this file).
+
+With preload (the default) the master imports the app, builds the road graph
+and route engine once, then forks the workers. The workers share those
+read-only pages copy-on-write instead of each building its own copy on its
+first request.
+
+  PRELOAD=0        build lazily in every worker instead
+  PRELOAD_MODEL=1  also load the AQI model and the first pollution field
+                   (which runs the model) in the master. Off by default:
+                   TensorFlow is not fork-safe once imported, so normally
+                   each worker builds both on first use
+  WEB_CONCURRENCY  worker processes (default 1), GUNICORN_THREADS (default 4)
+
+One worker is assumed: the TomTom refresh job (/api/traffic_refresh) and the
+live-traffic edge weights it publishes are per process, so with more workers
+a refresh only updates the worker that ran it and status polls served by
+another worker report the job as 'unknown'.
+"""
+import gc
+import os
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = 120
+preload_app = os.environ.get("PRELOAD", "1") != "0"
+
+_started = time.time()
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported (and before any fork)
+    if not server.cfg.preload_app:
+        return
+    import routing_core
+    stats = routing_core.preload(load_model=os.environ.get("PRELOAD_MODEL", "0") != "0")
+    # Keep the preloaded objects out of future GC passes so the collector
+    # does not touch (and un-share) their pages in the workers
+    gc.freeze()
+    server.log.info(f"preloaded in {stats['total_s']}s (startup {time.time() - _started:.1f}s), "
+                    f"master RSS {stats['rss_mb']} MB")
+
+
+def post_fork(server, worker):
+    import routing_core
+    server.log.info(f"worker {worker.pid} forked, RSS {routing_core.process_rss_mb()} MB, "
+                    f"private {routing_core.process_private_mb()} MB")
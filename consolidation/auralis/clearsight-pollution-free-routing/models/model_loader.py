@@ -1,16 +1,21 @@
 import os
+import json
+import time
+import shutil
+import hashlib
 import warnings
 from typing import List, Tuple, Any
+import threading
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
-import joblib
+from numpy.lib.stride_tricks import sliding_window_view
 
-# try/except tensorflow import so non-ML devs can still run parts of app
-try:
-    import tensorflow as tf
-except Exception:
-    tf = None
+# TensorFlow is imported on first use, not at import time:
+# TF alone takes seconds to import and most requests never touch the model.
+# _tensorflow() returns None when TF is not installed, so non-ML devs can
+# still run parts of app.
+tf = None
+_TF_CHECKED = False
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -18,7 +23,11 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 # Files
 MODEL_FILE_PATH = os.path.join(os.path.dirname(__file__), 'lstm_model.h5')
-SCALER_FILE_PATH = os.path.join(os.path.dirname(__file__), 'scaler.pkl')
+# Versioned bundle (manifest.json + weights + scaler.npy); preferred over MODEL_FILE_PATH when present
+MODEL_BUNDLE_DIR = os.environ.get("MODEL_BUNDLE_DIR", os.path.join(os.path.dirname(__file__), 'bundle'))
+BUNDLE_MANIFEST = 'manifest.json'
+BUNDLE_SCALER = 'scaler.npy'
+BUNDLE_FORMAT = 1
 
 # Defaults (will be inferred if a model is present)
 SEQUENCE_LENGTH = 24
@@ -30,13 +39,103 @@ FEATURE_COLUMNS = [
     'pm25_lag1', 'pm25_lag2', 'pm25_roll6h'
 ]
 INPUT_FEATURE_COUNT = len(FEATURE_COLUMNS)
+# Windows per forward pass
+MODEL_BATCH_SIZE = int(os.environ.get("MODEL_BATCH_SIZE", 256))
 
 # Global model + scaler
 TRAINED_MODEL = None
 GLOBAL_SCALER = None
+# True once a bundle fixed the feature list: inputs follow FEATURE_COLUMNS exactly
+FEATURES_FROM_BUNDLE = False
+# What was loaded, for /api/health (see model_status())
+MODEL_INFO = {"source": None}
+_MODEL_LOAD_ATTEMPTED = False
+_MODEL_LOCK = threading.Lock()
+
+
+def _tensorflow():
+    """Import TensorFlow once, on first use. Returns None if it is unavailable."""
+    global tf, _TF_CHECKED
+    if not _TF_CHECKED:
+        try:
+            import tensorflow
+            tf = tensorflow
+        except Exception:
+            tf = None
+        _TF_CHECKED = True
+    return tf
+
+
+class ModelBundleError(Exception):
+    """The model bundle is missing pieces, fails its checksum or does not fit the model."""
+
+
+class FeatureScaler:
+    """
+    Min-max feature scaling from stored per-feature data_min / data_max
+    (same arithmetic as sklearn's MinMaxScaler, without refitting or sklearn
+    at inference time). Constant features map to 0.
+    """
+
+    def __init__(self, data_min: np.ndarray, data_max: np.ndarray):
+        data_min = np.asarray(data_min, dtype=np.float64)
+        span = np.asarray(data_max, dtype=np.float64) - data_min
+        self.scale_ = np.where(span > 0, 1.0 / np.where(span > 0, span, 1.0), 0.0).astype(np.float32)
+        self.min_ = (-data_min * self.scale_).astype(np.float32)
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return X * self.scale_ + self.min_
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _input_shape(model) -> Tuple:
+    shape = model.input_shape
+    if isinstance(shape, list):
+        shape = shape[0]
+    return tuple(shape)
+
+
+def _warm_up(model, seq_len: int, n_features: int) -> float:
+    """One dummy forward pass so graph tracing happens at load time, not on the first request."""
+    t0 = time.perf_counter()
+    _forward(model, np.zeros((1, seq_len, n_features), dtype=np.float32))
+    return round(time.perf_counter() - t0, 3)
+
+
+def ensure_model_loaded():
+    """
+    Load the model at most once per process (or once in the gunicorn master
+    with --preload, so workers inherit it). A bundle in MODEL_BUNDLE_DIR is
+    used when present; otherwise the bare MODEL_FILE_PATH. Failures leave
+    TRAINED_MODEL unset and predictions fall back to mock values.
+    """
+    global _MODEL_LOAD_ATTEMPTED
+    if _MODEL_LOAD_ATTEMPTED:
+        return TRAINED_MODEL
+    with _MODEL_LOCK:
+        if not _MODEL_LOAD_ATTEMPTED:
+            try:
+                if os.path.exists(os.path.join(MODEL_BUNDLE_DIR, BUNDLE_MANIFEST)):
+                    load_model_bundle(MODEL_BUNDLE_DIR)
+                elif _tensorflow() is not None:
+                    load_trained_model()
+            except Exception as e:
+                print(f"WARNING: model load failed: {e}. Using mock predictions.")
+                MODEL_INFO.clear()
+                MODEL_INFO.update({"source": None, "error": str(e)})
+            _MODEL_LOAD_ATTEMPTED = True
+    return TRAINED_MODEL
 
 def _create_placeholder_model(seq_len, n_features):
     """Create a tiny LSTM model placeholder in case a saved model is missing."""
+    tf = _tensorflow()
     if tf is None:
         return None
     m = tf.keras.models.Sequential([
@@ -47,17 +146,65 @@ def _create_placeholder_model(seq_len, n_features):
     m.compile(optimizer='adam', loss='mse')
     return m
 
+def load_model_bundle(bundle_dir: str = MODEL_BUNDLE_DIR):
+    """
+    Load a bundle written by build_model_bundle(): verify every file against
+    the manifest checksums, check the model's input shape against the
+    manifest, load the scaler statistics and run a warm-up inference. Sets
+    TRAINED_MODEL, GLOBAL_SCALER, FEATURE_COLUMNS and SEQUENCE_LENGTH.
+    """
+    global TRAINED_MODEL, GLOBAL_SCALER, FEATURE_COLUMNS, INPUT_FEATURE_COUNT, SEQUENCE_LENGTH
+    global FEATURES_FROM_BUNDLE
+    with open(os.path.join(bundle_dir, BUNDLE_MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ModelBundleError(f"unsupported bundle format {manifest.get('format')}")
+    for name, digest in manifest["sha256"].items():
+        if _sha256(os.path.join(bundle_dir, name)) != digest:
+            raise ModelBundleError(f"checksum mismatch for {name}")
+
+    features = list(manifest["features"])
+    seq_len = int(manifest["sequence_length"])
+    scaler = np.load(os.path.join(bundle_dir, BUNDLE_SCALER))
+    if scaler.shape != (2, len(features)):
+        raise ModelBundleError(f"scaler shape {scaler.shape} does not match {len(features)} features")
+
+    tf = _tensorflow()
+    if tf is None:
+        raise ModelBundleError("TensorFlow is not installed")
+    model = tf.keras.models.load_model(os.path.join(bundle_dir, manifest["weights"]), compile=False)
+    shape = _input_shape(model)
+    if len(shape) != 3 or shape[1] not in (None, seq_len) or shape[2] != len(features):
+        raise ModelBundleError(f"model input {shape} does not match ({seq_len}, {len(features)})")
+
+    warm_s = _warm_up(model, seq_len, len(features))
+    FEATURE_COLUMNS = features
+    INPUT_FEATURE_COUNT = len(features)
+    SEQUENCE_LENGTH = seq_len
+    FEATURES_FROM_BUNDLE = True
+    GLOBAL_SCALER = FeatureScaler(scaler[0], scaler[1])
+    TRAINED_MODEL = model
+    MODEL_INFO.clear()
+    MODEL_INFO.update({"source": "bundle", "version": manifest.get("version"),
+                       "created": manifest.get("created"), "features": len(features),
+                       "sequence_length": seq_len, "warm_up_s": warm_s})
+    print(f"INFO: model bundle {manifest.get('version')} loaded ({len(features)} features, "
+          f"seq {seq_len}, warm-up {warm_s}s).")
+    return TRAINED_MODEL
+
 def load_trained_model():
-    """Loads the serialized Keras model and sets up the mock scaler."""
+    """
+    Loads the bare serialized Keras model (no bundle). Without stored scaler
+    statistics the features are passed unscaled; build a bundle to fix that.
+    """
     global TRAINED_MODEL, GLOBAL_SCALER
+    tf = _tensorflow()
+    GLOBAL_SCALER = None
     try:
         loaded = tf.keras.models.load_model(MODEL_FILE_PATH)
         # Inspect input shape: model expects (batch, seq_len, n_features)
         try:
-            input_shape = loaded.input_shape  # could be tuple or list
-            # normalize to (None, seq, features)
-            if isinstance(input_shape, list):
-                input_shape = input_shape[0]
+            input_shape = _input_shape(loaded)
             seq_len = input_shape[1] if len(input_shape) > 2 else None
             feat_cnt = input_shape[2] if len(input_shape) > 2 else None
 
@@ -65,132 +212,189 @@ def load_trained_model():
             if seq_len != SEQUENCE_LENGTH or feat_cnt != INPUT_FEATURE_COUNT:
                 print(f"WARNING: Loaded model shape mismatch. Model expects sequence length {seq_len}, features {feat_cnt}.")
                 print("Using mock model instead (to avoid runtime errors).")
-                TRAINED_MODEL = create_mock_model()
+                TRAINED_MODEL = _create_placeholder_model(SEQUENCE_LENGTH, INPUT_FEATURE_COUNT)
             else:
                 TRAINED_MODEL = loaded
-                print(f"INFO: Keras/LSTM model loaded successfully.")
+                print(f"INFO: Keras/LSTM model loaded successfully (no bundle: features unscaled).")
         except Exception as e:
             print(f"WARNING: Couldn't inspect model.input_shape: {e}. Using loaded model but will fallback if predict fails.")
             TRAINED_MODEL = loaded
 
-        # Setup a simple scaler so code continues
-        GLOBAL_SCALER = MinMaxScaler()
-        GLOBAL_SCALER.fit(np.array([1, 500]).reshape(-1, 1))
-
     except FileNotFoundError:
         print(f"WARNING: LSTM model not found at {MODEL_FILE_PATH}. Using mock model.")
-        TRAINED_MODEL = create_mock_model()
-        GLOBAL_SCALER = MinMaxScaler()
-        GLOBAL_SCALER.fit(np.array([1, 500]).reshape(-1, 1))
+        TRAINED_MODEL = _create_placeholder_model(SEQUENCE_LENGTH, INPUT_FEATURE_COUNT)
     except Exception as e:
         print(f"CRITICAL ERROR loading Keras model: {e}. Falling back to mock model.")
-        TRAINED_MODEL = create_mock_model()
-        GLOBAL_SCALER = MinMaxScaler()
-        GLOBAL_SCALER.fit(np.array([1, 500]).reshape(-1, 1))
+        TRAINED_MODEL = _create_placeholder_model(SEQUENCE_LENGTH, INPUT_FEATURE_COUNT)
+
+    MODEL_INFO.clear()
+    MODEL_INFO.update({"source": "file" if TRAINED_MODEL is not None else None,
+                       "features": INPUT_FEATURE_COUNT, "sequence_length": SEQUENCE_LENGTH})
+    if TRAINED_MODEL is not None:
+        try:
+            MODEL_INFO["warm_up_s"] = _warm_up(TRAINED_MODEL, SEQUENCE_LENGTH, INPUT_FEATURE_COUNT)
+        except Exception as e:
+            print(f"WARNING: warm-up inference failed: {e}")
     return TRAINED_MODEL
 
 
+def model_status() -> dict:
+    """Which model is serving (bundle version / bare file / mock), for /api/health."""
+    return dict(MODEL_INFO, loaded=TRAINED_MODEL is not None, attempted=_MODEL_LOAD_ATTEMPTED)
+
+
+# Derived calendar features: computed from the rows' `time` column (UTC epoch
+# seconds) when present, otherwise from the current time.
+_TIME_FEATURES = {
+    'hour_sin': ('hour', 24, np.sin), 'hour_cos': ('hour', 24, np.cos),
+    'month_sin': ('month', 12, np.sin), 'month_cos': ('month', 12, np.cos),
+    'day_sin': ('day', 31, np.sin), 'day_cos': ('day', 31, np.cos),
+}
+TIME_COLUMN = 'time'
+
+# Column plans keyed by the incoming frame's (columns, dtypes); see _feature_plan()
+_FEATURE_PLANS = {}
+
+
+def _feature_plan(df: pd.DataFrame) -> List[Tuple[str, str]]:
+    """
+    Which model input comes from where, as [(name, source), ...] with source
+    'column' (copied from df), 'time' (derived calendar feature) or 'pad'
+    (zeros). Exactly INPUT_FEATURE_COUNT entries:
+      1. FEATURE_COLUMNS present in df, or derivable calendar features
+      2. other numeric columns of df (not `time`)
+      3. zero padding
+    With a loaded bundle the plan is the bundle's feature list as-is.
+    Cached per frame layout, so repeated forecasts skip the column search.
+    """
+    key = (tuple(df.columns), tuple(str(t) for t in df.dtypes), tuple(FEATURE_COLUMNS))
+    plan = _FEATURE_PLANS.get(key)
+    if plan is not None:
+        return plan
+
+    if FEATURES_FROM_BUNDLE:
+        # The bundle's feature list is authoritative: same names, same order
+        plan = [(c, 'column' if c in df.columns else 'time' if c in _TIME_FEATURES else 'pad')
+                for c in FEATURE_COLUMNS]
+        missing = [c for c, src in plan if src == 'pad' and not c.startswith('_pad_')]
+        if missing:
+            print(f"WARNING: model features missing from input, zero-filled: {missing}")
+        _FEATURE_PLANS[key] = plan
+        return plan
+
+    plan = []
+    for c in FEATURE_COLUMNS:
+        if c in df.columns:
+            plan.append((c, 'column'))
+        elif c in _TIME_FEATURES:
+            plan.append((c, 'time'))
+    if len(plan) < INPUT_FEATURE_COUNT:
+        used = {name for name, _ in plan}
+        for c in df.select_dtypes(include=[np.number]).columns:
+            if c not in used and c != TIME_COLUMN:
+                plan.append((c, 'column'))
+                if len(plan) >= INPUT_FEATURE_COUNT:
+                    break
+    while len(plan) < INPUT_FEATURE_COUNT:
+        plan.append((f"_pad_{len(plan)}", 'pad'))
+    plan = plan[:INPUT_FEATURE_COUNT]
+    _FEATURE_PLANS[key] = plan
+    return plan
+
+
+def _calendar_parts(df: pd.DataFrame) -> dict:
+    """hour / month / day per row (arrays), or scalars for 'now' when df has no time column."""
+    if TIME_COLUMN in df.columns:
+        t = pd.to_datetime(df[TIME_COLUMN].to_numpy(), unit='s', utc=True)
+        return {'hour': t.hour.to_numpy(), 'month': t.month.to_numpy(), 'day': t.day.to_numpy()}
+    now = pd.Timestamp.now()
+    return {'hour': now.hour, 'month': now.month, 'day': now.day}
+
+
 def _prepare_features(df: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
     """
-    From an ERA5-like dataframe, build a (N_samples, N_features) feature matrix
-    matching FEATURE_COLUMNS up to INPUT_FEATURE_COUNT. Missing features are filled with zeros.
+    From an ERA5-like dataframe, build a (N_samples, INPUT_FEATURE_COUNT)
+    float32 feature matrix following _feature_plan(). The frame is not copied;
+    columns are written straight into the preallocated matrix.
     Returns (feature_matrix, used_feature_columns).
     """
-    global FEATURE_COLUMNS, INPUT_FEATURE_COUNT
-    df_local = df.copy()
-    n_samples = len(df_local)
+    plan = _feature_plan(df)
+    X = np.zeros((len(df), len(plan)), dtype=np.float32)
+    parts = None
+    for j, (name, source) in enumerate(plan):
+        if source == 'column':
+            X[:, j] = df[name].to_numpy(dtype=np.float64)
+        elif source == 'time':
+            if parts is None:
+                parts = _calendar_parts(df)
+            unit, period, fn = _TIME_FEATURES[name]
+            X[:, j] = fn(2 * np.pi * np.asarray(parts[unit], dtype=np.float64) / period)
+    return X, [name for name, _ in plan]
 
-    # Create time features if not present
-    now = pd.Timestamp.now()
-    if 'hour_sin' not in df_local.columns:
-        df_local['hour_sin'] = np.sin(2 * np.pi * now.hour / 24)
-        df_local['hour_cos'] = np.cos(2 * np.pi * now.hour / 24)
-    if 'month_sin' not in df_local.columns:
-        df_local['month_sin'] = np.sin(2 * np.pi * now.month / 12)
-        df_local['month_cos'] = np.cos(2 * np.pi * now.month / 12)
-    if 'day_sin' not in df_local.columns:
-        df_local['day_sin'] = np.sin(2 * np.pi * now.day / 31)
-        df_local['day_cos'] = np.cos(2 * np.pi * now.day / 31)
-
-    # Choose feature columns to use: prefer existing ones in df, but ensure count matches INPUT_FEATURE_COUNT
-    available = [c for c in FEATURE_COLUMNS if c in df_local.columns]
-    used = available.copy()
-
-    # If we don't have enough features, append other numeric columns from df
-    if len(used) < INPUT_FEATURE_COUNT:
-        extras = [c for c in df_local.select_dtypes(include=[np.number]).columns if c not in used]
-        for c in extras:
-            used.append(c)
-            if len(used) >= INPUT_FEATURE_COUNT:
-                break
-
-    # If still not enough, pad with dummy feature names and zeros
-    while len(used) < INPUT_FEATURE_COUNT:
-        pad_name = f"_pad_{len(used)}"
-        df_local[pad_name] = 0.0
-        used.append(pad_name)
-
-    # If too many features, trim to expected count
-    used = used[:INPUT_FEATURE_COUNT]
-
-    # Build matrix (N_samples, N_features)
-    X = df_local[used].astype(float).to_numpy()
-    return X, used
 
-def run_model_prediction(raw_data_frame: pd.DataFrame) -> np.ndarray:
+def rolling_windows(X: np.ndarray, seq_len: int) -> np.ndarray:
     """
-    Accepts forecasted ERA5 rows (one row per station) and returns predicted AQI values (array length = n_rows).
-    - Builds features to match the model's expected feature count.
-    - Repeats each row to create a sequence of length SEQUENCE_LENGTH if necessary.
-    - Scales features with GLOBAL_SCALER if available, otherwise fits a MinMaxScaler on the sample batch.
+    (n, F) hourly rows -> (n, seq_len, F) overlapping windows, window i ending
+    at row i. Rows before the first hour repeat it. Apart from those
+    seq_len - 1 padding rows this is a strided view, no data is duplicated.
     """
-    global TRAINED_MODEL, GLOBAL_SCALER, SEQUENCE_LENGTH, INPUT_FEATURE_COUNT
+    if seq_len <= 1:
+        return X[:, np.newaxis, :]
+    padded = np.concatenate([np.repeat(X[:1], seq_len - 1, axis=0), X])
+    return sliding_window_view(padded, seq_len, axis=0).transpose(0, 2, 1)
+
+
+def _forward(model, windows: np.ndarray) -> np.ndarray:
+    """One forward pass per MODEL_BATCH_SIZE windows (model() avoids predict()'s per-call setup)."""
+    out = []
+    for lo in range(0, len(windows), MODEL_BATCH_SIZE):
+        batch = np.ascontiguousarray(windows[lo:lo + MODEL_BATCH_SIZE], dtype=np.float32)
+        out.append(np.asarray(model(batch, training=False)).reshape(-1))
+    return np.concatenate(out) if out else np.array([])
 
+def run_model_prediction(raw_data_frame: pd.DataFrame) -> np.ndarray:
+    """
+    Accepts consecutive forecast hours (one row per hour, optional `time` in
+    UTC epoch seconds) and returns one predicted AQI per row, in input order.
+    - Builds features per the cached column plan (calendar features from `time`).
+    - Each row is predicted from the SEQUENCE_LENGTH hours ending at it
+      (rolling windows over the time-sorted series), in one batched pass.
+    - Scales features with the bundle's stored min/max (unscaled without a bundle).
+    """
     # If TensorFlow not available, return mock
+    ensure_model_loaded()
     if tf is None or TRAINED_MODEL is None:
         print("TF/model not available, returning mock predictions.")
         return np.random.randint(50, 300, size=len(raw_data_frame))
 
     try:
-        df = raw_data_frame.copy().reset_index(drop=True)
+        df = raw_data_frame
         n = len(df)
         if n == 0:
             return np.array([])
 
         # 1. Build (n, n_features) aligned to INPUT_FEATURE_COUNT
-        X_basic, used_cols = _prepare_features(df)  # shape (n, INPUT_FEATURE_COUNT)
-
-        # 2. Fit scaler if needed (fit on this batch)
-        if GLOBAL_SCALER is None:
-            GLOBAL_SCALER = MinMaxScaler()
-            try:
-                GLOBAL_SCALER.fit(X_basic)
-                print("Fitted on-the-fly MinMaxScaler from batch.")
-            except Exception as e:
-                print(f"Scaler fit failed: {e}. Proceeding without scaling.")
-                GLOBAL_SCALER = None
+        X_basic, used_cols = _prepare_features(df)
 
-        # 3. Scale X
+        # 2. Scale X with the bundle's stored statistics (once per row, before windowing)
         if GLOBAL_SCALER is not None:
             X_scaled = GLOBAL_SCALER.transform(X_basic)
         else:
             X_scaled = X_basic
 
-        # 4. Create sequences: (n_samples, seq_len, n_features)
-        # If the model was trained on sequences but we only have snapshot, repeat across time axis
-        seq_len = SEQUENCE_LENGTH
-        if seq_len <= 1:
-            input_seq = X_scaled.reshape((n, 1, INPUT_FEATURE_COUNT))
-        else:
-            # repeat each row seq_len times
-            input_seq = np.repeat(X_scaled[:, np.newaxis, :], seq_len, axis=1)
+        # 3. Windows over the time-ordered series: (n, seq_len, n_features)
+        order = None
+        if TIME_COLUMN in df.columns:
+            order = np.argsort(df[TIME_COLUMN].to_numpy(), kind='stable')
+            X_scaled = X_scaled[order]
+        windows = rolling_windows(X_scaled, SEQUENCE_LENGTH)
 
-        # 5. Predict
-        preds = TRAINED_MODEL.predict(input_seq, verbose=0)
-        # preds shape should be (n, 1) or (n,)
-        preds = np.asarray(preds).reshape(-1)
+        # 4. Predict, then put results back in input row order
+        preds = _forward(TRAINED_MODEL, windows)
+        if order is not None:
+            preds = preds[np.argsort(order)]
 
-        # 6. If scaler was applied to target during training, you need to inverse transform here.
+        # 5. If scaler was applied to target during training, you need to inverse transform here.
         # We don't know that, so assume preds are in PM2.5 units (or normalized). We attempt a sensible mapping:
         # If scaler exists and was fit on features only, we cannot reliably inverse. We'll return positive values and scale to AQI approximation:
         pred_pm25 = np.maximum(0.0, preds)
@@ -202,3 +406,52 @@ def run_model_prediction(raw_data_frame: pd.DataFrame) -> np.ndarray:
     except Exception as e:
         print(f"CRITICAL ERROR during model prediction: {e}. Returning mock values.")
         return np.random.randint(50, 300, size=len(raw_data_frame))
+
+
+def build_model_bundle(weights_path: str, training_frame: pd.DataFrame,
+                       out_dir: str = MODEL_BUNDLE_DIR, version: str = None,
+                       sequence_length: int = SEQUENCE_LENGTH) -> dict:
+    """
+    Write a versioned bundle: a copy of the weights, the feature list chosen
+    for training_frame, the scaler statistics fitted on it (scaler.npy, rows
+    data_min / data_max) and a manifest with SHA-256 checksums. The manifest
+    is written last, so a half-written bundle is never picked up.
+    """
+    X, features = _prepare_features(training_frame)
+    os.makedirs(out_dir, exist_ok=True)
+    weights_name = os.path.basename(weights_path)
+    shutil.copyfile(weights_path, os.path.join(out_dir, weights_name))
+    np.save(os.path.join(out_dir, BUNDLE_SCALER),
+            np.vstack([X.min(axis=0), X.max(axis=0)]).astype(np.float64))
+
+    sums = {name: _sha256(os.path.join(out_dir, name)) for name in (weights_name, BUNDLE_SCALER)}
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": version or f"{time.strftime('%Y%m%d')}-{sums[weights_name][:8]}",
+        "created": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "weights": weights_name,
+        "features": features,
+        "sequence_length": int(sequence_length),
+        "training_rows": int(len(X)),
+        "sha256": sums,
+    }
+    tmp = os.path.join(out_dir, BUNDLE_MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, BUNDLE_MANIFEST))
+    return manifest
+
+
+if __name__ == "__main__":
+    # Offline: bundle trained weights with the scaler fitted on their training features
+    import argparse
+    ap = argparse.ArgumentParser(description="Build a versioned model bundle")
+    ap.add_argument("--fit-csv", required=True, help="training features (CSV, optional `time` in epoch s)")
+    ap.add_argument("--weights", default=MODEL_FILE_PATH)
+    ap.add_argument("--out", default=MODEL_BUNDLE_DIR)
+    ap.add_argument("--version", default=None)
+    ap.add_argument("--sequence-length", type=int, default=SEQUENCE_LENGTH)
+    args = ap.parse_args()
+    m = build_model_bundle(args.weights, pd.read_csv(args.fit_csv), args.out,
+                           args.version, args.sequence_length)
+    print(f"bundle {m['version']}: {len(m['features'])} features, seq {m['sequence_length']} -> {args.out}")
@@ -10,10 +10,10 @@ from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
 import pandas as pd
 from datetime import datetime
-import json
 
-from src.data_engine import DataEngine
-from src.modulation_engine import calculate_modulated_attribution
+from src.data_engine import DataEngine, StationHistoryStore
+from src.modulation_engine import calculate_modulated_attribution, upwind_fire_load
+from src.serialization import frame_to_records, to_jsonable, json_response
 
 
 app = Flask(__name__, static_folder='../dashboard', static_url_path='')
@@ -24,6 +24,7 @@ DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__
 STATION_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'raw', 'station_data')
 
 engine = None
+history_store = StationHistoryStore()
 
 def get_engine():
     global engine
@@ -51,17 +52,9 @@ def get_stations():
     Returns: List of stations with id, name, lat, lon, and metadata.
     """
     eng = get_engine()
-    stations = eng.stations.to_dict('records')
+    stations = frame_to_records(eng.stations)
     
-    # Convert numpy types to Python types
-    for s in stations:
-        for k, v in s.items():
-            if pd.isna(v):
-                s[k] = None
-            elif hasattr(v, 'item'):
-                s[k] = v.item()
-    
-    return jsonify({
+    return json_response({
         'count': len(stations),
         'stations': stations
     })
@@ -131,9 +124,17 @@ def calculate_attribution():
 
 
         
-        # Get fire count from data engine
-        fires_df = eng.get_fires(timestamp, lookback_hours=24)
-        fire_count = len(fires_df) if fires_df is not None else 0
+        # Get fires from data engine: count, plus FRP-weighted upwind load when wind is known
+        fire_load = None
+        if eng.fire_index is not None:
+            fires = eng.fire_index.arrays(timestamp - pd.Timedelta(hours=24), timestamp)
+            fire_count = len(fires['ts'])
+            load = upwind_fire_load(float(station['lat']), float(station['lon']),
+                                    fires['lat'], fires['lon'], fires['frp'], wind_dir)
+            fire_load = load['load']
+        else:
+            fires_df = eng.get_fires(timestamp, lookback_hours=24)
+            fire_count = len(fires_df) if fires_df is not None else 0
         
         # Calculate attribution using modulation engine
         result = calculate_modulated_attribution(
@@ -142,7 +143,8 @@ def calculate_attribution():
             wind_dir=wind_dir,
             wind_speed=wind_speed,
             blh=blh,
-            fire_count=fire_count
+            fire_count=fire_count,
+            fire_load=fire_load
         )
 
         # ============================
@@ -176,6 +178,8 @@ def calculate_attribution():
             'wind_dir': wind_dir,
             'wind_speed': wind_speed,
             'blh': blh,
+            'fire_count': fire_count,
+            'upwind_fire_load': round(fire_load, 1) if fire_load is not None else None,
             'blh_note': 'Low' if blh and blh < 300 else ('Moderate' if blh and blh < 700 else 'Good mixing')
         }
         
@@ -190,9 +194,7 @@ def calculate_attribution():
         result['confidence'] = 'High' if (has_wind and has_blh and has_readings) else ('Medium' if has_readings else 'Low')
         
         # Convert any numpy types
-        result = json.loads(json.dumps(result, default=str))
-        
-        return jsonify(result)
+        return json_response(to_jsonable(result))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -218,7 +220,8 @@ def calculate_modulated_attribution_endpoint():
         "wind_dir": 308,
         "wind_speed": 4.0,
         "blh": 300,
-        "fire_count": 150
+        "fire_count": 150,
+        "fire_load": 120       (optional, FRP-weighted upwind load; replaces the count)
     }
     """
     data = request.get_json()
@@ -232,6 +235,7 @@ def calculate_modulated_attribution_endpoint():
     wind_speed = data.get('wind_speed')
     blh = data.get('blh')
     fire_count = data.get('fire_count', 0)
+    fire_load = data.get('fire_load')
     
     if not timestamp_str:
         return jsonify({'error': 'timestamp is required'}), 400
@@ -246,13 +250,12 @@ def calculate_modulated_attribution_endpoint():
             wind_dir=wind_dir,
             wind_speed=wind_speed,
             blh=blh,
-            fire_count=fire_count
+            fire_count=fire_count,
+            fire_load=fire_load
         )
         
         # Convert any numpy types
-        result = json.loads(json.dumps(result, default=str))
-        
-        return jsonify(result)
+        return json_response(to_jsonable(result))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -278,54 +281,20 @@ def get_station_data(station_id):
         return jsonify({'error': f'Data file not found for station {station_id}'}), 404
     
     try:
-        df = pd.read_csv(filepath)
-        
-        # Find the timestamp column (could be 'timestamp', 'Local Time', etc.)
-        time_col = None
-        for col in ['timestamp', 'Local Time', 'Timestamp', 'datetime', 'Date']:
-            if col in df.columns:
-                time_col = col
-                break
-        
-        # Parse dates and filter
-        if time_col:
-            df['_parsed_time'] = pd.to_datetime(df[time_col], errors='coerce')
-            df = df.dropna(subset=['_parsed_time'])
+        # Parsed, time-sorted history (cached; reloaded if the file changes)
+        history = history_store.get(filepath)
         
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         limit = request.args.get('limit', 100, type=int)
         
-        if start_date and time_col:
-            start_dt = pd.to_datetime(start_date)
-            df = df[df['_parsed_time'].dt.date >= start_dt.date()]
-        if end_date and time_col:
-            end_dt = pd.to_datetime(end_date)
-            df = df[df['_parsed_time'].dt.date <= end_dt.date()]
-        
-        # Get records (tail if no date filter, otherwise head for chronological order)
-        if start_date or end_date:
-            df = df.head(limit)
-        else:
-            df = df.tail(limit)
-        
-        # Add parsed timestamp to output
-        if time_col and '_parsed_time' in df.columns:
-            df['timestamp'] = df['_parsed_time'].dt.strftime('%Y-%m-%dT%H:%M:%S')
-            df = df.drop(columns=['_parsed_time'])
+        # Dates are inclusive; head of the range, or the latest rows without one
+        df = history.query(start_date, end_date, limit)
         
         # Convert to records
-        records = df.to_dict('records')
-        for r in records:
-            for k, v in r.items():
-                if pd.isna(v):
-                    r[k] = None
-                elif hasattr(v, 'item'):
-                    r[k] = v.item()
-                elif isinstance(v, pd.Timestamp):
-                    r[k] = v.isoformat()
+        records = frame_to_records(df)
         
-        return jsonify({
+        return json_response({
             'station_id': int(station_id),
             'station_name': station['station_name'],
             'count': len(records),
@@ -386,23 +355,13 @@ def get_meteorology():
     timestamp = request.args.get('timestamp')
     
     if timestamp:
-        ts = pd.to_datetime(timestamp)
-        hour = ts.replace(minute=0, second=0, microsecond=0)
-        wind_data = eng.wind[eng.wind['timestamp'] == hour]
+        wind_data = eng.get_wind_rows(pd.to_datetime(timestamp))
     else:
         wind_data = eng.wind.tail(24)  # Last 24 hours
     
-    records = wind_data.to_dict('records')
-    for r in records:
-        for k, v in r.items():
-            if pd.isna(v):
-                r[k] = None
-            elif hasattr(v, 'item'):
-                r[k] = v.item()
-            elif isinstance(v, pd.Timestamp):
-                r[k] = v.isoformat()
+    records = frame_to_records(wind_data)
     
-    return jsonify({
+    return json_response({
         'count': len(records),
         'data': records
     })
@@ -441,17 +400,9 @@ def get_fires():
     else:
         return jsonify({'error': 'timestamp or date parameter required'}), 400
     
-    records = fires.to_dict('records')
-    for r in records:
-        for k, v in r.items():
-            if pd.isna(v):
-                r[k] = None
-            elif hasattr(v, 'item'):
-                r[k] = v.item()
-            elif isinstance(v, pd.Timestamp):
-                r[k] = v.isoformat()
+    records = frame_to_records(fires)
     
-    return jsonify({
+    return json_response({
         'mode': time_mode,
         'count': len(records),
         'fires': records
@@ -470,15 +421,9 @@ def get_industries():
         # Filter to significant industries
         major = eng.industries[eng.industries['emission_weight'] >= 15]
         
-        records = major.to_dict('records')
-        for r in records:
-            for k, v in r.items():
-                if pd.isna(v):
-                    r[k] = None
-                elif hasattr(v, 'item'):
-                    r[k] = v.item()
+        records = frame_to_records(major)
         
-        return jsonify({
+        return json_response({
             'count': len(records),
             'industries': records
         })
@@ -507,53 +452,54 @@ def get_station_industries(station_id):
     wind_dir = request.args.get('wind_direction', type=float)
     
     try:
-        # Calculate distance and contribution for each industry
-        industries_with_score = []
+        # Industries within 50km (precomputed per station), in table order
+        pos, distance_km, bearing = eng.industry_index.near_station(
+            station['station_id'], station_lat, station_lon)
+        ind = eng.industries
         
-        for _, ind in eng.industries.iterrows():
-            # Calculate distance
-            lat1, lon1 = np.radians(station_lat), np.radians(station_lon)
-            lat2, lon2 = np.radians(ind['latitude']), np.radians(ind['longitude'])
-            dlat, dlon = lat2 - lat1, lon2 - lon1
-            a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-            distance_km = 6371 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
-            
-            # Only include industries within 50km
-            if distance_km > 50:
-                continue
-            
-            # Calculate contribution score
-            emission_weight = ind.get('emission_weight', 10)
-            
-            # Distance decay (closer = higher contribution)
-            distance_factor = 1 / (1 + distance_km / 10)
-            
-            # Wind factor (if wind direction provided)
-            wind_factor = 1.0
-            if wind_dir is not None:
-                # Calculate bearing from industry to station
-                y = np.sin(lon1 - lon2) * np.cos(lat1)
-                x = np.cos(lat2) * np.sin(lat1) - np.sin(lat2) * np.cos(lat1) * np.cos(lon1 - lon2)
-                bearing = (np.degrees(np.arctan2(y, x)) + 360) % 360
-                
-                # Check if industry is upwind (wind blowing from industry toward station)
-                angle_diff = abs((wind_dir - bearing + 180) % 360 - 180)
-                if angle_diff < 45:
-                    wind_factor = 2.0  # Directly upwind
-                elif angle_diff < 90:
-                    wind_factor = 1.5  # Partially upwind
-            
-            # Combined contribution score
-            contribution_score = emission_weight * distance_factor * wind_factor
+        # Calculate contribution score
+        if 'emission_weight' in ind.columns:
+            emission_weight = ind['emission_weight'].to_numpy(dtype=np.float64)[pos]
+        else:
+            emission_weight = np.full(len(pos), 10.0)
+        
+        # Distance decay (closer = higher contribution)
+        distance_factor = 1 / (1 + distance_km / 10)
+        
+        # Wind factor (if wind direction provided): bearing is from industry to station,
+        # so a small angle means the wind blows from the industry toward the station
+        wind_factor = np.ones(len(pos))
+        if wind_dir is not None:
+            angle_diff = np.abs((wind_dir - bearing + 180) % 360 - 180)
+            wind_factor = np.where(angle_diff < 45, 2.0,          # Directly upwind
+                                   np.where(angle_diff < 90, 1.5, 1.0))  # Partially upwind
+        
+        # Combined contribution score, ranked on the reported (rounded) value
+        score = np.round(emission_weight * distance_factor * wind_factor, 1)
+        
+        # Top 10: argpartition, then order the candidates (ties keep table order)
+        top_n = 10
+        cand = np.arange(len(pos))
+        if len(pos) > top_n:
+            cut = score[np.argpartition(-score, top_n - 1)[:top_n]].min()
+            cand = np.flatnonzero(score >= cut)
+        top = cand[np.lexsort((cand, -score[cand]))][:top_n]
+        
+        name_col = 'name' if 'name' in ind.columns else 'industry_name' if 'industry_name' in ind.columns else None
+        cat_col = 'category' if 'category' in ind.columns else 'facility_type' if 'facility_type' in ind.columns else None
+        
+        industries_with_score = []
+        for i in top:
+            row = pos[i]
             
-            # Handle NaN values in name
-            name = ind.get('name', ind.get('industry_name', ''))
-            if pd.isna(name) or name == '' or name is None:
-                name = f"Industrial Unit #{len(industries_with_score) + 1}"
+            # Handle NaN values in name (numbered by position among nearby industries)
+            name = ind[name_col].iat[row] if name_col else ''
+            if pd.isna(name) or name == '':
+                name = f"Industrial Unit #{i + 1}"
             
             # Get category and format nicely (Light_Industry -> Light Industry)
-            category = ind.get('category', ind.get('facility_type', ''))
-            if pd.isna(category) or category == '' or category is None:
+            category = ind[cat_col].iat[row] if cat_col else ''
+            if pd.isna(category) or category == '':
                 category = 'Industrial'
             else:
                 category = str(category).replace('_', ' ')
@@ -561,23 +507,20 @@ def get_station_industries(station_id):
             industries_with_score.append({
                 'name': str(name),
                 'type': category,
-                'latitude': float(ind['latitude']),
-                'longitude': float(ind['longitude']),
-                'distance_km': round(distance_km, 1),
-                'emission_weight': float(emission_weight),
-                'contribution_score': round(contribution_score, 1),
-                'is_upwind': wind_factor > 1.0 if wind_dir else None
+                'latitude': float(eng.industry_index.lat[row]),
+                'longitude': float(eng.industry_index.lon[row]),
+                'distance_km': round(float(distance_km[i]), 1),
+                'emission_weight': float(emission_weight[i]),
+                'contribution_score': float(score[i]),
+                'is_upwind': bool(wind_factor[i] > 1.0) if wind_dir else None
             })
         
-        # Sort by contribution score (highest first)
-        industries_with_score.sort(key=lambda x: x['contribution_score'], reverse=True)
-        
         # Return top 10 contributors
         return jsonify({
             'station_id': int(station_id),
             'station_name': station['station_name'],
-            'count': len(industries_with_score[:10]),
-            'industries': industries_with_score[:10]
+            'count': len(industries_with_score),
+            'industries': industries_with_score
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -6,13 +6,18 @@ Modules:
 - data_engine: Data loading (stations, wind, fires, industries)
 - modulation_engine: Validated prior + modulation attribution
 - geo_utils: Geographic utilities
+- serialization: JSON-safe conversion of DataFrames and results for the API
 """
 from .data_engine import DataEngine
-from .modulation_engine import calculate_modulated_attribution
+from .modulation_engine import calculate_modulated_attribution, upwind_fire_load
+from .modulation_engine import calculate_modulated_attribution_batch, BatchAttribution
 from .geo_utils import haversine, bearing, angular_diff, is_upwind
+from .geo_utils import haversine_array, bearing_array, angular_diff_array, is_upwind_array
 
 __all__ = [
     'DataEngine',
-    'calculate_modulated_attribution',
+    'calculate_modulated_attribution', 'upwind_fire_load',
+    'calculate_modulated_attribution_batch', 'BatchAttribution',
     'haversine', 'bearing', 'angular_diff', 'is_upwind',
+    'haversine_array', 'bearing_array', 'angular_diff_array', 'is_upwind_array',
 ]
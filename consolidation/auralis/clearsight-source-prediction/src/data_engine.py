@@ -5,14 +5,301 @@ Data Engine - Handles data loading for attribution
 This module provides the DataEngine class that loads and manages:
 - Station metadata
 - Wind/meteorology data
-- Fire hotspot data
-- Industry locations
+- Fire hotspot data (time-sorted, indexed by time and grid cell)
+- Industry locations (KD-tree for radius queries, per-station neighbours)
+- Per-station history CSVs (parsed once, time-sorted, LRU-cached)
 
 The actual attribution calculations are done in modulation_engine.py.
 """
 
 import pandas as pd
+import numpy as np
 import os
+import threading
+from collections import OrderedDict
+from scipy.spatial import cKDTree
+
+try:
+    from .geo_utils import haversine_array, bearing_array
+except ImportError:
+    from geo_utils import haversine_array, bearing_array
+
+NS_PER_HOUR = 3_600_000_000_000
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+
+def _hour_number(ts) -> int:
+    """Whole hours since the epoch for a (naive, wall-clock) timestamp."""
+    t = pd.Timestamp(ts)
+    if t.tzinfo is not None:
+        t = t.tz_localize(None)
+    return t.value // NS_PER_HOUR
+
+
+class HourlyIndex:
+    """
+    O(1) row lookup for an hourly table by (key, hour).
+
+    pos[k, h] holds the position of the first row with key k whose timestamp
+    is exactly hour0 + h (rows off the full hour are not indexed, matching an
+    equality test against the floored hour), or -1 when there is none.
+    """
+
+    def __init__(self, timestamps: pd.Series, keys=None):
+        ns = timestamps.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        valid = (~timestamps.isna().to_numpy()) & (ns % NS_PER_HOUR == 0)
+        if keys is None:
+            codes = np.zeros(len(ns), dtype=np.int64)
+            self.keys = [None]
+        else:
+            codes, uniques = pd.factorize(pd.Series(keys))   # NaN keys -> -1
+            valid &= codes >= 0
+            self.keys = uniques.tolist()
+        self._key_pos = {k: i for i, k in enumerate(self.keys)}
+        rows = np.flatnonzero(valid)
+        hours = ns[rows] // NS_PER_HOUR
+        key_values = codes[rows].astype(np.int64)
+
+        self.hour0 = int(hours.min()) if len(hours) else 0
+        self.n_hours = int(hours.max()) - self.hour0 + 1 if len(hours) else 0
+        self.pos = np.full((len(self.keys), self.n_hours), -1, dtype=np.int32)
+        flat = key_values * self.n_hours + (hours - self.hour0)
+        cells, first = np.unique(flat, return_index=True)   # first row per (key, hour)
+        self.pos.ravel()[cells] = rows[first]
+
+    def lookup(self, hour: int, key=None) -> int:
+        """Row position for (key, hour number), or -1."""
+        k = self._key_pos.get(key)
+        h = hour - self.hour0
+        if k is None or h < 0 or h >= self.n_hours:
+            return -1
+        return int(self.pos[k, h])
+
+    def lookup_many(self, hours: np.ndarray, key=None) -> np.ndarray:
+        """Row positions for an array of hour numbers (-1 where missing)."""
+        hours = np.asarray(hours, dtype=np.int64)
+        out = np.full(len(hours), -1, dtype=np.int64)
+        k = self._key_pos.get(key)
+        if k is None:
+            return out
+        h = hours - self.hour0
+        ok = (h >= 0) & (h < self.n_hours)
+        out[ok] = self.pos[k, h[ok]]
+        return out
+
+    def rows_at(self, hour: int) -> np.ndarray:
+        """Positions of every key's row at this hour, in row order."""
+        h = hour - self.hour0
+        if h < 0 or h >= self.n_hours:
+            return np.empty(0, dtype=np.int64)
+        col = self.pos[:, h]
+        return np.sort(col[col >= 0]).astype(np.int64)
+
+
+FIRE_CELL_DEG = 0.5   # spatial bucket size of the fire index (degrees)
+
+
+class FireIndex:
+    """
+    Fire detections sorted by time as contiguous arrays (ts int64 ns, lat,
+    lon, frp), with binary-search time windows and a lat/lon grid-cell bucket
+    layer for "fires in this box within the last N hours" queries.
+
+    Positions refer to the time-sorted fire table the index was built from;
+    `timestamps` are that table's parsed timestamps, row for row (the table
+    keeps its original strings for output). Rows without a timestamp sort
+    last and are never returned.
+    """
+
+    def __init__(self, fires: pd.DataFrame, timestamps: pd.Series, cell_deg: float = FIRE_CELL_DEG):
+        ts = timestamps
+        self.n_valid = int(ts.notna().sum())
+        self.ts = ts.to_numpy(dtype='datetime64[ns]').astype(np.int64)[:self.n_valid]
+        self.lat = fires['latitude'].to_numpy(dtype=np.float64)[:self.n_valid]
+        self.lon = fires['longitude'].to_numpy(dtype=np.float64)[:self.n_valid]
+        frp = fires['frp'] if 'frp' in fires.columns else pd.Series(1.0, index=fires.index)
+        self.frp = np.nan_to_num(frp.to_numpy(dtype=np.float64)[:self.n_valid], nan=0.0)
+
+        # Buckets: per grid cell, that cell's positions in time order
+        self.cell_deg = cell_deg
+        row = np.floor(self.lat / cell_deg).astype(np.int64)
+        col = np.floor(self.lon / cell_deg).astype(np.int64)
+        cell = row * 100_000 + col
+        self._cell_order = np.argsort(cell, kind='stable')       # stable: keeps time order
+        cells, starts = np.unique(cell[self._cell_order], return_index=True)
+        ends = np.append(starts[1:], len(cell))
+        self._cells = {int(c): (int(a), int(b)) for c, a, b in zip(cells, starts, ends)}
+        self._cell_ts = self.ts[self._cell_order]
+
+    def window(self, start, end) -> slice:
+        """Positions with start <= ts <= end, as a slice."""
+        lo = np.searchsorted(self.ts, pd.Timestamp(start).value, side='left')
+        hi = np.searchsorted(self.ts, pd.Timestamp(end).value, side='right')
+        return slice(int(lo), int(hi))
+
+    def arrays(self, start, end) -> dict:
+        """Views of ts / lat / lon / frp for the fires in [start, end]."""
+        w = self.window(start, end)
+        return {'ts': self.ts[w], 'lat': self.lat[w], 'lon': self.lon[w], 'frp': self.frp[w]}
+
+    def query(self, start, end, lat_min: float, lat_max: float,
+              lon_min: float, lon_max: float) -> np.ndarray:
+        """
+        Sorted positions of fires in [start, end] inside the lat/lon box.
+        Only the grid cells overlapping the box are searched.
+        """
+        t0, t1 = pd.Timestamp(start).value, pd.Timestamp(end).value
+        d = self.cell_deg
+        parts = []
+        for r in range(int(np.floor(lat_min / d)), int(np.floor(lat_max / d)) + 1):
+            for c in range(int(np.floor(lon_min / d)), int(np.floor(lon_max / d)) + 1):
+                span = self._cells.get(r * 100_000 + c)
+                if span is None:
+                    continue
+                a, b = span
+                lo = a + np.searchsorted(self._cell_ts[a:b], t0, side='left')
+                hi = a + np.searchsorted(self._cell_ts[a:b], t1, side='right')
+                if hi > lo:
+                    parts.append(self._cell_order[lo:hi])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        pos = np.sort(np.concatenate(parts))
+        inside = ((self.lat[pos] >= lat_min) & (self.lat[pos] <= lat_max) &
+                  (self.lon[pos] >= lon_min) & (self.lon[pos] <= lon_max))
+        return pos[inside]
+
+
+INDUSTRY_RADIUS_KM = 50   # neighbourhood precomputed for every station
+EARTH_RADIUS_KM = 6371
+
+
+def _unit_vectors(lat, lon) -> np.ndarray:
+    """Lat/lon (degrees) -> points on the unit sphere, shape (n, 3)."""
+    phi = np.radians(np.asarray(lat, dtype=np.float64))
+    lam = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)])
+
+
+class IndustryIndex:
+    """
+    KD-tree over industry locations for "industries within R km" queries.
+
+    Points live on the unit sphere, where chord length grows monotonically
+    with great-circle distance, so a chord-radius ball query followed by an
+    exact haversine check gives the same set as a full scan. Results are
+    row positions in table order with the distance from the query point and
+    the bearing from each industry towards it.
+
+    Neighbourhoods of the monitoring stations (INDUSTRY_RADIUS_KM) are
+    computed once by precompute() and served from memory.
+    """
+
+    def __init__(self, industries: pd.DataFrame):
+        self.lat = industries['latitude'].to_numpy(dtype=np.float64)
+        self.lon = industries['longitude'].to_numpy(dtype=np.float64)
+        self.tree = cKDTree(_unit_vectors(self.lat, self.lon))
+        self._near = {}
+
+    def within(self, lat: float, lon: float, radius_km: float = INDUSTRY_RADIUS_KM):
+        """(positions, distance_km, bearing from industry to point) for industries within radius_km."""
+        theta = min(radius_km / EARTH_RADIUS_KM, np.pi)
+        chord = 2 * np.sin(theta / 2) * (1 + 1e-9)     # slack so the exact check decides the edge
+        pos = self.tree.query_ball_point(_unit_vectors([lat], [lon])[0], chord)
+        pos = np.sort(np.asarray(pos, dtype=np.intp))
+        dist = haversine_array(lat, lon, self.lat[pos], self.lon[pos])
+        keep = dist <= radius_km
+        pos, dist = pos[keep], dist[keep]
+        return pos, dist, bearing_array(self.lat[pos], self.lon[pos], lat, lon)
+
+    def precompute(self, stations: pd.DataFrame, radius_km: float = INDUSTRY_RADIUS_KM):
+        """Neighbour lists for every station, keyed by station_id."""
+        for sid, lat, lon in zip(stations['station_id'], stations['lat'], stations['lon']):
+            self._near[(sid, radius_km)] = self.within(lat, lon, radius_km)
+
+    def near_station(self, station_id, lat: float, lon: float,
+                     radius_km: float = INDUSTRY_RADIUS_KM):
+        """Precomputed neighbours of a station (computed and kept on first use otherwise)."""
+        key = (station_id, radius_km)
+        hit = self._near.get(key)
+        if hit is None:
+            hit = self._near[key] = self.within(lat, lon, radius_km)
+        return hit
+
+STATION_TIME_COLUMNS = ['timestamp', 'Local Time', 'Timestamp', 'datetime', 'Date']
+STATION_HISTORY_CACHE = int(os.environ.get('STATION_HISTORY_CACHE', 64))   # station files kept parsed
+
+
+def _day_start_ns(value) -> int:
+    """Midnight (wall clock) of the calendar date of value, as int64 ns."""
+    return pd.Timestamp(pd.to_datetime(value).date()).value
+
+
+class StationHistory:
+    """
+    One station's raw CSV, parsed once.
+
+    Rows whose time does not parse are dropped, the rest are sorted by time,
+    the output 'timestamp' column (%Y-%m-%dT%H:%M:%S) is precomputed, and
+    wall-clock times are kept as int64 ns so date ranges are binary searches.
+    Files without a recognised time column are kept as read.
+    """
+
+    def __init__(self, path: str):
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        df = pd.read_csv(path)
+        self.time_col = next((c for c in STATION_TIME_COLUMNS if c in df.columns), None)
+        self.t = None
+        if self.time_col:
+            parsed = pd.to_datetime(df[self.time_col], errors='coerce')
+            if parsed.dt.tz is not None:
+                parsed = parsed.dt.tz_localize(None)   # local wall clock, as the dates are compared
+            keep = parsed.notna().to_numpy()
+            wall = parsed.to_numpy(dtype='datetime64[ns]')[keep]
+            order = np.argsort(wall, kind='stable')
+            df = df[keep].iloc[order].reset_index(drop=True)
+            wall = wall[order]
+            df['timestamp'] = np.datetime_as_string(wall, unit='s').astype(object)
+            self.t = wall.astype(np.int64)
+        self.frame = df
+
+    def query(self, start_date=None, end_date=None, limit: int = 100) -> pd.DataFrame:
+        """
+        Rows whose date lies in [start_date, end_date] (both optional, inclusive).
+        The first `limit` rows of a date range, or the latest `limit` without one.
+        """
+        df = self.frame
+        if self.t is not None:
+            lo, hi = 0, len(df)
+            if start_date:
+                lo = int(np.searchsorted(self.t, _day_start_ns(start_date), side='left'))
+            if end_date:
+                hi = int(np.searchsorted(self.t, _day_start_ns(end_date) + NS_PER_DAY, side='left'))
+            df = df.iloc[lo:max(lo, hi)]
+        return df.head(limit) if (start_date or end_date) else df.tail(limit)
+
+
+class StationHistoryStore:
+    """LRU of StationHistory by file path; an entry is reloaded when the file's mtime changes."""
+
+    def __init__(self, max_entries: int = STATION_HISTORY_CACHE):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> StationHistory:
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            hist = self._items.get(path)
+            if hist is not None and hist.mtime_ns == mtime:
+                self._items.move_to_end(path)
+                return hist
+        hist = StationHistory(path)
+        with self._lock:
+            self._items[path] = hist
+            self._items.move_to_end(path)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return hist
 
 
 class DataEngine:
@@ -23,7 +310,7 @@ class DataEngine:
     - stations: CPCB monitoring station metadata
     - wind: ERA5 wind/BLH data (hourly)
     - fires: VIIRS fire hotspot data
-    - industries: Major pollution source locations
+    - industries: Major pollution source locations (spatial index in industry_index)
     """
     
     def __init__(self, industries_path: str, fires_path: str,
@@ -33,6 +320,14 @@ class DataEngine:
         self.industries = pd.read_csv(industries_path)
         self.fires = pd.read_csv(fires_path)
         self.fires['acq_date'] = pd.to_datetime(self.fires['acq_date'])
+        # Timestamps parsed once, for the index only (the 'timestamp' column
+        # keeps the CSV strings); table kept in time order so windows are slices
+        self.fire_index = None
+        if 'timestamp' in self.fires.columns:
+            fire_ts = pd.to_datetime(self.fires['timestamp'], errors='coerce')
+            order = fire_ts.sort_values(kind='stable', na_position='last').index
+            self.fires = self.fires.loc[order].reset_index(drop=True)
+            self.fire_index = FireIndex(self.fires, fire_ts.loc[order].reset_index(drop=True))
         self.stations = pd.read_csv(stations_path)
         
         # Load regional wind data
@@ -50,6 +345,18 @@ class DataEngine:
         except Exception as e:
             print(f"Note: Station wind data not loaded: {e}")
         
+        # (key, hour) -> row indexes, so wind lookups don't scan the tables
+        self.wind_index = HourlyIndex(self.wind['timestamp'], self.wind['wind_location'])
+        self.wind_any_index = HourlyIndex(self.wind['timestamp'])
+        self.station_wind_index = None
+        if self.station_wind is not None:
+            self.station_wind_index = HourlyIndex(self.station_wind['timestamp'],
+                                                  self.station_wind['station_id'])
+        
+        # Industry KD-tree and each station's neighbours within INDUSTRY_RADIUS_KM
+        self.industry_index = IndustryIndex(self.industries)
+        self.industry_index.precompute(self.stations)
+        
         print(f"Loaded: {len(self.stations)} stations, {len(self.industries)} industries, {len(self.fires)} fires")
     
     def get_station(self, name: str):
@@ -59,23 +366,24 @@ class DataEngine:
     
     def get_wind(self, timestamp, lat, lon, station_id=None):
         """Get wind data - prioritizes station-specific data, fallback to regional."""
-        hour = timestamp.replace(minute=0, second=0, microsecond=0)
+        hour = _hour_number(timestamp.replace(minute=0, second=0, microsecond=0))
         
         # Try station-specific wind data first
-        if self.station_wind is not None and station_id is not None:
-            station_wind = self.station_wind[
-                (self.station_wind['timestamp'] == hour) & 
-                (self.station_wind['station_id'] == station_id)
-            ]
-            if len(station_wind) > 0:
-                return station_wind.iloc[0]
+        if self.station_wind_index is not None and station_id is not None:
+            pos = self.station_wind_index.lookup(hour, station_id)
+            if pos >= 0:
+                return self.station_wind.iloc[pos]
         
         # Fallback to regional wind data
-        wind_hour = self.wind[self.wind['timestamp'] == hour]
-        if len(wind_hour) == 0:
-            return None
-        delhi = wind_hour[wind_hour['wind_location'] == 'Delhi']
-        return delhi.iloc[0] if len(delhi) > 0 else wind_hour.iloc[0]
+        pos = self.wind_index.lookup(hour, 'Delhi')
+        if pos < 0:
+            pos = self.wind_any_index.lookup(hour)
+        return self.wind.iloc[pos] if pos >= 0 else None
+    
+    def get_wind_rows(self, timestamp):
+        """All regional wind rows (one per location) for the hour of timestamp."""
+        hour = _hour_number(pd.Timestamp(timestamp).floor('h'))
+        return self.wind.iloc[self.wind_index.rows_at(hour)]
     
     def get_fires(self, dt, lookback_hours=48):
         """
@@ -87,9 +395,8 @@ class DataEngine:
         start_time = dt - pd.Timedelta(hours=lookback_hours)
         
         # Use timestamp column if available, otherwise fall back to date
-        if 'timestamp' in self.fires.columns:
-            fires_ts = pd.to_datetime(self.fires['timestamp'])
-            return self.fires[(fires_ts >= start_time) & (fires_ts <= end_time)]
+        if self.fire_index is not None:
+            return self.fires.iloc[self.fire_index.window(start_time, end_time)]
         else:
             # Fallback: get fires from that day and previous day
             dates = [dt.date(), (dt - pd.Timedelta(days=1)).date()]
@@ -97,17 +404,12 @@ class DataEngine:
     
     def get_fire_region_wind(self, timestamp):
         """Get wind data from fire source region (Punjab/Amritsar) for 2-point averaging."""
-        hour = timestamp.replace(minute=0, second=0, microsecond=0)
-        wind_hour = self.wind[self.wind['timestamp'] == hour]
-        if len(wind_hour) == 0:
-            return None
+        hour = _hour_number(timestamp.replace(minute=0, second=0, microsecond=0))
         # Prefer Amritsar (major Punjab fire region), fallback to Ludhiana
-        amritsar = wind_hour[wind_hour['wind_location'] == 'Amritsar']
-        if len(amritsar) > 0:
-            return amritsar.iloc[0]
-        ludhiana = wind_hour[wind_hour['wind_location'] == 'Ludhiana']
-        if len(ludhiana) > 0:
-            return ludhiana.iloc[0]
+        for location in ('Amritsar', 'Ludhiana'):
+            pos = self.wind_index.lookup(hour, location)
+            if pos >= 0:
+                return self.wind.iloc[pos]
         return None
 
 
@@ -2,9 +2,13 @@
 Geographic Utility Functions
 ============================
 Haversine distance, bearing calculation, upwind checks.
+
+Scalar versions use math; the *_array versions take NumPy arrays (or
+scalars, broadcast) and evaluate many points in one pass.
 """
 
 import math
+import numpy as np
 
 
 def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -88,6 +92,42 @@ def is_upwind(source_bearing: float, wind_direction: float, tolerance: float = 4
     return diff <= tolerance
 
 
+# =============================================================================
+# VECTORIZED VERSIONS
+# =============================================================================
+
+def haversine_array(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """haversine() over arrays (degrees in, km out)."""
+    R = 6371
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def bearing_array(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """bearing() over arrays: initial bearing from point 1 to point 2 (0-360°)."""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    x = np.sin(dlambda) * np.cos(phi2)
+    y = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlambda)
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
+
+
+def angular_diff_array(angle1, angle2) -> np.ndarray:
+    """angular_diff() over arrays (0-180°)."""
+    diff = np.abs(np.asarray(angle1) - np.asarray(angle2)) % 360
+    return np.where(diff > 180, 360 - diff, diff)
+
+
+def is_upwind_array(source_bearing, wind_direction, tolerance: float = 45) -> np.ndarray:
+    """is_upwind() over arrays: boolean mask of sources inside the upwind cone."""
+    return angular_diff_array(source_bearing, wind_direction) <= tolerance
+
+
 if __name__ == '__main__':
     # Test: Anand Vihar to Sangrur, Punjab
     dist = haversine(28.6469, 77.3164, 30.2331, 75.8406)
@@ -28,6 +28,11 @@ import numpy as np
 from datetime import datetime
 from typing import Dict, Optional, Union
 
+try:
+    from .geo_utils import haversine_array, bearing_array, is_upwind_array
+except ImportError:  # run as a script
+    from geo_utils import haversine_array, bearing_array, is_upwind_array
+
 # =============================================================================
 # VALIDATED BASELINES
 # =============================================================================
@@ -44,6 +49,13 @@ BASELINES = {
     'fires_stubble_season_avg': 193,  # Oct-Nov daily average - from data
     'fires_stubble_peak': 529,        # Peak day in stubble season - from data
     
+    # Upwind fire load baseline - computed from fires_combined.csv with the
+    # same cone and cutoff as upwind_fire_load (±45°, 600 km), from Delhi centre:
+    # Oct-Nov daily mean load, averaged over wind directions 250-340° (the NW
+    # sector the count path gates at 1.0; no per-day observed wind in the data).
+    # Individual directions: 300° ≈ 55, 315° ≈ 56, 330° ≈ 57, 270° ≈ 27
+    'fire_load_stubble_avg': 43,
+    
     # NO2 baselines - VERIFIED from IIT Kanpur 2016 study
     # Source: 1576211826iitk.pdf, Chapter 2, Section 2.4.7.2
     # Quote: "The overall average NO2 concentration estimated was 83µg/m3 for winter 
@@ -121,6 +133,45 @@ PRIORS = {
 # 22 + 12 + 15 + 22 + 26 + 4 = 101%
 # This is acceptable as original values have ± error ranges
 
+# =============================================================================
+# UPWIND FIRE LOAD
+# =============================================================================
+# Each fire counts as FRP / FIRE_FRP_REF "median fires", decayed with distance
+FIRE_FRP_REF = 4.23        # MW, median FRP in fires_combined.csv
+FIRE_DECAY_KM = 300        # e-folding distance of a fire's influence
+FIRE_MAX_KM = 600          # fires further away are ignored
+FIRE_UPWIND_TOLERANCE = 45 # degrees either side of the wind direction
+
+
+def upwind_fire_load(
+    station_lat: float, station_lon: float,
+    fire_lat: np.ndarray, fire_lon: np.ndarray, frp: np.ndarray,
+    wind_dir: Optional[float]
+) -> Dict:
+    """
+    FRP-weighted, distance-decayed load of the fires inside the station's
+    upwind cone, evaluated for all fires in one pass:
+
+        load = sum over upwind fires of (FRP / FIRE_FRP_REF) * exp(-d / FIRE_DECAY_KM)
+
+    Returns {'load', 'upwind_count', 'fire_count'}; load is None when the
+    wind direction is unknown.
+    """
+    fire_lat = np.asarray(fire_lat, dtype=np.float64)
+    n = len(fire_lat)
+    if wind_dir is None or n == 0:
+        return {'load': None if wind_dir is None else 0.0, 'upwind_count': 0, 'fire_count': n}
+    dist = haversine_array(station_lat, station_lon, fire_lat, fire_lon)
+    upwind = is_upwind_array(bearing_array(station_lat, station_lon, fire_lat, fire_lon),
+                             wind_dir, FIRE_UPWIND_TOLERANCE) & (dist <= FIRE_MAX_KM)
+    weights = np.asarray(frp, dtype=np.float64) / FIRE_FRP_REF * np.exp(-dist / FIRE_DECAY_KM)
+    return {
+        'load': float(weights[upwind].sum()),
+        'upwind_count': int(upwind.sum()),
+        'fire_count': n,
+    }
+
+
 # =============================================================================
 # MODULATION FACTOR CALCULATORS
 # =============================================================================
@@ -151,11 +202,15 @@ def calculate_traffic_modulation(no2: Optional[float], hour: int) -> tuple:
 
 
 def calculate_stubble_modulation(
-    fire_count: int, wind_dir: Optional[float], month: int
+    fire_count: int, wind_dir: Optional[float], month: int,
+    fire_load: Optional[float] = None
 ) -> tuple:
     """
     Stubble burning modulation based on fire count anomaly.
     Gated by: (1) month and (2) wind direction from NW.
+    
+    With fire_load (see upwind_fire_load) the per-fire upwind cone replaces
+    the NW wind gate and the load is compared with its own baseline.
     """
     # Seasonal gate - stubble is Oct-Nov primarily
     if month not in [10, 11]:
@@ -166,6 +221,14 @@ def calculate_stubble_modulation(
     else:
         season_factor = 1.0
     
+    if fire_load is not None:
+        baseline = BASELINES['fire_load_stubble_avg']
+        if fire_load <= 0:
+            return 0.0, "No upwind fires detected"
+        modulation = (fire_load / baseline) * season_factor
+        modulation = max(0.0, min(5.0, modulation))  # Cap at 5x (severe event)
+        return modulation, f"upwind fire load {fire_load:.0f} vs avg {baseline:.0f} (FRP-weighted)"
+    
     # Wind gate - must be from NW (Punjab direction)
     if wind_dir is None:
         wind_gate = 0.5  # Uncertain wind
@@ -388,10 +451,12 @@ def calculate_modulated_attribution(
     wind_dir: Optional[float],
     wind_speed: Optional[float],
     blh: Optional[float],
-    fire_count: int
+    fire_count: int,
+    fire_load: Optional[float] = None
 ) -> Dict:
     """
     Calculate source attribution using validated priors + modulation.
+    fire_load (optional) is the upwind fire load from upwind_fire_load().
     
     Returns normalized percentages that sum to 100%.
     """
@@ -415,7 +480,7 @@ def calculate_modulated_attribution(
     explanations['traffic'] = exp_traffic
     
     # Stubble burning
-    m_stubble, exp_stubble = calculate_stubble_modulation(fire_count, wind_dir, month)
+    m_stubble, exp_stubble = calculate_stubble_modulation(fire_count, wind_dir, month, fire_load)
     modulations['stubble_burning'] = m_stubble
     explanations['stubble_burning'] = exp_stubble
     
@@ -467,12 +532,196 @@ def calculate_modulated_attribution(
         'contributions': contributions,
         'baselines_used': {
             'blh_baseline': BASELINES[f'blh_{"winter" if month in [11,12,1,2] else "summer" if month in [3,4,5] else "monsoon"}_avg'],
-            'fires_baseline': BASELINES['fires_stubble_season_avg'],
+            'fires_baseline': BASELINES['fire_load_stubble_avg'] if fire_load is not None else BASELINES['fires_stubble_season_avg'],
             'no2_baseline': BASELINES['no2_rush_hour_avg'] if hour in [7,8,9,10,17,18,19,20] else BASELINES['no2_overall_avg'],
         }
     }
 
 
+# =============================================================================
+# BATCH ATTRIBUTION (time-series backfills)
+# =============================================================================
+# Same factors, caps and gates as the calculate_*_modulation functions above,
+# evaluated over whole arrays. A missing value is NaN (None in the scalar API).
+
+SOURCES = list(PRIORS.keys())
+_PRIOR_VECTOR = np.array([PRIORS[s] for s in SOURCES])
+
+
+def _lookup_table(size: int, default: float, groups) -> np.ndarray:
+    """Hour/month lookup table: table[i] = value for i in each group, else default."""
+    table = np.full(size, default, dtype=np.float64)
+    for idx, value in groups:
+        table[idx] = value
+    return table
+
+
+_WINTER = [11, 12, 1, 2]
+_SUMMER = [3, 4, 5]
+_NIGHT = [0, 1, 2, 3, 4, 5]
+
+_NO2_BASE_BY_HOUR = _lookup_table(24, BASELINES['no2_overall_avg'], [
+    ([7, 8, 9, 10, 17, 18, 19, 20], BASELINES['no2_rush_hour_avg']),
+    (_NIGHT, BASELINES['no2_night_avg'])])
+_LOCAL_HOUR_FACTOR = _lookup_table(24, 1.0, [([6, 7, 8, 19, 20, 21, 22], 1.3), (_NIGHT, 1.1)])
+_STUBBLE_SEASON = _lookup_table(13, 0.0, [([10, 11], 1.0), ([12, 1], 0.5)])
+_BLH_BASE_BY_MONTH = _lookup_table(13, BASELINES['blh_monsoon_avg'], [
+    (_WINTER, BASELINES['blh_winter_avg']), (_SUMMER, BASELINES['blh_summer_avg'])])
+_PM25_BASE_BY_MONTH = _lookup_table(13, BASELINES['pm25_monsoon_avg'], [
+    (_WINTER, BASELINES['pm25_winter_avg']), ([10], BASELINES['pm25_postmonsoon_avg']),
+    (_SUMMER, BASELINES['pm25_summer_avg'])])
+_PM10_BASE_BY_MONTH = _lookup_table(13, BASELINES['pm10_monsoon_avg'], [
+    (_WINTER, BASELINES['pm10_winter_avg']), ([10], BASELINES['pm10_postmonsoon_avg']),
+    (_SUMMER, BASELINES['pm10_summer_avg'])])
+_WINTER_FACTOR = _lookup_table(13, 1.0, [(_WINTER, 1.2)])
+
+
+class BatchAttribution:
+    """
+    Result of calculate_modulated_attribution_batch() for T rows.
+
+    contributions  (T, 6) normalized percentages, columns in SOURCES order
+    modulation     (T, 6) modulation factors
+
+    Explanation strings are only built for the rows asked for (explain / row).
+    """
+
+    sources = SOURCES
+
+    def __init__(self, modulation: np.ndarray, contributions: np.ndarray, inputs: Dict[str, np.ndarray]):
+        self.modulation = modulation
+        self.contributions = contributions
+        self._inputs = inputs
+
+    def __len__(self) -> int:
+        return len(self.contributions)
+
+    def to_frame(self, index=None) -> pd.DataFrame:
+        """Percentages as a DataFrame with one column per source."""
+        return pd.DataFrame(self.contributions, columns=SOURCES, index=index)
+
+    def explain(self, i: int) -> Dict[str, str]:
+        """Explanations for row i (same text as calculate_modulated_attribution)."""
+        v = {k: a[i] for k, a in self._inputs.items()}
+        opt = lambda x: None if np.isnan(x) else float(x)
+        hour, month = int(v['hour']), int(v['month'])
+        pm25, pm10, wind_speed = opt(v['pm25']), opt(v['pm10']), opt(v['wind_speed'])
+        return {
+            'traffic': calculate_traffic_modulation(opt(v['no2']), hour)[1],
+            'industry': calculate_industry_modulation(opt(v['so2']))[1],
+            'dust': calculate_dust_modulation(pm25, pm10, wind_speed)[1],
+            'stubble_burning': calculate_stubble_modulation(
+                int(v['fire_count']), opt(v['wind_dir']), month, opt(v['fire_load']))[1],
+            'secondary_aerosols': calculate_secondary_modulation(opt(v['blh']), month)[1],
+            'local_combustion': calculate_local_combustion_modulation(
+                hour, month, opt(v['co']), pm25, pm10, wind_speed)[1],
+        }
+
+    def row(self, i: int) -> Dict:
+        """Row i in the 'contributions' format of calculate_modulated_attribution."""
+        explanations = self.explain(i)
+        out = {}
+        for j, source in enumerate(SOURCES):
+            percentage = float(self.contributions[i, j])
+            out[source] = {
+                'percentage': round(percentage, 1),
+                'modulation_factor': round(float(self.modulation[i, j]), 2),
+                'prior': PRIORS[source] * 100,
+                'explanation': explanations[source],
+                'level': 'High' if percentage > 25 else ('Medium' if percentage > 15 else 'Low')
+            }
+        return out
+
+
+def calculate_modulated_attribution_batch(
+    hour, month,
+    pm25=None, pm10=None, no2=None, so2=None, co=None,
+    wind_dir=None, wind_speed=None, blh=None,
+    fire_count=0, fire_load=None
+) -> BatchAttribution:
+    """
+    calculate_modulated_attribution() over arrays of T timestamps/readings.
+
+    hour (0-23) and month (1-12) are integer arrays; every other argument is
+    an array, a scalar (broadcast) or None (missing for all rows). fire_load
+    rows that are NaN fall back to the fire count + NW wind gate, as when the
+    scalar version gets fire_load=None.
+    """
+    hour = np.atleast_1d(np.asarray(hour, dtype=np.intp))
+    month = np.atleast_1d(np.asarray(month, dtype=np.intp))
+    T = len(hour)
+
+    def col(x):
+        if x is None:
+            return np.full(T, np.nan)
+        return np.broadcast_to(np.asarray(x, dtype=np.float64), (T,))
+
+    pm25, pm10, no2, so2, co = col(pm25), col(pm10), col(no2), col(so2), col(co)
+    wind_dir, wind_speed, blh = col(wind_dir), col(wind_speed), col(blh)
+    fire_count, fire_load = col(fire_count), col(fire_load)
+
+    M = np.empty((T, len(SOURCES)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Traffic: NO2 vs hour-of-day baseline
+        M[:, SOURCES.index('traffic')] = np.where(
+            np.isnan(no2), 1.0, np.clip(no2 / _NO2_BASE_BY_HOUR[hour], 0.3, 3.0))
+
+        # Industry: SO2 vs baseline
+        M[:, SOURCES.index('industry')] = np.where(
+            np.isnan(so2), 1.0, np.clip(so2 / BASELINES['so2_avg'], 0.3, 3.0))
+
+        # Dust: PM2.5/PM10 ratio, boosted by wind above 5
+        ratio_mod = BASELINES['pm_ratio_avg'] / np.maximum(pm25 / pm10, 0.2)
+        wind_mod = np.where(wind_speed > 5, 1.0 + (wind_speed - 5) * 0.1, 1.0)
+        has_ratio = ~np.isnan(pm25) & ~np.isnan(pm10) & (pm10 != 0)
+        M[:, SOURCES.index('dust')] = np.where(has_ratio, np.clip(ratio_mod * wind_mod, 0.3, 3.0), 1.0)
+
+        # Stubble: seasonal gate, then upwind fire load or fire count + NW wind gate
+        season = _STUBBLE_SEASON[month]
+        wind_gate = np.select(
+            [np.isnan(wind_dir),
+             (wind_dir >= 250) & (wind_dir <= 340),
+             ((wind_dir >= 200) & (wind_dir < 250)) | ((wind_dir > 340) & (wind_dir <= 360))],
+            [0.5, 1.0, 0.5], default=0.0)
+        m_count = np.where(fire_count == 0, 0.0, np.clip(
+            fire_count / BASELINES['fires_stubble_season_avg'] * season * wind_gate, 0.0, 5.0))
+        m_load = np.where(fire_load <= 0, 0.0, np.clip(
+            fire_load / BASELINES['fire_load_stubble_avg'] * season, 0.0, 5.0))
+        m_stubble = np.where(np.isnan(fire_load), m_count, m_load)
+        M[:, SOURCES.index('stubble_burning')] = np.where(season == 0, 0.0, m_stubble)
+
+        # Secondary: seasonal BLH baseline / BLH (floored at 150 m)
+        has_blh = ~np.isnan(blh) & (blh > 0)
+        M[:, SOURCES.index('secondary_aerosols')] = np.where(
+            has_blh, np.clip(_BLH_BASE_BY_MONTH[month] / np.maximum(150, blh), 0.5, 2.0), 1.0)
+
+        # Local combustion: fireworks signature, else mean PM index x hour x winter x CO
+        pm25_base = _PM25_BASE_BY_MONTH[month]
+        has25, has10 = ~np.isnan(pm25), ~np.isnan(pm10)
+        fireworks = (has25 & (pm25 > 500) & has10 & (pm10 > 0) & (pm25 / pm10 > 0.75)
+                     & (co > 2.0) & ~(wind_speed >= 3.0))
+        n_pm = has25.astype(np.int64) + has10
+        pm_sum = (np.where(has25, pm25 / pm25_base, 0.0)
+                  + np.where(has10, pm10 / _PM10_BASE_BY_MONTH[month], 0.0))
+        base = np.where(n_pm > 0, pm_sum / np.maximum(n_pm, 1), 1.0)
+        base = base * _LOCAL_HOUR_FACTOR[hour]
+        base = base * _WINTER_FACTOR[month]
+        base = base * np.where(np.isnan(co), 1.0, np.minimum(co / 1.5, 2.0))
+        M[:, SOURCES.index('local_combustion')] = np.where(
+            fireworks, np.minimum(25.0, pm25 / pm25_base), np.clip(base, 0.3, 10.0))
+
+    # Apply modulation to priors and normalize to 100%
+    weighted = M * _PRIOR_VECTOR
+    total = weighted.sum(axis=1)
+    total[total == 0] = 1  # Prevent division by zero
+    contributions = weighted / total[:, None] * 100
+
+    inputs = {'hour': hour, 'month': month, 'pm25': pm25, 'pm10': pm10, 'no2': no2,
+              'so2': so2, 'co': co, 'wind_dir': wind_dir, 'wind_speed': wind_speed,
+              'blh': blh, 'fire_count': fire_count, 'fire_load': fire_load}
+    return BatchAttribution(M, contributions, inputs)
+
+
 # =============================================================================
 # TEST FUNCTION
 # =============================================================================
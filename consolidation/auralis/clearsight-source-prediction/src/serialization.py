@@ -0,0 +1,125 @@
+"""
+JSON Serialization - DataFrames and results to JSON-safe Python
+================================================================
+
+Shared by the API endpoints. DataFrames are converted column by column
+(one NumPy pass per column instead of per-cell checks):
+- NaN / NaT / None -> null
+- datetime columns -> ISO 8601 strings
+- NumPy scalars -> Python int / float / bool
+
+Responses are encoded compactly and streamed in blocks of rows, so large
+/fires and /station/<id>/data payloads are never held as one string.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+from flask import Response
+
+JSON_CHUNK_ROWS = 2000   # records per streamed block
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=lambda o: to_jsonable(o, strict=True))
+
+
+def _datetime_values(s: pd.Series) -> list:
+    """Datetime column -> ISO strings (Timestamp.isoformat() format), NaT -> None."""
+    if s.dt.tz is None:
+        arr = s.to_numpy(dtype='datetime64[ns]')
+        ns = arr.astype(np.int64)
+        mask = np.isnat(arr)
+        if not (ns[~mask] % 1_000_000_000).any():
+            out = np.datetime_as_string(arr, unit='s').astype(object)
+            out[mask] = None
+            return out.tolist()
+    return [None if pd.isna(v) else v.isoformat() for v in s]
+
+
+def column_values(s: pd.Series) -> list:
+    """One DataFrame column as a list of JSON-safe Python values."""
+    kind = s.dtype.kind
+    if kind == 'M':
+        return _datetime_values(s)
+    if kind in 'iub':
+        return s.to_numpy().tolist()
+    if kind == 'f':
+        arr = s.to_numpy()
+        mask = np.isnan(arr)
+        if not mask.any():
+            return arr.tolist()
+        out = arr.astype(object)
+        out[mask] = None
+        return out.tolist()
+    # object / string / categorical / extension: check the nulls column-wise,
+    # unwrap NumPy scalars and timestamps that ended up in object cells
+    mask = s.isna().to_numpy()
+    values = s.to_numpy(dtype=object, copy=True)
+    values[mask] = None
+    return [to_jsonable(v) if isinstance(v, (np.generic, pd.Timestamp)) else v for v in values]
+
+
+def frame_to_records(df: pd.DataFrame) -> list:
+    """DataFrame -> list of row dicts with JSON-safe values (column order kept)."""
+    cols = [str(c) for c in df.columns]
+    data = [column_values(df.iloc[:, i]) for i in range(df.shape[1])]
+    return [dict(zip(cols, row)) for row in zip(*data)] if cols else [{} for _ in range(len(df))]
+
+
+def to_jsonable(obj, strict: bool = False):
+    """
+    Nested result (dicts, lists, NumPy/pandas scalars) -> JSON-safe Python.
+    NaN becomes null. Unknown objects fall back to str() unless strict.
+    """
+    if obj is None or isinstance(obj, (str, bool, int)):
+        return obj
+    if isinstance(obj, float):
+        return None if obj != obj else obj
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v, strict) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v, strict) for v in obj]
+    if isinstance(obj, pd.DataFrame):
+        return frame_to_records(obj)
+    if isinstance(obj, pd.Series):
+        return [to_jsonable(v, strict) for v in column_values(obj)]
+    if isinstance(obj, np.ndarray):
+        return to_jsonable(obj.tolist(), strict)
+    if obj is pd.NaT or (isinstance(obj, np.datetime64) and np.isnat(obj)):
+        return None
+    if isinstance(obj, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(obj).isoformat()
+    if isinstance(obj, np.generic):
+        return to_jsonable(obj.item(), strict)
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if strict:
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return str(obj)
+
+
+def _chunks(payload):
+    """
+    Encode with the C encoder one block of rows at a time: long lists at the
+    top level of the payload are split into JSON_CHUNK_ROWS-row slices.
+    """
+    if not isinstance(payload, dict):
+        yield _encoder.encode(payload)
+        return
+    sep = '{'
+    for key, value in payload.items():
+        yield sep + _encoder.encode(str(key)) + ':'
+        sep = ','
+        if isinstance(value, list) and len(value) > JSON_CHUNK_ROWS:
+            for i in range(0, len(value), JSON_CHUNK_ROWS):
+                block = _encoder.encode(value[i:i + JSON_CHUNK_ROWS])
+                yield ('[' if i == 0 else ',') + block[1:-1]
+            yield ']'
+        else:
+            yield _encoder.encode(value)
+    yield '{}' if sep == '{' else '}'
+
+
+def json_response(payload, status: int = 200) -> Response:
+    """Compact, streamed application/json response for an already JSON-safe payload."""
+    return Response(_chunks(payload), status=status, mimetype='application/json')